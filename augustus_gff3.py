@@ -0,0 +1,83 @@
+#!/usr/bin/env python2
+
+'''
+Extract protein sequences from AUGUSTUS GFF3 output
+
+AUGUSTUS (and BRAKER, which runs AUGUSTUS) writes the predicted protein of
+each transcript as comment lines after its features:
+
+    scaffold_1  AUGUSTUS  transcript  ...  ID=g1.t1;Parent=g1
+    ...
+    # protein sequence = [MSTRKLLSAVLL...
+    # GQWETAHRLL...]
+    # Evidence for and against this transcript:
+    # % of transcript supported by hints (any source): 0
+    ...
+
+The file is read in one pass with a single tokenizer; other comment lines
+(hint evidence of BRAKER output) are skipped, and each protein is written as
+soon as its block ends. With by_gene_number (run_augustus.py), proteins are
+held in memory and written in gene number order (g1.t1, g1.t2, g2.t1, ...)
+instead.
+'''
+
+# Import modules
+import re
+
+# Parameters
+line_width = 60
+
+# Transcript (or mRNA) line, start of protein block and continuation of
+# protein block
+reg_token = re.compile(
+    r'^(?:'
+    r'[^#\t][^\t]*\t[^\t]*\t(?:transcript|mRNA)\t(?:[^\t]*\t){5}'
+    r'(?:[^\t]*;)?ID=(?P<transcript_id>[^;\t\s]+)'
+    r'|# protein sequence = \[(?P<start>[A-Za-z*]*)(?P<start_end>\])?\s*$'
+    r'|# (?P<cont>[A-Za-z*]+)(?P<cont_end>\])?\s*$'
+    r')'
+)
+reg_gene_number = re.compile(r'g(\d+)\.t\d+$')
+
+
+def iter_proteins(gff3_file):
+    # Yield (transcript_id, protein sequence) in file order
+    transcript_id = None
+    fragments = None  # Not None while inside a protein block
+    with open(gff3_file) as f_in:
+        for line in f_in:
+            m_token = reg_token.match(line)
+            if not m_token:
+                continue
+
+            if m_token.group('transcript_id'):
+                transcript_id = m_token.group('transcript_id')
+                fragments = None
+            elif m_token.group('start') is not None:
+                fragments = [m_token.group('start')]
+                if m_token.group('start_end'):
+                    yield transcript_id, ''.join(fragments)
+                    fragments = None
+            elif fragments is not None:
+                fragments.append(m_token.group('cont'))
+                if m_token.group('cont_end'):
+                    yield transcript_id, ''.join(fragments)
+                    fragments = None
+
+
+def get_gene_number(transcript_id):
+    return int(reg_gene_number.search(transcript_id).group(1))
+
+
+def write_proteins(gff3_file, output_faa, by_gene_number=False):
+    proteins = iter_proteins(gff3_file)
+    if by_gene_number:
+        # Transcripts of a gene keep their file order
+        proteins = sorted(proteins, key=lambda x: get_gene_number(x[0]))
+
+    outhandle = open(output_faa, 'w')
+    for transcript_id, prot_seq in proteins:
+        outhandle.write('>{}\n'.format(transcript_id))
+        for i in xrange(0, len(prot_seq), line_width):
+            outhandle.write('{}\n'.format(prot_seq[i:i + line_width]))
+    outhandle.close()
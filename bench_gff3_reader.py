@@ -0,0 +1,148 @@
+#!/usr/bin/env python2
+
+'''
+Benchmark GFF3 parsing for catch_bad_genes.py: BCBio GFF.parse (the former
+path, optionally with the genome attached as base_dict) against the
+streaming reader (gff3_reader.py)
+
+Each parser reads all GFF3 files in its own process, collecting the CDS
+coordinates and phases of every mRNA; wall time and peak memory (maximum
+resident set size) are reported, and the two results are compared.
+
+Input: GFF3 files of a run (e.g. augustus, maker and braker1 output) and
+       optionally the genome assembly
+Output: table on standard output
+'''
+
+# Import modules
+import os
+import sys
+import time
+import resource
+from multiprocessing import Pool
+from argparse import ArgumentParser
+
+this_path = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_path)
+sys.path.append(this_dir)
+from gff3_reader import iter_mrnas
+
+
+# Main function
+def main(argv):
+    argparse_usage = (
+        'bench_gff3_reader.py -g <gff3_files> [-a <genome_assembly>]'
+    )
+    parser = ArgumentParser(usage=argparse_usage)
+    parser.add_argument(
+        '-g', '--gff3_files', nargs='+', required=True,
+        help='Input GFF3 files'
+    )
+    parser.add_argument(
+        '-a', '--genome_assembly', nargs='?', default=None,
+        help='Genome assembly, given to BCBio as base_dict'
+    )
+    parser.add_argument(
+        '-r', '--repeats', nargs='?', default=1, type=int,
+        help='Number of runs of each parser (default: 1)'
+    )
+
+    args = parser.parse_args()
+    gff3_files = [os.path.abspath(x) for x in args.gff3_files]
+    if args.genome_assembly:
+        genome_assembly = os.path.abspath(args.genome_assembly)
+    else:
+        genome_assembly = None
+
+    # Run functions :)
+    run_benchmark(gff3_files, genome_assembly, args.repeats)
+
+
+def parse_bcbio(gff3_files, genome_assembly):
+    # Returns D_cds (key: (prefix, mRNA ID), value: (scaffold, strand,
+    # sorted CDS list))
+    from BCBio import GFF
+    from Bio import SeqIO
+
+    seq_dict = None
+    if genome_assembly:
+        seq_dict = SeqIO.to_dict(SeqIO.parse(genome_assembly, 'fasta'))
+
+    D_cds = {}
+    for gff3_file in gff3_files:
+        prefix = os.path.basename(os.path.splitext(gff3_file)[0])
+        in_handle = open(gff3_file)
+        for rec in GFF.parse(in_handle, base_dict=seq_dict):
+            for gene_feature in rec.features:
+                for mrna_feature in gene_feature.sub_features:
+                    cds_list = sorted(
+                        (
+                            int(x.location.start) + 1, int(x.location.end),
+                            x.qualifiers['phase'][0]
+                        )
+                        for x in mrna_feature.sub_features if x.type == 'CDS'
+                    )
+                    strand = '-' if mrna_feature.strand == -1 else '+'
+                    D_cds[(prefix, mrna_feature.id)] = (
+                        rec.id, strand, cds_list
+                    )
+        in_handle.close()
+    return D_cds
+
+
+def parse_stream(gff3_files, genome_assembly):
+    # Same result with gff3_reader.py; the genome is not needed
+    D_cds = {}
+    for gff3_file in gff3_files:
+        prefix = os.path.basename(os.path.splitext(gff3_file)[0])
+        for scaffold, mrna_id, strand, cds_list in iter_mrnas(gff3_file):
+            D_cds[(prefix, mrna_id)] = (scaffold, strand, sorted(cds_list))
+    return D_cds
+
+
+def run_parser(args):
+    # Run in a fresh worker process, so peak memory is the parser's own
+    parser_name, gff3_files, genome_assembly = args
+    func = {'bcbio': parse_bcbio, 'stream': parse_stream}[parser_name]
+    start_time = time.time()
+    D_cds = func(gff3_files, genome_assembly)
+    wall_time = time.time() - start_time
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KB
+    return wall_time, max_rss, D_cds
+
+
+def run_benchmark(gff3_files, genome_assembly, repeats):
+    D_result = {}
+    print '{}\t{}\t{}\t{}'.format('parser', 'run', 'wall_time(s)', 'max_rss(MB)')
+    for parser_name in ('bcbio', 'stream'):
+        for run_i in range(repeats):
+            pool = Pool(1, maxtasksperchild=1)
+            try:
+                wall_time, max_rss, D_cds = pool.apply(
+                    run_parser, ((parser_name, gff3_files, genome_assembly),)
+                )
+            finally:
+                pool.close()
+                pool.join()
+            print '{}\t{}\t{:.2f}\t{:.1f}'.format(
+                parser_name, run_i + 1, wall_time, max_rss / 1024.0
+            )
+            D_result[parser_name] = D_cds
+
+    # Compare mRNAs with CDS
+    D_bcbio = dict((k, v) for k, v in D_result['bcbio'].items() if v[2])
+    D_stream = dict((k, v) for k, v in D_result['stream'].items() if v[2])
+    if D_bcbio == D_stream:
+        print '# Same CDSs of {} mRNAs'.format(len(D_stream))
+    else:
+        diff_keys = set(D_bcbio) ^ set(D_stream) | set(
+            x for x in set(D_bcbio) & set(D_stream)
+            if D_bcbio[x] != D_stream[x]
+        )
+        print '# [WARNING] Parsers differ on {} mRNAs, e.g. {}'.format(
+            len(diff_keys), sorted(diff_keys)[:5]
+        )
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
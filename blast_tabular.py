@@ -0,0 +1,80 @@
+#!/usr/bin/env python2
+
+'''
+Streaming parser of BLAST tabular output
+(outfmt "6 qseqid sseqid length qlen slen bitscore")
+
+The output is read in large blocks and split into lines as it goes, so the
+raw text is never held as a whole; gzipped output (by the .gz suffix or the
+gzip magic bytes) is read directly. Each hit is scored by its bit score
+weighted by query and subject coverage, and reduced on the fly:
+    - top_hits: score of the first (best) hit of each query (import_blastp)
+    - sum_hits: running sum of rounded scores per query (import_blastn)
+'''
+
+# Import modules
+from __future__ import division
+import gzip
+
+# Parameters
+block_size = 1 << 22  # 4 MB
+
+
+def open_blast(blast_file):
+    with open(blast_file, 'rb') as f_in:
+        magic = f_in.read(2)
+    if blast_file.endswith('.gz') or magic == '\x1f\x8b':
+        return gzip.open(blast_file, 'rb')
+    return open(blast_file, 'rb')
+
+
+def iter_lines(blast_file):
+    f_in = open_blast(blast_file)
+    rest = ''
+    while True:
+        block = f_in.read(block_size)
+        if not block:
+            break
+        lines = (rest + block).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    f_in.close()
+    if rest:
+        yield rest
+
+
+def iter_hits(blast_file):
+    # Yield (query, coverage-weighted bit score) in file order
+    for line in iter_lines(blast_file):
+        line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+        line_split = line.split('\t')
+        alignment_length = int(line_split[2])
+        qlen = int(line_split[3])
+        slen = int(line_split[4])
+        bit_score = float(line_split[5])
+
+        q_cov = min(1.0, alignment_length / qlen)
+        s_cov = min(1.0, alignment_length / slen)
+        yield line_split[0], bit_score * q_cov * s_cov
+
+
+def top_hits(blast_file):
+    # Yield (query, score) of the first hit of each query; BLAST reports
+    # hits of a query in order of significance
+    done = set()
+    for query, score in iter_hits(blast_file):
+        if query in done:
+            continue
+        done.add(query)
+        yield query, score
+
+
+def sum_hits(blast_file, D_sum, key_func=None):
+    # Add rounded scores of all hits to D_sum (keyed by key_func(query))
+    for query, score in iter_hits(blast_file):
+        key = key_func(query) if key_func else query
+        D_sum[key] += round(score, 1)
+    return D_sum
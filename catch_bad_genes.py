@@ -5,6 +5,22 @@ Catch bad genes for given gff3 files
   1) Stop codon in the middle of proteins
   2) Check if translation consists of more than 50% X residues
   3) Check if feature begins or ends in gap
+  4) Check if an intron is shorter than 10 bp
+
+mRNAs are streamed from each GFF3 (gff3_reader.py) and checked in batches
+with NumPy. The genome (the mmap of the
+indexed assembly, genome_index.py) is viewed as a uint8 array, the CDS
+bases of all models of a batch are gathered into one array by offset
+arithmetic, reverse complemented and trimmed by phase per model, and
+translated through a codon lookup table. Bases are encoded as IUPAC codes,
+and the table gives for an ambiguous codon what Biopython's translate()
+gives for it (an amino acid, B/Z/J, X or *).
+
+With --num_cores > 1, GFF3 files are checked in a process pool; when there
+are more cores than files, each file is also split into groups of scaffolds
+of similar total length. Workers are forked after the genome is opened, so
+they share its read-only mapping. Bad genes and counts of all jobs are
+merged at the end.
 
 Input: multiple gff3s
 Output: pickle for filter_gff3s_ver3.py
@@ -14,13 +30,40 @@ Output: pickle for filter_gff3s_ver3.py
 from __future__ import division
 import sys
 import os
-import re
-import operator
 import cPickle
+from itertools import product
+from multiprocessing import Pool
 from collections import defaultdict
 from argparse import ArgumentParser
-from BCBio import GFF
-from Bio import SeqIO
+import numpy as np
+
+this_path = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_path)
+sys.path.append(this_dir)
+from genome_index import open_genome, get_entry, seq_names, seq_length
+from fasta_shards import balance_shards
+from gff3_reader import iter_mrnas
+
+# Parameters
+batch_bases = 1 << 20  # CDS bases translated at once
+min_intron_len = 10
+iupac_codes = 'ACGTRYSWKMBDHVN'  # Code 15: any other letter
+D_iupac = {
+    'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T', 'R': 'AG', 'Y': 'CT',
+    'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC', 'B': 'CGT', 'D': 'AGT',
+    'H': 'ACT', 'V': 'ACG', 'N': 'ACGT'
+}
+D_complement = {
+    'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'R': 'Y', 'Y': 'R', 'S': 'S',
+    'W': 'W', 'K': 'M', 'M': 'K', 'B': 'V', 'D': 'H', 'H': 'D', 'V': 'B',
+    'N': 'N'
+}
+# Standard code (NCBI table 1), codons in TCAG order
+standard_aas = (
+    'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG'
+)
+n_code = iupac_codes.index('N')
+D_worker = {}  # Genome, tables and scaffold groups inherited by workers
 
 
 # Main function
@@ -42,15 +85,24 @@ def main(argv):
         '-o', '--output_dir', nargs='?', default='gene_filtering',
         help='Output directory'
     )
+    parser.add_argument(
+        '-c', '--num_cores', nargs='?', default=1, type=int,
+        help='Number of cores to be used (default: 1)'
+    )
 
     args = parser.parse_args()
     gff3_files = [os.path.abspath(x) for x in args.gff3_files]
     genome_assembly_file = os.path.abspath(args.genome_assembly[0])
     output_dir = os.path.abspath(args.output_dir)
+    num_cores = args.num_cores
 
     # Run functions :) Slow is as good as Fast
     create_dir(output_dir)
-    catch_middle_stop(gff3_files, genome_assembly_file, output_dir)
+    output_pickle = os.path.join(output_dir, 'D_bad.p')
+    catch_middle_stop(
+        gff3_files, genome_assembly_file, output_dir, output_pickle,
+        num_cores
+    )
 
 
 def create_dir(output_dir):
@@ -58,86 +110,53 @@ def create_dir(output_dir):
         os.mkdir(output_dir)
 
 
-def catch_middle_stop(gff3_files, genome_assembly_file, output_dir):
+def catch_middle_stop(
+    gff3_files, genome_assembly_file, output_dir, output_pickle=None,
+    num_cores=1
+):
     D_bad = defaultdict(bool)
     D_stop = defaultdict(int)
     D_toomanyX = defaultdict(int)
     D_gap = defaultdict(int)
     D_intron = defaultdict(int)
-    for gff3_file in gff3_files:
+    D_genome = open_genome(genome_assembly_file)
+    D_tables = make_tables()
+
+    # Jobs: (gff3_file, scaffold group or None for the whole file)
+    num_groups = -(-num_cores // max(len(gff3_files), 1))
+    if num_cores > 1 and num_groups > 1:
+        D_group = group_scaffolds(D_genome, num_groups)
+        num_groups = max(D_group.values()) + 1 if D_group else 1
+        jobs = [(x, y) for x in gff3_files for y in range(num_groups)]
+    else:
+        D_group = {}
+        jobs = [(x, None) for x in gff3_files]
+
+    if num_cores > 1 and len(jobs) > 1:
+        D_worker['genome'] = D_genome
+        D_worker['tables'] = D_tables
+        D_worker['group'] = D_group
+        pool = Pool(min(num_cores, len(jobs)))
+        try:
+            results = pool.map(check_job, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+            D_worker.clear()
+    else:
+        results = [check_gff3(x, D_genome, D_tables) for x, _ in jobs]
+
+    for (gff3_file, _), (bad_ids, D_count) in zip(jobs, results):
         prefix = os.path.basename(os.path.splitext(gff3_file)[0])
+        for mrna_id in bad_ids:
+            D_bad[(prefix, mrna_id)] = True
+        for D_type, count_type in (
+            (D_stop, 'stop'), (D_toomanyX, 'toomanyX'), (D_gap, 'gap'),
+            (D_intron, 'intron')
+        ):
+            if D_count[count_type]:
+                D_type[prefix] += D_count[count_type]
 
-        # Import genome sequence
-        in_seq_handle = open(genome_assembly_file)
-        seq_dict = SeqIO.to_dict(SeqIO.parse(in_seq_handle, 'fasta'))
-        in_seq_handle.close()
-
-        # Import GFF3
-        in_handle = open(gff3_file)
-        for rec in GFF.parse(in_handle, base_dict=seq_dict):
-            gene_features = rec.features
-            for gene_feature in gene_features:
-                mrna_features = gene_feature.sub_features
-                for mrna_feature in mrna_features:
-                    mrna_sub_features = mrna_feature.sub_features
-                    mrna_sub_features_s = sorted(
-                        mrna_sub_features, key=lambda x: x.location.start
-                    )
-                    seq_cds = []
-                    coords = []
-                    mrna_sub_features_s2 = []
-                    for feature in mrna_sub_features_s:
-                        if feature.type != 'CDS':
-                            continue
-                        mrna_sub_features_s2.append(feature)
-                        seq_cds.append(rec.seq[
-                            feature.location.start:
-                            feature.location.end])
-                        coords.append(
-                            (feature.location.start, feature.location.end)
-                        )
-
-                    i = 1
-                    while i < len(coords):
-                        intron_start = coords[i - 1][1]
-                        intron_end = coords[i][0]
-                        intron_len = intron_end - intron_start
-                        if intron_len < 10:
-                            D_bad[(prefix, mrna_feature.id)] = True
-                            D_intron[prefix] += 1
-                        i += 1
-
-                    gene_seq = reduce(operator.add, seq_cds)
-                    # If strand is -, get reverse complementary sequence
-                    if mrna_feature.strand == -1:
-                        gene_seq = gene_seq.reverse_complement()
-                        phase = mrna_sub_features_s2[-1].qualifiers['phase']
-                    else:
-                        phase = mrna_sub_features_s2[0].qualifiers['phase']
-
-                    phase = int(phase[0])
-                    gene_seq = gene_seq[phase:]
-                    protein_seq = str(gene_seq.translate())
-
-                    # Check protein seq has stop codon in the middle
-                    protein_seq2 = re.sub('\*$', '', protein_seq)
-                    count_stop = protein_seq2.count('*')
-                    if count_stop > 0:
-                        D_bad[(prefix, mrna_feature.id)] = True
-                        D_stop[prefix] += 1
-
-                    # Check if translation consists of more than 50% X residues
-                    len_prot = len(protein_seq2)
-                    len_X = protein_seq2.count('X')
-                    if len_X / len_prot > 0.5:
-                        D_bad[(prefix, mrna_feature.id)] = True
-                        D_toomanyX[prefix] += 1
-
-                    # Check if feature begins or ends in gap
-                    gene_seq2 = str(gene_seq).lower()
-                    if gene_seq2.startswith('n') or gene_seq2.endswith('n'):
-                        D_bad[(prefix, mrna_feature.id)] = True
-                        D_gap[prefix] += 1
     outfile_stats = os.path.join(output_dir, 'bad_genes_stats.txt')
     outhandle_stats = open(outfile_stats, 'w')
     run_names = D_stop.keys()
@@ -153,8 +172,265 @@ def catch_middle_stop(gff3_files, genome_assembly_file, output_dir):
     outhandle_stats.write('start_with_gap\t{}\n'.format('\t'.join(gap_list)))
     outhandle_stats.write('toomanyX\t{}\n'.format('\t'.join(toomanyX_list)))
     outhandle_stats.write('short_intron\t{}\n'.format('\t'.join(intron_list)))
-    D_bad_pickle = os.path.join(output_dir, 'D_bad.p')
-    cPickle.dump(D_bad, open(D_bad_pickle, 'wb'))
+    outhandle_stats.close()
+
+    if output_pickle:
+        cPickle.dump(D_bad, open(output_pickle, 'wb'))
+
+    return D_bad
+
+
+def group_scaffolds(D_genome, num_groups):
+    # key: scaffold, value: group of similar total length
+    seq_lengths = [(x, seq_length(D_genome, x)) for x in seq_names(D_genome)]
+    assignment = balance_shards(seq_lengths, num_groups)
+    D_group = dict(
+        (x[0], group) for x, group in zip(seq_lengths, assignment)
+    )
+    return D_group
+
+
+def check_job(job):
+    # Run in a worker process. Scaffolds missing from the genome go to the
+    # first group, so they are still reported
+    gff3_file, group = job
+    keep_scaffold = None
+    if group is not None:
+        D_group = D_worker['group']
+        keep_scaffold = lambda x: D_group.get(x, 0) == group
+    return check_gff3(
+        gff3_file, D_worker['genome'], D_worker['tables'], keep_scaffold
+    )
+
+
+def make_tables():
+    # encode: byte to IUPAC code, complement: code to code, codon: code of
+    # a codon (c1 * 256 + c2 * 16 + c3) to amino acid letter (as uint8)
+    encode = np.full(256, 15, dtype=np.uint8)
+    complement = np.full(16, 15, dtype=np.uint8)
+    for code, letter in enumerate(iupac_codes):
+        encode[ord(letter)] = code
+        encode[ord(letter.lower())] = code
+        complement[code] = iupac_codes.index(D_complement[letter])
+
+    D_codon = dict(
+        (''.join(codon), aa)
+        for codon, aa in zip(product('TCAG', repeat=3), standard_aas)
+    )
+    codon_table = np.empty(4096, dtype=np.uint8)
+    for c1, c2, c3 in product(range(16), repeat=3):
+        codon_table[c1 * 256 + c2 * 16 + c3] = ord(
+            translate_codon(D_codon, (c1, c2, c3))
+        )
+
+    D_tables = {
+        'encode': encode,
+        'complement': complement,
+        'codon': codon_table,
+    }
+    return D_tables
+
+
+def translate_codon(D_codon, codes):
+    # Amino acid of a possibly ambiguous codon, as Biopython translates it
+    if 15 in codes:
+        return 'X'
+    aas = set(
+        D_codon[''.join(x)]
+        for x in product(*[D_iupac[iupac_codes[y]] for y in codes])
+    )
+    if len(aas) == 1:
+        return aas.pop()
+    elif '*' in aas:
+        return 'X'  # Possible stop codon
+    elif aas == set('DN'):
+        return 'B'
+    elif aas == set('EQ'):
+        return 'Z'
+    elif aas == set('IL'):
+        return 'J'
+    return 'X'
+
+
+def check_gff3(gff3_file, D_genome, D_tables, keep_scaffold=None):
+    # Returns (IDs of bad mRNAs, D_count); D_count has the number of mRNAs
+    # with internal stop, too many X or gap ends, and of short introns
+    bad_ids = []
+    D_count = defaultdict(int)
+
+    batch = []
+    batch_len = 0
+    for mrna in iter_mrnas(gff3_file, keep_scaffold):
+        cds_list = mrna[3]
+        if not cds_list:
+            continue
+        batch.append(mrna)
+        batch_len += sum(x[1] - x[0] + 1 for x in cds_list)
+        if batch_len >= batch_bases:
+            check_batch(batch, D_genome, D_tables, bad_ids, D_count)
+            batch = []
+            batch_len = 0
+    if batch:
+        check_batch(batch, D_genome, D_tables, bad_ids, D_count)
+
+    return bad_ids, D_count
+
+
+def check_batch(batch, D_genome, D_tables, bad_ids, D_count):
+    # batch: list of (scaffold, mrna_id, strand, cds_list) (gff3_reader.py)
+    num_batch = len(batch)
+    minus = np.zeros(num_batch, dtype=bool)
+    phases = np.zeros(num_batch, dtype=np.int64)
+    seg_model = []
+    seg_scaffold = []
+    seg_start = []
+    seg_end = []
+    for i, (scaffold, mrna_id, strand, cds_list) in enumerate(batch):
+        # Phase of the first CDS in the direction of transcription
+        if strand == '-':
+            minus[i] = True
+            phase = cds_list[-1][2]
+        else:
+            phase = cds_list[0][2]
+        phases[i] = int(phase) if phase.isdigit() else 0
+        for start, end, _ in cds_list:
+            seg_model.append(i)
+            seg_scaffold.append(scaffold)
+            seg_start.append(start)
+            seg_end.append(end)
+    seg_model = np.array(seg_model, dtype=np.int64)
+    seg_start = np.array(seg_start, dtype=np.int64)
+    seg_end = np.array(seg_end, dtype=np.int64)
+
+    # Short introns, between consecutive CDSs of a model
+    intron_len = seg_start[1:] - 1 - seg_end[:-1]
+    short = (seg_model[1:] == seg_model[:-1]) & (intron_len < min_intron_len)
+    num_short = np.bincount(seg_model[1:][short], minlength=num_batch)
+
+    # CDS bases of each model, in order of position
+    seg_len = get_seg_len(D_genome, seg_scaffold, seg_start, seg_end)
+    seq = gather_cds(D_genome, D_tables, seg_scaffold, seg_start, seg_len)
+    model_len = np.bincount(
+        seg_model, weights=seg_len, minlength=num_batch
+    ).astype(np.int64)
+    model_start = np.zeros(num_batch, dtype=np.int64)
+    model_start[1:] = np.cumsum(model_len)[:-1]
+
+    # Reverse complement minus strand models
+    base_model = np.repeat(np.arange(num_batch), model_len)
+    base_idx = np.arange(len(seq))
+    minus_base = minus[base_model]
+    src = np.where(
+        minus_base,
+        2 * model_start[base_model] + model_len[base_model] - 1 - base_idx,
+        base_idx
+    )
+    seq = seq[src]
+    seq[minus_base] = D_tables['complement'][seq[minus_base]]
+
+    # Trim by phase and translate
+    trim_start = model_start + phases
+    trim_len = np.maximum(model_len - phases, 0)
+    num_codons = trim_len // 3
+    codon_first = np.zeros(num_batch, dtype=np.int64)
+    codon_first[1:] = np.cumsum(num_codons)[:-1]
+    codon_model = np.repeat(np.arange(num_batch), num_codons)
+    codon_pos = trim_start[codon_model] + 3 * (
+        np.arange(len(codon_model)) - codon_first[codon_model]
+    )
+    codes = (
+        seq[codon_pos].astype(np.int64) * 256 +
+        seq[codon_pos + 1].astype(np.int64) * 16 +
+        seq[codon_pos + 2]
+    )
+    protein = D_tables['codon'][codes]
+
+    # Stop codons, except a terminal one
+    is_stop = protein == ord('*')
+    num_stop = np.bincount(codon_model[is_stop], minlength=num_batch)
+    last_stop = np.zeros(num_batch, dtype=np.int64)
+    has_codon = num_codons > 0
+    last_stop[has_codon] = is_stop[
+        codon_first[has_codon] + num_codons[has_codon] - 1
+    ]
+    internal_stop = num_stop - last_stop > 0
+
+    # More than 50% X residues
+    len_prot = num_codons - last_stop
+    num_x = np.bincount(
+        codon_model[protein == ord('X')], minlength=num_batch
+    )
+    toomany_x = (len_prot > 0) & (num_x * 2 > len_prot)
+
+    # CDS (after phase trimming) begins or ends in gap
+    has_seq = trim_len > 0
+    gap = np.zeros(num_batch, dtype=bool)
+    gap[has_seq] = (
+        (seq[trim_start[has_seq]] == n_code) |
+        (seq[trim_start[has_seq] + trim_len[has_seq] - 1] == n_code)
+    )
+
+    D_count['stop'] += int(internal_stop.sum())
+    D_count['toomanyX'] += int(toomany_x.sum())
+    D_count['gap'] += int(gap.sum())
+    D_count['intron'] += int(num_short.sum())
+    bad = internal_stop | toomany_x | gap | (num_short > 0)
+    for i in np.flatnonzero(bad):
+        bad_ids.append(batch[i][1])
+
+
+def get_seg_len(D_genome, seg_scaffold, seg_start, seg_end):
+    # Length of each CDS within its sequence
+    scaffold_len = np.array(
+        [get_entry(D_genome, x)[0] for x in seg_scaffold], dtype=np.int64
+    )
+    start = np.maximum(seg_start, 1)
+    end = np.minimum(seg_end, scaffold_len)
+    return np.maximum(end - start + 1, 0)
+
+
+def gather_cds(D_genome, D_tables, seg_scaffold, seg_start, seg_len):
+    # Encoded bases of the CDSs, concatenated in order. Bases are read from
+    # the genome mmap by offset arithmetic (line wrapping), or from memory
+    # for unevenly wrapped sequences
+    entries = [get_entry(D_genome, x) for x in seg_scaffold]
+    irregular = np.array(
+        [x in D_genome['irregular'] for x in seg_scaffold], dtype=bool
+    )
+    offset = np.array([x[1] for x in entries], dtype=np.int64)
+    line_bases = np.array([max(x[2], 1) for x in entries], dtype=np.int64)
+    line_width = np.array([x[3] for x in entries], dtype=np.int64)
+
+    start = np.maximum(seg_start, 1)
+    out_start = np.zeros(len(seg_len), dtype=np.int64)
+    out_start[1:] = np.cumsum(seg_len)[:-1]
+    total_len = int(seg_len.sum())
+
+    seq = np.empty(total_len, dtype=np.uint8)
+    regular_base = ~np.repeat(irregular, seg_len)
+    if regular_base.any():
+        # 0-based position in the sequence of each base
+        pos = (
+            np.repeat(start - 1 - out_start, seg_len) +
+            np.arange(total_len)
+        )[regular_base]
+        byte = (
+            np.repeat(offset, seg_len)[regular_base] +
+            pos // np.repeat(line_bases, seg_len)[regular_base] *
+            np.repeat(line_width, seg_len)[regular_base] +
+            pos % np.repeat(line_bases, seg_len)[regular_base]
+        )
+        genome_array = np.frombuffer(D_genome['mmap'], dtype=np.uint8)
+        seq[regular_base] = D_tables['encode'][genome_array[byte]]
+
+    for i in np.flatnonzero(irregular):
+        seg_seq = D_genome['irregular'][seg_scaffold[i]][
+            start[i] - 1:start[i] - 1 + seg_len[i]
+        ]
+        seq[out_start[i]:out_start[i] + seg_len[i]] = D_tables['encode'][
+            np.frombuffer(seg_seq, dtype=np.uint8)
+        ]
+    return seq
 
 
 if __name__ == '__main__':
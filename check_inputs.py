@@ -3,6 +3,11 @@ import sys
 import os
 from Bio import SeqIO
 
+this_path = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_path)
+sys.path.append(this_dir)
+from genome_index import open_genome, seq_names
+
 '''
 Check if inputs are proper to run FunGAP
 '''
@@ -91,21 +96,21 @@ def check_inputs(
 
     print 'TRANS_READ_FILES is ok...'
 
-    # Check geonme assembly in FASTA
-    with open(genome_assembly, 'r') as handle:
-        fasta = SeqIO.parse(handle, 'fasta')
-        if not any(fasta):
-            sys.exit('[ERROR] FASTA file is invalid: {}'.format(
-                genome_assembly
-            ))
-
-        for record in SeqIO.parse(handle, 'fasta'):
-            if '|' in record.id:
-                error_message6 = (
-                    '[ERROR] FASTA defline contains "|" character, please '
-                    'remove and re-run'
-                )
-                sys.exit(error_message6)
+    # Check geonme assembly in FASTA. This also builds the genome index
+    # (genome_index.py) used by the later steps
+    genome_names = seq_names(open_genome(genome_assembly))
+    if not genome_names:
+        sys.exit('[ERROR] FASTA file is invalid: {}'.format(
+            genome_assembly
+        ))
+
+    for genome_name in genome_names:
+        if '|' in genome_name:
+            error_message6 = (
+                '[ERROR] FASTA defline contains "|" character, please '
+                'remove and re-run'
+            )
+            sys.exit(error_message6)
 
     print 'GENOME_ASSEMBLY is ok...'
 
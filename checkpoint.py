@@ -0,0 +1,232 @@
+#!/usr/bin/env python2
+
+'''
+Content-addressed checkpoints of FunGAP stages
+
+Each finished stage is recorded in <output_dir>/logs/checkpoint.json with a
+key built from hashes of its input files, its parameters and its tools
+(program files), together with its return value and hashes of its output
+files. On a rerun, a stage is skipped when its key and outputs are unchanged,
+and re-run otherwise. Because the key includes the hashes of the upstream
+outputs, a change propagates only to the stages that actually see it.
+
+File hashes are cached by (size, mtime), so unchanged large files such as
+BAMs are hashed only once.
+
+Results that do not come back unchanged from JSON (e.g. tuples, or score
+dictionaries of the stages run in-process) are pickled to <output_dir>/logs/checkpoint/<stage>.p, and
+the hash of the pickle stands for the result in the keys of downstream
+stages.
+'''
+
+# Import modules
+import os
+import json
+import cPickle
+import shutil
+import hashlib
+import threading
+
+# Parameters
+chunk_size = 1024 * 1024
+
+
+def init_checkpoint(output_dir):
+    manifest_file = os.path.join(output_dir, 'logs', 'checkpoint.json')
+    D_manifest = {'stages': {}, 'files': {}}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f_in:
+            D_manifest = to_str(json.load(f_in))
+
+    D_checkpoint = {
+        'root': os.path.abspath(output_dir),
+        'manifest_file': manifest_file,
+        'result_dir': os.path.join(output_dir, 'logs', 'checkpoint'),
+        'stages': D_manifest['stages'],
+        'files': D_manifest['files'],
+        'lock': threading.Lock(),
+    }
+    return D_checkpoint
+
+
+def to_str(value):
+    # json gives unicode; keep plain str paths as the wrappers expect
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, list):
+        return [to_str(x) for x in value]
+    elif isinstance(value, dict):
+        return dict((to_str(x), to_str(y)) for x, y in value.items())
+    return value
+
+
+def save_manifest(D_checkpoint):
+    manifest_file = D_checkpoint['manifest_file']
+    tmp_file = '{}.tmp'.format(manifest_file)
+    with open(tmp_file, 'w') as outhandle:
+        json.dump(
+            {'stages': D_checkpoint['stages'], 'files': D_checkpoint['files']},
+            outhandle, indent=1, sort_keys=True
+        )
+    os.rename(tmp_file, manifest_file)
+
+
+def hash_file(D_checkpoint, path):
+    stat = os.stat(path)
+    with D_checkpoint['lock']:
+        cached = D_checkpoint['files'].get(path)
+    if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+        return cached[2]
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f_in:
+        for chunk in iter(lambda: f_in.read(chunk_size), ''):
+            sha1.update(chunk)
+    digest = sha1.hexdigest()
+
+    with D_checkpoint['lock']:
+        D_checkpoint['files'][path] = [stat.st_size, stat.st_mtime, digest]
+    return digest
+
+
+def hash_path(D_checkpoint, path):
+    if not os.path.isdir(path):
+        return hash_file(D_checkpoint, path)
+
+    sha1 = hashlib.sha1()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file_name in sorted(files):
+            file_path = os.path.join(root, file_name)
+            if not os.path.isfile(file_path):
+                continue
+            sha1.update(os.path.relpath(file_path, path))
+            sha1.update(hash_file(D_checkpoint, file_path))
+    return sha1.hexdigest()
+
+
+def get_paths(value):
+    # Existing files or directories in a stage result. Dictionaries are
+    # in-memory results, not file lists, and are not searched
+    paths = []
+    if isinstance(value, basestring):
+        if os.path.isabs(value) and os.path.exists(value):
+            paths.append(value)
+    elif isinstance(value, (list, tuple)):
+        for element in value:
+            paths += get_paths(element)
+    return paths
+
+
+def is_json(value):
+    # Only values that come back unchanged from JSON: tuples would be read
+    # back as lists and non-string dictionary keys as strings
+    try:
+        return json.loads(json.dumps(value)) == value
+    except (TypeError, ValueError):
+        return False
+
+
+def stage_key(D_checkpoint, stage_name, inputs, params, tools, deps=()):
+    sha1 = hashlib.sha1()
+    sha1.update(stage_name)
+    sha1.update(json.dumps(params, sort_keys=True))
+    for path in get_paths(list(inputs)) + get_paths(list(tools)):
+        sha1.update(path)
+        sha1.update(hash_path(D_checkpoint, path))
+
+    # Pickled results of the dependencies
+    with D_checkpoint['lock']:
+        for dep in deps:
+            D_stage = D_checkpoint['stages'].get(dep, {})
+            sha1.update(D_stage.get('result_digest', ''))
+    return sha1.hexdigest()
+
+
+def find_checkpoint(D_checkpoint, stage_name, key):
+    # Return (True, result) if the stage is done with the same key and its
+    # outputs are untouched
+    with D_checkpoint['lock']:
+        D_stage = D_checkpoint['stages'].get(stage_name)
+    if not D_stage or D_stage['key'] != key:
+        return False, None
+
+    for path, digest in D_stage['outputs'].items():
+        if not os.path.exists(path):
+            return False, None
+        if hash_path(D_checkpoint, path) != digest:
+            return False, None
+
+    result_file = D_stage.get('result_file')
+    if result_file:
+        if not os.path.exists(result_file):
+            return False, None
+        if hash_file(D_checkpoint, result_file) != D_stage['result_digest']:
+            return False, None
+        with open(result_file, 'rb') as f_in:
+            return True, cPickle.load(f_in)
+
+    return True, D_stage['result']
+
+
+def clear_outputs(D_checkpoint, stage_name, inputs=(), work_dirs=()):
+    # Remove outputs of a stale stage, so that "already finished" checks in
+    # the wrapped scripts do not pick them up, and its work directories
+    # (e.g. shards of an earlier run), which are not in its result. Only
+    # touch files in output_dir that the stage created: paths it was given
+    # (its inputs and the results of its dependencies, e.g. a BAM passed
+    # through by hisat2) are kept. A stage without a record was interrupted
+    # and keeps its work directories to resume from
+    with D_checkpoint['lock']:
+        D_stage = D_checkpoint['stages'].pop(stage_name, None)
+    if not D_stage:
+        return []
+
+    root = D_checkpoint['root'] + os.sep
+    given = set(os.path.abspath(x) for x in get_paths(list(inputs)))
+    removed = []
+    for path in list(D_stage['outputs']) + list(work_dirs):
+        if not path.startswith(root) or not os.path.exists(path):
+            continue
+        path_dir = os.path.abspath(path) + os.sep
+        if os.path.abspath(path) in given or any(
+            x.startswith(path_dir) for x in given
+        ):
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        removed.append(path)
+    return removed
+
+
+def dump_result(D_checkpoint, stage_name, result):
+    result_dir = D_checkpoint['result_dir']
+    with D_checkpoint['lock']:
+        if not os.path.exists(result_dir):
+            os.mkdir(result_dir)
+
+    result_file = os.path.join(result_dir, '{}.p'.format(stage_name))
+    tmp_file = '{}.tmp'.format(result_file)
+    with open(tmp_file, 'wb') as outhandle:
+        cPickle.dump(result, outhandle, cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_file, result_file)
+    return result_file
+
+
+def record_checkpoint(D_checkpoint, stage_name, key, result):
+    D_output = {}
+    for path in get_paths(result):
+        D_output[path] = hash_path(D_checkpoint, path)
+
+    D_stage = {'key': key, 'result': result, 'outputs': D_output}
+    if not is_json(result):
+        result_file = dump_result(D_checkpoint, stage_name, result)
+        D_stage['result'] = None
+        D_stage['result_file'] = result_file
+        D_stage['result_digest'] = hash_file(D_checkpoint, result_file)
+
+    with D_checkpoint['lock']:
+        D_checkpoint['stages'][stage_name] = D_stage
+        save_manifest(D_checkpoint)
@@ -59,6 +59,8 @@ def copy_output(output_dir):
         )
         copyfile(prot_out, fungap_out_prot)
 
+    return fungap_out_gff3, fungap_out_prot
+
 
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -11,7 +11,6 @@ import sys
 import datetime
 import subprocess
 import numpy as np
-from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.SeqUtils import GC
 from markdown2 import markdown
@@ -28,6 +27,8 @@ this_path = os.path.realpath(__file__)
 this_dir = os.path.dirname(this_path)
 sys.path.append(this_dir)
 from import_config import import_config
+from genome_index import open_genome, seq_names, seq_length, fetch_seq
+from interval_index import build_index, merge_intervals
 
 # Parameters
 D_conf = import_config(this_dir)
@@ -69,11 +70,19 @@ def main(argv):
     output_dir = os.path.abspath(args.output_dir)
 
     # Run functions :) Slow is as good as Fast
+    make_report(
+        input_fasta, input_gff3, trinity_assembly, bam_file, output_dir
+    )
+
+
+def make_report(
+    input_fasta, input_gff3, trinity_assembly, bam_file, output_dir
+):
     create_dir(output_dir)
-    D_fasta = SeqIO.to_dict(SeqIO.parse(input_fasta, 'fasta', generic_dna))
+    D_genome = open_genome(input_fasta)
     D_gff3 = parse_gff3(input_gff3)
-    D_cds_coords, protein_lengths, D_stat = get_stats(D_fasta, D_gff3)
-    D_stat = get_stats2(D_fasta, D_cds_coords, D_stat)
+    D_cds_coords, protein_lengths, D_stat = get_stats(D_genome, D_gff3)
+    D_stat = get_stats2(D_genome, D_cds_coords, D_stat)
     D_trinity = get_stats_trinity(trinity_assembly, bam_file)
     trans_len_dist_png = draw_trans_len_dist(D_trinity, output_dir)
     prot_len_dist_png = draw_prot_len_dist(protein_lengths, output_dir)
@@ -81,6 +90,8 @@ def main(argv):
         D_stat, D_trinity, trans_len_dist_png, prot_len_dist_png, output_dir
     )
 
+    return os.path.join(output_dir, 'fungap_out.html')
+
 
 def import_file(input_file):
     with open(input_file) as f_in:
@@ -138,7 +149,7 @@ def parse_gff3(input_gff3):
     return D_gff3_sorted
 
 
-def get_stats(D_fasta, D_gff3):
+def get_stats(D_genome, D_gff3):
     # Get stats
     D_stat = {}
     cds_lengths = []
@@ -178,7 +189,7 @@ def get_stats(D_fasta, D_gff3):
             tmp_prot_len += end - start + 1
             exon_lengths.append(end - start + 1)
             # Get sequence
-            cds_seq += str(D_fasta[scaffold][start - 1:end].seq)
+            cds_seq += fetch_seq(D_genome, scaffold, start, end)
             # Store in dictionary
             D_cds_coords[scaffold].append((start, end))
 
@@ -223,8 +234,7 @@ def get_stats(D_fasta, D_gff3):
 
     # Guitar
     percent_splice = round(float(num_spliced) / total_genes * 100, 2)
-    total_bases_lst = [len(str(x.seq)) for x in D_fasta.values()]
-    total_bases = sum(total_bases_lst)
+    total_bases = get_total_bases(D_genome)
     gene_density = float(total_genes) / total_bases
     gene_density = gene_density * 1000000
     gene_density = round(gene_density, 2)
@@ -259,23 +269,43 @@ def get_stats(D_fasta, D_gff3):
     return D_cds_coords, protein_lengths, D_stat
 
 
-def get_stats2(D_fasta, D_cds_coords, D_stat):
-    non_coding_seq = ''
-    scaffolds_with_gene = []
+def get_total_bases(D_genome):
+    return sum(seq_length(D_genome, x) for x in seq_names(D_genome))
+
+
+def count_gc(seq):
+    # Same bases as Bio.SeqUtils.GC
+    return sum(seq.count(x) for x in 'GCSgcs')
 
-    # Handle scaffolds without genes
-    for scaffold, seq in D_fasta.items():
-        if scaffold in scaffolds_with_gene:
-            continue
-        non_coding_seq += str(D_fasta[scaffold].seq)
 
-    total_bases_lst = [len(str(x.seq)) for x in D_fasta.values()]
-    total_bases = sum(total_bases_lst)
-    non_coding_percent = float(len(non_coding_seq)) / total_bases
+def get_stats2(D_genome, D_cds_coords, D_stat):
+    non_coding_len = 0
+    non_coding_gc_count = 0
+
+    # Non-coding region is the genome minus the union of CDSs. Sequences
+    # are read one scaffold at a time from the genome index
+    D_index = build_index(
+        (scaffold, start, end, None)
+        for scaffold, coords in D_cds_coords.items()
+        for start, end in coords
+    )
+    for scaffold in seq_names(D_genome):
+        seq = fetch_seq(D_genome, scaffold)
+        non_coding_len += len(seq)
+        non_coding_gc_count += count_gc(seq)
+        for start, end in merge_intervals(D_index, scaffold):
+            coding_seq = seq[start - 1:end]
+            non_coding_len -= len(coding_seq)
+            non_coding_gc_count -= count_gc(coding_seq)
+
+    total_bases = get_total_bases(D_genome)
+    non_coding_percent = float(non_coding_len) / total_bases
     non_coding_percent = non_coding_percent * 100
     non_coding_percent = round(non_coding_percent, 2)
-    my_seq = Seq(non_coding_seq, IUPAC.unambiguous_dna)
-    non_coding_gc = GC(my_seq)
+    if non_coding_len:
+        non_coding_gc = non_coding_gc_count * 100.0 / non_coding_len
+    else:
+        non_coding_gc = 0.0
 
     D_stat['Percent non-coding region'] = (non_coding_percent)
     D_stat['Non-coding region GC'] = round(non_coding_gc, 2)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python2
+
+'''
+Evidence score table of gene models
+
+Model IDs are the rows of nr_prot_mapping.txt (make_nr_prot.py): model i is
+the i-th (prefix, transcript ID) of the file. Each import step (import_*.py)
+writes its scores as one column indexed by model ID (<column>.npy in
+evidence_columns), and the columns are merged into one table file,
+evidence_table.npy: a NumPy structured array with a model_id column and one
+column per evidence type, which is loaded with mmap_mode='r'.
+
+filter_gff3s.py joins the table once against the models of a gene model
+store (gene_models.py) by integer ID. The bad gene dictionary
+(catch_bad_genes.py) becomes a column too, and the score column is the sum
+of the evidence columns, computed over whole columns.
+
+Input: evidence columns (.npy) written by import_*.py
+Output: evidence_table.npy
+'''
+
+# Import modules
+import os
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+
+import numpy as np
+
+# Parameters
+columns = ['blastp', 'busco', 'pfam', 'blastn']
+
+
+# Main function
+def main(argv):
+    argparse_usage = (
+        'evidence_table.py -c <column_files> -o <output_dir>'
+    )
+    parser = ArgumentParser(usage=argparse_usage)
+    parser.add_argument(
+        '-c', '--column_files', nargs='+', required=True,
+        help='Evidence columns (blastp.npy, busco.npy, pfam.npy, blastn.npy)'
+    )
+    parser.add_argument(
+        '-o', '--output_dir', nargs='?', default='gene_filtering',
+        help='Output directory'
+    )
+
+    args = parser.parse_args()
+    column_files = [os.path.abspath(x) for x in args.column_files]
+    output_dir = os.path.abspath(args.output_dir)
+
+    # Run functions :)
+    write_table(column_files, get_table_file(output_dir))
+
+
+def import_rows(nr_prot_mapping):
+    # Returns keys (list of (prefix, transcript ID), index: model ID) and
+    # D_rows (key: nr ID, value: list of model IDs)
+    keys = []
+    D_rows = defaultdict(list)
+    with open(nr_prot_mapping) as f_in:
+        next(f_in)  # Header
+        for line in f_in:
+            line = line.rstrip()
+            if not line:
+                continue
+            prot_name, prefix, prefix_id = line.split('\t')
+            D_rows[prot_name].append(len(keys))
+            keys.append((prefix, prefix_id))
+    return keys, D_rows
+
+
+def get_column_file(output_dir, column):
+    column_dir = os.path.join(output_dir, 'evidence_columns')
+    if not os.path.exists(column_dir):
+        os.mkdir(column_dir)
+    return os.path.join(column_dir, '{}.npy'.format(column))
+
+
+def get_table_file(output_dir):
+    return os.path.join(output_dir, 'evidence_table.npy')
+
+
+def nr_column(D_nr_score, D_rows, num_rows):
+    # Scores of nr IDs given to all models sharing the sequence. Models
+    # without a score get 0
+    values = np.zeros(num_rows, dtype=np.float64)
+    for nr_name, score in D_nr_score.iteritems():
+        values[D_rows.get(nr_name, [])] = score
+    return values
+
+
+def key_column(D_score, keys):
+    # Scores keyed by (prefix, transcript ID)
+    return np.fromiter(
+        (D_score.get(x, 0.0) for x in keys), dtype=np.float64,
+        count=len(keys)
+    )
+
+
+def write_column(values, output_file):
+    tmp_file = '{}.tmp'.format(output_file)
+    with open(tmp_file, 'wb') as outhandle:
+        np.save(outhandle, np.asarray(values, dtype=np.float64))
+    os.rename(tmp_file, output_file)
+    return output_file
+
+
+def write_table(column_files, output_file):
+    # Merge evidence columns, named by their file names, into one table
+    D_column = {}
+    for column_file in column_files:
+        column = os.path.splitext(os.path.basename(column_file))[0]
+        if column not in columns:
+            sys.exit('[ERROR] Unknown evidence column: {}'.format(column_file))
+        D_column[column] = np.load(column_file, mmap_mode='r')
+    missing = [x for x in columns if x not in D_column]
+    if missing:
+        sys.exit('[ERROR] Missing evidence columns: {}'.format(
+            ', '.join(missing)
+        ))
+    num_rows = len(D_column[columns[0]])
+    if any(len(D_column[x]) != num_rows for x in columns):
+        sys.exit('[ERROR] Evidence columns differ in length: {}'.format(
+            ', '.join(column_files)
+        ))
+
+    table = np.zeros(num_rows, dtype=[('model_id', np.int64)] + [
+        (x, np.float64) for x in columns
+    ])
+    table['model_id'] = np.arange(num_rows)
+    for column in columns:
+        table[column] = D_column[column]
+
+    tmp_file = '{}.tmp'.format(output_file)
+    with open(tmp_file, 'wb') as outhandle:
+        np.save(outhandle, table)
+    os.rename(tmp_file, output_file)
+    return output_file
+
+
+def build_table(keys, table_file, nr_prot_mapping, D_bad):
+    # keys: model keys in model ID order of a gene model store
+    # (gene_models.py). Models missing from the table score 0
+    table = np.load(table_file, mmap_mode='r')
+    table_keys, _ = import_rows(nr_prot_mapping)
+    if len(table_keys) != len(table):
+        sys.exit('[ERROR] {} does not match {}'.format(
+            table_file, nr_prot_mapping
+        ))
+    D_row = dict((x, i) for i, x in enumerate(table_keys))
+    rows = np.fromiter(
+        (D_row.get(x, -1) for x in keys), dtype=np.int64, count=len(keys)
+    )
+    found = rows >= 0
+
+    D_table = {'keys': list(keys)}
+    for column in columns:
+        D_table[column] = np.zeros(len(keys), dtype=np.float64)
+        D_table[column][found] = table[column][rows[found]]
+    D_table['bad'] = np.fromiter(
+        (1 if D_bad.get(x) else 0 for x in keys), dtype=np.int8,
+        count=len(keys)
+    )
+
+    # Same order of addition as filter_gff3s.py used, so ties are kept
+    D_table['score'] = (
+        D_table['blastp'] + D_table['pfam'] + D_table['busco'] +
+        D_table['blastn']
+    )
+    return D_table
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
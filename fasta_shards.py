@@ -0,0 +1,133 @@
+#!/usr/bin/env python2
+
+'''
+Split a FASTA file into shards for running a tool in parallel
+
+Sequences are assigned to shards by balancing total length (longest
+processing time first), and each shard keeps the input order of its
+sequences, so shard outputs can be merged back in input order
+(merge_outputs).
+
+A shard file is rewritten only when its content changes; unchanged shards
+keep their modification time, so finished shard outputs can be reused. The
+shard directory is stamped with the tool, database and options of the run
+(check_stamp), and shards of a run with another stamp are discarded.
+'''
+
+# Import modules
+import os
+import sys
+import heapq
+import shutil
+import filecmp
+
+
+def check_stamp(shard_dir, stamp):
+    # Make shard_dir for a run described by stamp. An existing shard_dir
+    # with another stamp (or none) is removed first
+    stamp_file = os.path.join(shard_dir, 'stamp.txt')
+    if os.path.exists(shard_dir):
+        old_stamp = None
+        if os.path.exists(stamp_file):
+            with open(stamp_file) as f_in:
+                old_stamp = f_in.read()
+        if old_stamp == stamp:
+            return
+        shutil.rmtree(shard_dir)
+
+    os.mkdir(shard_dir)
+    tmp_file = '{}.tmp'.format(stamp_file)
+    with open(tmp_file, 'w') as outhandle:
+        outhandle.write(stamp)
+    os.rename(tmp_file, stamp_file)
+
+
+def get_seq_lengths(input_fasta):
+    # Returns list of (seq_name, length) in input order
+    seq_lengths = []
+    with open(input_fasta) as f_in:
+        for line in f_in:
+            if line.startswith('>'):
+                seq_name = line[1:].split()[0]
+                seq_lengths.append([seq_name, 0])
+            elif seq_lengths:
+                seq_lengths[-1][1] += len(line.strip())
+    return [tuple(x) for x in seq_lengths]
+
+
+def balance_shards(seq_lengths, num_shards):
+    # Returns shard index of each sequence (0 to number of shards - 1, none
+    # empty). Longest sequences are placed first, each on the shard with the
+    # least total length
+    num_shards = max(1, min(num_shards, len(seq_lengths)))
+    heap = [(0, x) for x in range(num_shards)]
+    assignment = [0] * len(seq_lengths)
+    order = sorted(
+        range(len(seq_lengths)), key=lambda x: seq_lengths[x][1], reverse=True
+    )
+    for seq_i in order:
+        total_len, shard_i = heapq.heappop(heap)
+        assignment[seq_i] = shard_i
+        heapq.heappush(heap, (total_len + seq_lengths[seq_i][1], shard_i))
+
+    # Renumber so that no shard is empty (e.g. zero-length sequences)
+    D_shard = dict((y, x) for x, y in enumerate(sorted(set(assignment))))
+    return [D_shard[x] for x in assignment]
+
+
+def write_shards(input_fasta, assignment, shard_files):
+    # Write sequences to their shard files. Returns shard files whose
+    # content changed since the last run
+    tmp_files = ['{}.tmp'.format(x) for x in shard_files]
+    outhandles = [open(x, 'w') for x in tmp_files]
+    seq_i = -1
+    with open(input_fasta) as f_in:
+        for line in f_in:
+            if line.startswith('>'):
+                seq_i += 1
+            if seq_i >= 0 and line.strip():
+                outhandles[assignment[seq_i]].write(line)
+    for outhandle in outhandles:
+        outhandle.close()
+
+    changed = []
+    for tmp_file, shard_file in zip(tmp_files, shard_files):
+        if os.path.exists(shard_file) and filecmp.cmp(
+            tmp_file, shard_file, shallow=False
+        ):
+            os.remove(tmp_file)
+            continue
+        os.rename(tmp_file, shard_file)
+        changed.append(shard_file)
+    return changed
+
+
+def next_output_line(f_in):
+    # Next line of a shard output, skipping comment and blank lines. Returns
+    # '' at the end of the file
+    for line in f_in:
+        if line.strip() and not line.startswith('#'):
+            return line
+    return ''
+
+
+def merge_outputs(seq_lengths, assignment, shard_outputs, outhandle):
+    # Write lines of shard outputs in input order of their sequences. Each
+    # line starts with its sequence name, and a shard output follows the
+    # order of its shard
+    f_ins = [open(x) for x in shard_outputs]
+    next_lines = [next_output_line(x) for x in f_ins]
+    for (seq_name, seq_len), shard_i in zip(seq_lengths, assignment):
+        line = next_lines[shard_i]
+        while line and line.split(None, 1)[0] == seq_name:
+            outhandle.write(line)
+            line = next_output_line(f_ins[shard_i])
+        next_lines[shard_i] = line
+    for f_in in f_ins:
+        f_in.close()
+
+    leftover = [x for x, y in zip(shard_outputs, next_lines) if y]
+    if leftover:
+        sys.exit('[ERROR] Unknown or unordered sequences in {}'.format(
+            ', '.join(leftover)
+        ))
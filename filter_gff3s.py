@@ -8,10 +8,10 @@ with at least one base pair. FunGAP gets all combinations of gene models
 in a gene block and calculates the sum of the evidence scores. Gene models
 in the block with the highest evidence score are selected as final genes of
 that region. Short coding sequence overlap (<10% of coding sequence length)
-is allowed.
+is allowed. The best combination is found by interval_selection.py.
 
-Input: multiple GFF3 files, Blast score file, Busco score file, Pfam score
-       file, bad genes file
+Input: multiple GFF3 files, evidence table (evidence_table.py), bad genes
+       file
 Output: filtered gene featrue file in GFF3
 '''
 
@@ -22,13 +22,20 @@ import re
 import cPickle
 from collections import defaultdict
 from argparse import ArgumentParser
-import networkx as nx
 
 # Get Logging
 this_path = os.path.realpath(__file__)
 this_dir = os.path.dirname(this_path)
 sys.path.append(this_dir)
 from set_logging import set_logging
+from genome_index import open_genome, seq_names
+from evidence_table import build_table
+from gene_models import (
+    load_models, get_prefix, prefix_models, num_models, model_key,
+    get_transcript, get_features, has_cds, get_cds_span, get_cds_len
+)
+from interval_index import build_index, iter_blocks
+from interval_selection import select_intervals
 
 # Parameters
 evalue_zero = 2.225074e-308
@@ -39,8 +46,8 @@ blast_cutoff = 0.00001  # -1 * log(evalue, 10)
 def main(argv):
     argparse_usage = (
         'filter_gff3s.py -a <genome_assembly> -i <input_gff3s> '
-        '-m <mapping_file> -b <blastp_dict> -B <busco_dict> -p <pfam_dict> '
-        '-N <blastn_dict> -g <bad_dict> -n <nr_prot_file> -o <output_dir>'
+        '-m <mapping_file> -e <evidence_table> -g <bad_dict> '
+        '-n <nr_prot_file> -o <output_dir>'
     )
     parser = ArgumentParser(usage=argparse_usage)
     parser.add_argument(
@@ -56,20 +63,8 @@ def main(argv):
         help="Mapping txt file (make_nr_prot.py)"
     )
     parser.add_argument(
-        "-b", "--blastp_dict", nargs=1, required=True,
-        help="Parsed blastp output in dictionary (import_blastp.py)"
-    )
-    parser.add_argument(
-        "-B", "--busco_dict", nargs=1, required=True,
-        help="Parsed BUSCO output in dictionary (import_busco.py)"
-    )
-    parser.add_argument(
-        "-p", "--pfam_dict", nargs=1, required=True,
-        help="Parsed Pfam_scan output in dictionary (import_pfam.py)"
-    )
-    parser.add_argument(
-        "-N", "--blastn_dict", nargs=1, required=True,
-        help="Parsed BLASTn output in dictionary (import_blastn.py)"
+        "-e", "--evidence_table", nargs=1, required=True,
+        help="evidence_table.npy (evidence_table.py)"
     )
     parser.add_argument(
         "-g", "--bad_dict", nargs=1, required=True,
@@ -89,15 +84,11 @@ def main(argv):
     )
 
     args = parser.parse_args()
-    genome_assembly = os.path.abspath(args.genome_assembly)
+    genome_assembly = os.path.abspath(args.genome_assembly[0])
     input_gff3s = [os.path.abspath(x) for x in args.input_gff3s]
     mapping_file = os.path.abspath(args.mapping_file[0])
-    blastp_dict = os.path.abspath(args.blastp_dict[0])
-    busco_dict = os.path.abspath(args.busco_dict[0])
-    pfam_dict = os.path.abspath(args.pfam_dict[0])
-    blastn_dict = os.path.abspath(args.blastn_dict[0])
+    evidence_table = os.path.abspath(args.evidence_table[0])
     bad_dict = os.path.abspath(args.bad_dict[0])
-    D_bad = cPickle.load(open(bad_dict, 'rb'))
     nr_prot_file = os.path.abspath(args.nr_prot_file[0])
     output_dir = os.path.abspath(args.output_dir)
     log_dir = os.path.abspath(args.log_dir)
@@ -114,48 +105,61 @@ def main(argv):
     logger_time.debug('START: Filtering GFF3')
     D_mapping, D_mapping_rev = import_mapping(mapping_file)
 
-    # Import dictionaries
-    D_blastp = cPickle.load(open(blastp_dict, 'rb'))
-    D_busco = cPickle.load(open(busco_dict, 'rb'))
-    D_pfam = cPickle.load(open(pfam_dict, 'rb'))
-    D_blastn = cPickle.load(open(blastn_dict, 'rb'))
+    # Import dictionary
+    D_bad = cPickle.load(open(bad_dict, 'rb'))
+
+    filter_gff3s(
+        genome_assembly, input_gff3s, mapping_file, D_mapping, D_mapping_rev,
+        evidence_table, D_bad, nr_prot_file, output_dir
+    )
+    logger_time.debug('DONE : Filtering GFF3')
+
+
+def filter_gff3s(
+    genome_assembly, input_gff3s, mapping_file, D_mapping, D_mapping_rev,
+    evidence_table, D_bad, nr_prot_file, output_dir
+):
+    # All GFF3s are parsed once into a columnar store (gene_models.py);
+    # models are keyed by (prefix, ID)
+    D_models = load_models(input_gff3s)
+
+    # The evidence table, indexed by the rows of mapping_file, is joined
+    # once into columns indexed by model ID (evidence_table.py)
+    D_table = build_table(
+        D_models['keys'], evidence_table, mapping_file, D_bad
+    )
+    write_scores(D_models, D_table, output_dir)
 
     # Self-filtering
+    D_prefix = prefix_models(D_models)
     for input_gff3 in input_gff3s:
         prefix = re.sub(r'\.gff3$', '', os.path.basename(input_gff3))
-        D_gff3, D_gene, D_cds, D_cds_len, D_exon = import_gff3([input_gff3])
         self_filtered = filtering(
-            D_cds, D_cds_len, D_blastp, D_busco, D_pfam, D_blastn, D_bad,
-            output_dir
+            D_models, D_prefix[get_prefix(input_gff3)], D_table
         )
         outfile_self = os.path.join(
             output_dir, '{}_filtered.list'.format(prefix)
         )
         outhandle_self = open(outfile_self, 'w')
-
-        cds_len_filtered = 0
-        for tup in self_filtered:
-            outhandle_self.write('{}\n'.format(tup[1]))
-            cds_len_filtered += D_cds_len[tup]
+        for model_id in self_filtered:
+            gene_tup = model_key(D_models, model_id)
+            outhandle_self.write('{}\n'.format(gene_tup[1]))
         outhandle_self.close()
 
     # Filtering
-    D_gff3, D_gene, D_cds, D_cds_len, D_exon = import_gff3(input_gff3s)
     final_gene_set = filtering(
-        D_cds, D_cds_len, D_blastp, D_busco, D_pfam, D_blastn, D_bad,
-        output_dir
+        D_models, range(num_models(D_models)), D_table
     )
     D_prot = import_prot(nr_prot_file, D_mapping_rev)
-    write_final_prots(final_gene_set, D_mapping, output_dir)
-    write_files(
-        final_gene_set, D_gene, D_gff3, D_prot, D_exon, output_dir, D_cds
+    write_final_prots(
+        [model_key(D_models, x) for x in final_gene_set], D_mapping,
+        output_dir
     )
+    write_files(genome_assembly, D_models, final_gene_set, D_prot, output_dir)
 
-    cds_len_final = 0
-    for tup in final_gene_set:
-        cds_len_final += D_cds_len[tup]
-
-    logger_time.debug('DONE : Filtering GFF3')
+    filtered_gff3 = os.path.join(output_dir, 'filtered_1.gff3')
+    filtered_prot = os.path.join(output_dir, 'filtered_prot.faa')
+    return filtered_gff3, filtered_prot
 
 
 def import_file(path):
@@ -186,110 +190,16 @@ def import_mapping(mapping_file):
     return D_mapping, D_mapping_rev
 
 
-def import_gff3(gff3_files):
-    # Define empty dictionaries
-    D_gff3 = defaultdict(list)
-    D_exon = defaultdict(list)
-    D_gene = {}
-    D_cds = defaultdict(lambda: (0, 100000000000, 0))
-    D_cds_len = defaultdict(int)
-
-    # Regular expressions
-    reg_id = re.compile(r'ID=([^;]+)')
-    reg_parent = re.compile(r'Parent=([^;]+)')
-    for gff3_file in gff3_files:
-        prefix = os.path.basename(gff3_file).split('.')[0]
-        gff3_txt = import_file(gff3_file)
-
-        D_parent = {}
-        for line in gff3_txt:
-            if not re.search('\t', line):
-                continue  # Only consider line containing tabs
-
-            line_split = line.split('\t')
-            (
-                scaffold, source, feat_type, start, end, score,
-                strand, phase, attr
-            ) = line_split
-
-            m_id = reg_id.search(line)
-            if m_id:
-                entry_id = m_id.group(1)
-            else:
-                entry_id = line_split[8]
-
-            m_parent = reg_parent.search(line)
-            if m_parent:
-                parent_id = m_parent.group(1)
-            else:
-                parent_id = ''
-
-            if feat_type in ('mRNA', 'transcript'):
-                if entry_id != '':
-                    mrna_id = entry_id
-                    mrna_parent = parent_id
-                    if mrna_parent != '':
-                        D_parent[mrna_id] = mrna_parent
-
-                new_mrna_id = (prefix, mrna_id)
-                D_gene[new_mrna_id] = (
-                    scaffold, source, feat_type, int(start), int(end), score,
-                    strand, phase
-                )
-
-            elif feat_type == 'CDS':
-                cds_gene = parent_id  # mRNA ID
-                new_cds_gene = (prefix, cds_gene)
-                # Measure length of CDSs
-                cds_len = (
-                    max([int(start), int(end)]) -
-                    min([int(start), int(end)]) + 1
-                )
-                D_cds_len[new_cds_gene] += cds_len
-
-                if max([int(start), int(end)]) > D_cds[new_cds_gene][2]:
-                    D_cds[new_cds_gene] = (
-                        scaffold, D_cds[new_cds_gene][1],
-                        max([int(start), int(end)])
-                    )
-                if min([int(start), int(end)]) < D_cds[new_cds_gene][1]:
-                    D_cds[new_cds_gene] = (
-                        scaffold, min([int(start), int(end)]),
-                        D_cds[new_cds_gene][2]
-                    )
-                D_gff3[new_cds_gene].append((
-                    scaffold, source, feat_type, int(start), int(end),
-                    score, strand, phase
-                ))
-
-            elif feat_type == 'exon':
-                exon_gene = parent_id # mRNA ID
-                new_exon_gene = (prefix, exon_gene)
-
-                D_exon[new_exon_gene].append((
-                    scaffold, source, feat_type, int(start), int(end),
-                    score, strand, phase
-                ))
-
-    return D_gff3, D_gene, D_cds, D_cds_len, D_exon
-
-
-def filtering(
-    D_cds, D_cds_len, D_blastp, D_busco, D_pfam, D_blastn, D_bad, output_dir
-):
-    # Filter good gene models
-    D_cds_filtered = {}
-    for gene_tup, value in D_cds.items():
-        if D_bad[gene_tup]:
-            continue
-        D_cds_filtered[gene_tup] = value
-
-    # Sort CDS: three keys used - scaffold, start, and end
-    D_cds_sorted = sorted(
-        D_cds_filtered.items(), key=lambda x: (x[1][0], x[1][1], x[1][2])
+def write_scores(D_models, D_table, output_dir):
+    # Score table of good gene models, sorted by scaffold, start, and end
+    model_ids = sorted(
+        [
+            x for x in range(num_models(D_models))
+            if has_cds(D_models, x) and not D_table['bad'][x]
+        ],
+        key=lambda x: get_cds_span(D_models, x)
     )
 
-    # Write score table
     outfile_score = os.path.join(output_dir, 'gene_model_scores.txt')
     outhandle_score = open(outfile_score, 'w')
     header_txt = '{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
@@ -297,15 +207,21 @@ def filtering(
         'pfam_score', 'blastn_score', 'score_sum'
     )
     outhandle_score.write(header_txt)
-    for tup in D_cds_sorted:
-        gene_tup = tup[0]
+    # Summed in the order of this table's columns (score column of
+    # evidence_table.py adds pfam before busco)
+    score_sums = (
+        D_table['blastp'] + D_table['busco'] + D_table['pfam'] +
+        D_table['blastn']
+    )
+    for model_id in model_ids:
+        gene_tup = model_key(D_models, model_id)
         software = gene_tup[0]
         software_id = gene_tup[1]
-        blast_score = D_blastp[gene_tup]
-        busco_score = D_busco[gene_tup]
-        pfam_score = D_pfam[gene_tup]
-        blastn_score = D_blastn[gene_tup]
-        score_sum = sum([blast_score, busco_score, pfam_score, blastn_score])
+        blast_score = float(D_table['blastp'][model_id])
+        busco_score = float(D_table['busco'][model_id])
+        pfam_score = float(D_table['pfam'][model_id])
+        blastn_score = float(D_table['blastn'][model_id])
+        score_sum = float(score_sums[model_id])
         row_txt = '{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(
             software, software_id, round(blast_score, 1),
             round(busco_score, 1), round(pfam_score, 1), blastn_score,
@@ -315,91 +231,39 @@ def filtering(
 
     outhandle_score.close()
 
-    # Find chunks
-    model_chunks = []  # It will be list of list
-    tmp_list = [D_cds_sorted[0][0]]  # Initialize
-    i = 1
-    max_cds_end = D_cds_sorted[0][1][2]
-    while i < len(D_cds_sorted):
-        previous_gene_name, previous_tup = D_cds_sorted[i - 1]
-        current_gene_name, current_tup = D_cds_sorted[i]
-
-        previous_scaffold = previous_tup[0]
-        current_scaffold = current_tup[0]
-
-        current_cds_start = current_tup[1]
-        current_cds_end = current_tup[2]
-
-        # If overlapped
-        if previous_scaffold != current_scaffold:
-            model_chunks.append(tmp_list)
-            tmp_list = [current_gene_name]  # Initialize
-            max_cds_end = int(current_cds_end)
-        elif max_cds_end >= current_cds_start:
-            tmp_list.append(current_gene_name)
-            max_cds_end = max(max_cds_end, current_cds_end)
-        else:
-            model_chunks.append(tmp_list)
-            tmp_list = [current_gene_name]  # Initialize
-            max_cds_end = int(current_cds_end)
 
-        i += 1
+def filtering(D_models, model_ids, D_table):
+    # Filter good gene models. Returns model IDs
+    model_ids_filtered = [
+        x for x in model_ids
+        if has_cds(D_models, x) and not D_table['bad'][x]
+    ]
 
-    # Filtering
+    # Sort CDS: three keys used - scaffold, start, and end
+    model_ids_sorted = sorted(
+        model_ids_filtered, key=lambda x: get_cds_span(D_models, x)
+    )
+
+    # Find chunks: blocks of models with overlapping CDS spans
+    D_index = build_index(
+        get_cds_span(D_models, x) + (x,) for x in model_ids_sorted
+    )
+    model_chunks = []  # It will be list of list
+    for scaffold in sorted(D_index):
+        model_chunks += list(iter_blocks(D_index, scaffold))
+
+    # Filtering: best-scoring set of compatible models in each chunk. Ties
+    # (e.g. all scores are zero) go to the maximally covered candidates
     final_gene_set = []
-    i = 1
     for model_chunk in model_chunks:
-        i += 1
-        # Build Graph
-        G = nx.Graph()
-        for gene_name1 in model_chunk:
-            for gene_name2 in model_chunk:
-                G.add_node(gene_name1)
-                scaffold1, start1, end1 = D_cds[gene_name1]
-                scaffold2, start2, end2 = D_cds[gene_name2]
-                if start1 == start2 and end1 == end2:
-                    continue
-                overlap = min(end1, end2) - max(start1, start2)
-                condition1 = overlap < (end1 - start1 + 1) * 0.1
-                condition2 = overlap < (end2 - start2 + 1) * 0.1
-                if overlap == 0 or condition1 and condition2:
-                    G.add_edge(gene_name1, gene_name2)
-        all_combs = list(nx.find_cliques(G))
-
-        # Get score and pick best one
-        max_score = 0
-        final_chunk = []
-        for comb in all_combs:
-            score = 0
-            for element in comb:
-                blast_score = D_blastp[element]
-                busco_score = D_busco[element]
-                pfam_score = D_pfam[element]
-                blastn_score = D_blastn[element]
-
-                score += sum(
-                    [blast_score, pfam_score, busco_score, blastn_score]
-                )
+        intervals = [get_cds_span(D_models, x)[1:] for x in model_chunk]
+        weights = [
+            (float(D_table['score'][x]), get_cds_len(D_models, x))
+            for x in model_chunk
+        ]
 
-            if score == max_score:
-                final_chunk += [comb]
-            elif score > max_score:
-                final_chunk = [comb]
-                max_score = score
-
-        # If all scores are zero, get maximally covered candidates
-        if max_score == 0 and len(final_chunk) > 1:
-            max_cds_len = 0
-            for comb in final_chunk:
-                total_cds_len = sum(D_cds_len[x] for x in comb)
-                if total_cds_len > max_cds_len:
-                    final_chunk2 = comb
-                    max_cds_len = total_cds_len
-        else:
-            final_chunk2 = final_chunk[0]
-
-        # Get score per element
-        final_gene_set += final_chunk2
+        selected = select_intervals(intervals, weights)
+        final_gene_set += [model_chunk[x] for x in selected]
 
     return final_gene_set
 
@@ -433,30 +297,27 @@ def write_final_prots(final_gene_set, D_mapping, output_dir):
     outhandle_protnames.close()
 
 
-def write_files(
-    genome_assembly, final_gene_set, D_gene, D_gff3, D_prot, D_exon, output_dir,
-    D_cds
-):
+def write_files(genome_assembly, D_models, final_gene_set, D_prot, output_dir):
     D_scaffold = {}
-    scaffold_i = 0
-    genome_assembly_txt = import_file(genome_assembly)
-    for line in genome_assembly_txt:
-        if not line.startswith('>'):
-            continue
-        scaffold_name = line.split(' ')[0].replace('>', '')
+    for scaffold_i, scaffold_name in enumerate(
+        seq_names(open_genome(genome_assembly))
+    ):
         D_scaffold[scaffold_name] = scaffold_i
-        scaffold_i += 1
     final_gene_set_sorted = sorted(
-        final_gene_set, key=lambda x: (D_scaffold[D_gene[x][0]], D_cds[x][1])
+        final_gene_set, key=lambda x: (
+            D_scaffold[get_transcript(D_models, x)[0]],
+            get_cds_span(D_models, x)[1]
+        )
     )
     output_gff3 = open(os.path.join(output_dir, 'filtered_1.gff3'), 'w')
     output_gff3.write('##gff-version 3\n')  # gff3 Header
     i = 1
-    for gene in final_gene_set_sorted:
+    for model_id in final_gene_set_sorted:
+        gene = model_key(D_models, model_id)
         (
             gscaffold, gsource, gfeat_type, gstart, gend, gscore,
             gstrand, gphase
-        ) = D_gene[gene]
+        ) = get_transcript(D_models, model_id)
         gid = 'ID={}_{};prediction_source={}:{}'.format(
             'gene', str(i).zfill(5), gene[0], gene[1]
         )
@@ -473,9 +334,11 @@ def write_files(
             gphase, mid
         ))
 
-        if gene in D_exon:
+        cds_features = get_features(D_models, model_id, 'CDS')
+        exon_features = get_features(D_models, model_id, 'exon')
+        if exon_features:
             j = 1
-            for exon in D_exon[gene]:
+            for exon in exon_features:
                 (
                     escaffold, esource, efeat_type, estart, eend, escore,
                     estrand, ephase
@@ -491,7 +354,7 @@ def write_files(
                 j += 1
         else:
             j = 1
-            for cds in D_gff3[gene]:
+            for cds in cds_features:
                 (
                     cscaffold, csource, cfeat_type, cstart, cend, cscore,
                     cstrand, cphase
@@ -506,7 +369,7 @@ def write_files(
                 j += 1
 
         j = 1
-        for cds in D_gff3[gene]:
+        for cds in cds_features:
             (
                 cscaffold, csource, cfeat_type, cstart, cend, cscore,
                 cstrand, cphase
@@ -526,7 +389,8 @@ def write_files(
 
     # Write protein faa file
     output_prot = open(os.path.join(output_dir, 'filtered_prot.faa'), 'w')
-    for gene_num, gene in enumerate(final_gene_set_sorted, start=1):
+    for gene_num, model_id in enumerate(final_gene_set_sorted, start=1):
+        gene = model_key(D_models, model_id)
         output_prot.write('>{}_{}.t1 prediction_source={}:{}\n'.format(
             'gene', str(gene_num).zfill(5), gene[0], gene[1]
         ))
@@ -18,6 +18,7 @@ This script runs the pipeline with following order.
     3) Evaluation and filtering
         make_nr_prot.py
         make_transcripts.py
+        make_nr_transcript.py
         run_busco.py
         run_pfam_scan.py
         run_blastp.py
@@ -26,6 +27,7 @@ This script runs the pipeline with following order.
         import_busco.py
         import_pfam.py
         import_blastn.py
+        evidence_table.py
         catch_bad_genes.py
         filter_gff3s.py
         gff3_postprocess.py
@@ -33,6 +35,18 @@ This script runs the pipeline with following order.
     4) Write output
         copy_output.py
         create_markdown.py
+
+Steps are run by stage_scheduler.py as a dependency graph: a step starts as
+soon as the steps it depends on are finished and resource_broker.py leases
+it cores (and memory) from --num_cores (--max_memory), so independent steps
+run concurrently without oversubscribing the node.
+
+Python-only steps (make_nr_prot.py, make_transcripts.py,
+make_nr_transcript.py, import_*.py, evidence_table.py, catch_bad_genes.py,
+filter_gff3s.py, gff3_postprocess.py, copy_output.py and create_markdown.py)
+are called in this process. The mapping and bad gene dictionaries are passed
+between them in memory, and the evidence scores through the evidence table
+(gene_filtering/evidence_table.npy).
 '''
 
 # Version
@@ -54,6 +68,27 @@ this_dir = os.path.dirname(this_path)
 sys.path.append(this_dir)
 from set_logging import set_logging
 from check_inputs import check_inputs
+from import_config import import_config
+from stage_scheduler import make_stage, run_stages
+from checkpoint import init_checkpoint
+
+# Python-only steps, run in-process
+import make_nr_prot as make_nr_prot_py
+import make_transcripts as make_transcripts_py
+import make_nr_transcript as make_nr_transcript_py
+import import_blastp as import_blastp_py
+import import_busco as import_busco_py
+import import_pfam as import_pfam_py
+import import_blastn as import_blastn_py
+import evidence_table as evidence_table_py
+import catch_bad_genes as catch_bad_genes_py
+import filter_gff3s as filter_gff3s_py
+import gff3_postprocess as gff3_postprocess_py
+import copy_output as copy_output_py
+import create_markdown as create_markdown_py
+
+# Parameters
+D_conf = import_config(this_dir)
 
 # File paths
 run_check_dependencies_path = os.path.join(this_dir, 'check_dependencies.py')
@@ -70,11 +105,13 @@ run_pfam_scan_path = os.path.join(this_dir, 'run_pfam_scan.py')
 make_nr_prot_path = os.path.join(this_dir, 'make_nr_prot.py')
 run_blastp_path = os.path.join(this_dir, 'run_blastp.py')
 make_transcripts_path = os.path.join(this_dir, 'make_transcripts.py')
+make_nr_transcript_path = os.path.join(this_dir, 'make_nr_transcript.py')
 run_blastn_path = os.path.join(this_dir, 'run_blastn.py')
 import_blast_path = os.path.join(this_dir, 'import_blastp.py')
 import_busco_path = os.path.join(this_dir, 'import_busco.py')
 import_pfam_path = os.path.join(this_dir, 'import_pfam.py')
 import_blastn_path = os.path.join(this_dir, 'import_blastn.py')
+evidence_table_path = os.path.join(this_dir, 'evidence_table.py')
 catch_bad_genes_path = os.path.join(this_dir, 'catch_bad_genes.py')
 filter_gff3s_path = os.path.join(this_dir, 'filter_gff3s.py')
 gff3_postprocess_path = os.path.join(this_dir, 'gff3_postprocess.py')
@@ -127,6 +164,27 @@ def main(argv):
         '-c', '--num_cores', nargs='?', default=1, type=int,
         help='Number of cores to be used (default: 1)'
     )
+    parser.add_argument(
+        '--max_memory', nargs='?', default=None, type=int,
+        help=(
+            'Memory (GB) shared by concurrently running tools '
+            '(default: not limited)'
+        )
+    )
+    parser.add_argument(
+        '--write_pickles', action='store_true',
+        help=(
+            'Also write the bad gene dictionary to gene_filtering/D_bad.p '
+            '(input of filter_gff3s.py run by hand)'
+        )
+    )
+    parser.add_argument(
+        '--cache_db', nargs='?', default=None,
+        help=(
+            'SQLite cache of BLASTp and Pfam_scan results per protein, '
+            'shared across runs (optional)'
+        )
+    )
     parser.add_argument(
         '-v', '--version', action='version',
         version='%(prog)s {}'.format(__version__)
@@ -160,7 +218,13 @@ def main(argv):
     augustus_species = args.augustus_species[0]
     sister_proteome = os.path.abspath(args.sister_proteome[0])
     num_cores = args.num_cores
+    max_memory = args.max_memory
     max_intron = args.max_intron
+    write_pickles = args.write_pickles
+    if args.cache_db:
+        cache_db = os.path.abspath(args.cache_db)
+    else:
+        cache_db = None
 
     # For non-fungus genomes
     if args.no_braker_fungus:
@@ -195,85 +259,232 @@ def main(argv):
         trans_read_1, trans_read_2, trans_read_single, trans_bam,
         genome_assembly, sister_proteome
     )
-    trans_bams = run_hisat2(
-        genome_assembly, trans_read_files, output_dir, num_cores, max_intron
-    )
-    trinity_asms = run_trinity(
-        trans_bams, output_dir, num_cores, no_jaccard_clip, max_intron
-    )
-    repeat_model_file = run_repeat_modeler(
-        genome_assembly, output_dir, num_cores
-    )
-    maker_gff3s, maker_faas = run_maker(
-        genome_assembly, output_dir, augustus_species, sister_proteome,
-        num_cores, repeat_model_file, trinity_asms, no_genemark_fungus
-    )
-    # Get masked assembly
+
+    # Get masked assembly (generated by Maker run3)
     masked_assembly = os.path.join(
         output_dir, 'maker_out', 'masked_assembly.fasta'
     )
-
-    # Run Augustus
-    augustus_gff3, augustus_faa = run_augustus(
-        masked_assembly, output_dir, augustus_species
-    )
-
-    # Run Braker1
-    braker1_gff3s, braker1_faas = run_braker1(
-        masked_assembly, trans_bams, output_dir, num_cores, no_braker_fungus
-    )
-
-    # Run BUSCO on each gene models
-    faa_files = [augustus_faa] + maker_faas + braker1_faas
-    for faa_file in faa_files:
-        run_busco(faa_file, output_dir, num_cores)
     busco_out_dir = os.path.join(output_dir, 'busco_out')
-
-    # Get protein nr by removing identical proteins
-    nr_prot_file, nr_prot_mapping_file = make_nr_prot(faa_files, output_dir)
-
-    # Run BLASTp with nr prot file
-    blastp_output = run_blastp(
-        nr_prot_file, output_dir, sister_proteome, num_cores
+    trinity_memory = 10  # GB, max_memory in run_trinity.py
+    predictor_stages = ['augustus', 'maker', 'braker1']
+
+    # Each stage is started as soon as its dependencies are finished. Stages
+    # whose inputs, parameters and tools did not change since the last run
+    # are skipped (see checkpoint.py)
+    D_checkpoint = init_checkpoint(output_dir)
+    stages = [
+        # Preprocessing
+        make_stage(
+            'hisat2', lambda D, c: run_hisat2(
+                genome_assembly, trans_read_files, output_dir, c, max_intron
+            ), max_cores=num_cores,
+            inputs=[genome_assembly] + trans_read_files,
+            params={'max_intron': max_intron},
+            tools=[run_hisat2_path, D_conf['HISAT2_PATH']]
+        ),
+        make_stage(
+            'repeat_modeler', lambda D, c: run_repeat_modeler(
+                genome_assembly, output_dir, c
+            ), max_cores=num_cores, inputs=[genome_assembly],
+            tools=[run_repeat_modeler_path, D_conf['REPEATMODELER_PATH']]
+        ),
+        make_stage(
+            'trinity', lambda D, c: run_trinity(
+                D['hisat2'], output_dir, c, no_jaccard_clip, max_intron
+            ), deps=['hisat2'], max_cores=num_cores, memory=trinity_memory,
+            params={'jaccard_clip': no_jaccard_clip, 'max_intron': max_intron},
+            tools=[run_trinity_path, D_conf['TRINITY_PATH']]
+        ),
+
+        # Gene prediction
+        make_stage(
+            'maker', lambda D, c: run_maker(
+                genome_assembly, output_dir, augustus_species,
+                sister_proteome, c, D['repeat_modeler'], D['trinity'],
+                no_genemark_fungus
+            ), deps=['trinity', 'repeat_modeler'], max_cores=num_cores,
+            inputs=[genome_assembly, sister_proteome],
+            params={
+                'augustus_species': augustus_species,
+                'genemark_fungus': no_genemark_fungus
+            },
+            tools=[
+                run_maker_path, D_conf['MAKER_PATH'], D_conf['GENEMARK_PATH']
+            ]
+        ),
+        make_stage(
+            'augustus', lambda D, c: run_augustus(
+                masked_assembly, output_dir, augustus_species, c
+            ), deps=['maker'], max_cores=num_cores, inputs=[masked_assembly],
+            params={'augustus_species': augustus_species},
+            tools=[run_augustus_path, D_conf['AUGUSTUS_PATH']],
+            work_dirs=[
+                os.path.join(output_dir, 'augustus_out', 'augustus_batches')
+            ]
+        ),
+        make_stage(
+            'braker1', lambda D, c: run_braker1(
+                masked_assembly, D['hisat2'], output_dir, c, no_braker_fungus
+            ), deps=['hisat2', 'maker'], max_cores=num_cores,
+            inputs=[masked_assembly],
+            params={'braker_fungus': no_braker_fungus},
+            tools=[run_braker1_path, D_conf['BRAKER1_PATH']]
+        ),
+
+        # Evaluation
+        make_stage(
+            'busco', lambda D, c: run_busco(
+                D['make_nr_prot'][0], output_dir, c
+            ), deps=['make_nr_prot'], max_cores=num_cores,
+            tools=[
+                run_busco_path, D_conf['BUSCO_PATH'], D_conf['BUSCO_DB_PATH']
+            ]
+        ),
+        make_stage(
+            'make_nr_prot', lambda D, c: make_nr_prot(
+                get_faa_files(D), output_dir
+            ), deps=predictor_stages, tools=[make_nr_prot_path]
+        ),
+        make_stage(
+            'blastp', lambda D, c: run_blastp(
+                D['make_nr_prot'][0], output_dir, sister_proteome, c,
+                cache_db
+            ), deps=['make_nr_prot'], max_cores=num_cores,
+            inputs=[sister_proteome],
+            tools=[run_blastp_path, D_conf['BLASTP_PATH']],
+            work_dirs=[
+                os.path.join(output_dir, 'gene_filtering', x) for x in (
+                    'nr_prot_blastp_shards',
+                    'nr_prot.blastp_miss_blastp_shards'
+                )
+            ]
+        ),
+        make_stage(
+            'pfam_scan', lambda D, c: run_pfam_scan(
+                D['make_nr_prot'][0], output_dir, c, cache_db
+            ), deps=['make_nr_prot'], max_cores=num_cores,
+            tools=[
+                run_pfam_scan_path, D_conf['PFAM_SCAN_PATH'],
+                D_conf['PFAM_DB_PATH']
+            ],
+            work_dirs=[
+                os.path.join(output_dir, 'gene_filtering', x) for x in (
+                    'nr_prot_shards', 'nr_prot.pfam_miss_shards'
+                )
+            ]
+        ),
+        make_stage(
+            'trinity_transcripts', lambda D, c: concat_trinity_asms(
+                D['trinity'], output_dir
+            ), deps=['trinity'], tools=[D_conf['MAKEBLASTDB_PATH']]
+        ),
+        make_stage(
+            'blastn', lambda D, c: run_blastns(
+                get_gff3_files(D), genome_assembly,
+                D['trinity_transcripts'], output_dir, c
+            ), deps=predictor_stages + ['trinity_transcripts'],
+            max_cores=num_cores, inputs=[genome_assembly],
+            tools=[
+                make_transcripts_path, make_nr_transcript_path,
+                run_blastn_path, D_conf['BLASTN_PATH']
+            ]
+        ),
+
+        # Import BLAST, BUSCO and Pfam score
+        make_stage(
+            'import_blastp', lambda D, c: import_blastp(
+                D['blastp'], D['make_nr_prot'][1], output_dir
+            ), deps=['blastp', 'make_nr_prot'],
+            tools=[import_blast_path, evidence_table_path]
+        ),
+        make_stage(
+            'import_busco', lambda D, c: import_busco(
+                busco_out_dir, D['make_nr_prot'][1], output_dir
+            ), deps=['busco', 'make_nr_prot'],
+            tools=[import_busco_path, evidence_table_path]
+        ),
+        make_stage(
+            'import_pfam', lambda D, c: import_pfam(
+                D['pfam_scan'], D['make_nr_prot'][1], output_dir
+            ), deps=['pfam_scan', 'make_nr_prot'],
+            tools=[import_pfam_path, evidence_table_path]
+        ),
+        make_stage(
+            'import_blastn', lambda D, c: import_blastn(
+                D['blastn'][0], D['blastn'][1], D['make_nr_prot'][1],
+                output_dir
+            ), deps=['blastn', 'make_nr_prot'],
+            tools=[import_blastn_path, evidence_table_path]
+        ),
+        make_stage(
+            'evidence_table', lambda D, c: evidence_table(
+                [
+                    D['import_blastp'], D['import_busco'], D['import_pfam'],
+                    D['import_blastn']
+                ], output_dir
+            ), deps=[
+                'import_blastp', 'import_busco', 'import_pfam',
+                'import_blastn'
+            ], tools=[evidence_table_path]
+        ),
+
+        # Filtering
+        make_stage(
+            'catch_bad_genes', lambda D, c: catch_bad_genes(
+                get_gff3_files(D), genome_assembly, output_dir, c,
+                write_pickles
+            ), deps=predictor_stages, max_cores=num_cores,
+            inputs=[genome_assembly],
+            params={'write_pickles': write_pickles},
+            tools=[catch_bad_genes_path]
+        ),
+        make_stage(
+            'filter_gff3s', lambda D, c: filter_gff3s(
+                genome_assembly, get_gff3_files(D), D['make_nr_prot'],
+                D['evidence_table'], D['catch_bad_genes'], output_dir
+            ), deps=predictor_stages + [
+                'make_nr_prot', 'evidence_table', 'catch_bad_genes'
+            ], inputs=[genome_assembly],
+            tools=[filter_gff3s_path, evidence_table_path]
+        ),
+        make_stage(
+            'gff3_postprocess', lambda D, c: gff3_postprocess(
+                genome_assembly, output_dir
+            ), deps=['filter_gff3s'], inputs=[genome_assembly],
+            tools=[gff3_postprocess_path]
+        ),
+
+        # Write output
+        make_stage(
+            'copy_output', lambda D, c: copy_output(output_dir),
+            deps=['filter_gff3s', 'gff3_postprocess'],
+            tools=[copy_output_path]
+        ),
+        make_stage(
+            'create_markdown', lambda D, c: create_markdown(
+                genome_assembly, output_dir, D['hisat2'], D['trinity']
+            ), deps=['hisat2', 'trinity', 'copy_output'],
+            inputs=[genome_assembly], tools=[create_markdown_path]
+        ),
+    ]
+    run_stages(
+        stages, num_cores, logger_time, logger_txt, max_memory, D_checkpoint
     )
+    logger_time.debug('## DONE: FunGAP ##')
 
-    # Run Pfam_scan with nr prot file
-    pfam_scan_out = run_pfam_scan(nr_prot_file, output_dir, num_cores)
-
-    # Concatenate all transcripts files
-    gene_filtering_dir = os.path.join(output_dir, 'gene_filtering')
-    trinity_asm = os.path.join(gene_filtering_dir, 'trinity_transcripts.fna')
-    command = 'cat {} > {}'.format(' '.join(trinity_asms), trinity_asm)
-    logger_time.debug('Create transcript')
-    logger_txt.debug('[Run] {}'.format(command))
-    os.system(command)
-
-    gff3_files = [augustus_gff3] + maker_gff3s + braker1_gff3s
-    blastn_out_files = []
-    for gff3_file in gff3_files:
-        transcript_file = make_transcripts(genome_assembly, gff3_file)
-        blastn_out_file = run_blastn(transcript_file, trinity_asm, output_dir)
-        blastn_out_files.append(blastn_out_file)
-
-    # Import BLAST, BUSCO and Pfam score
-    blastp_dict = import_blastp(blastp_output, nr_prot_mapping_file)
-    busco_dict = import_busco(busco_out_dir, output_dir)
-    pfam_dict = import_pfam(pfam_scan_out, nr_prot_mapping_file)
-    blastn_dict = import_blastn(blastn_out_files, output_dir)
 
-    # Catch bad genes
-    bad_dict = catch_bad_genes(gff3_files, genome_assembly, output_dir)
-    filter_gff3s(
-        gff3_files, blastp_dict, busco_dict, pfam_dict, blastn_dict, bad_dict,
-        nr_prot_file, nr_prot_mapping_file, output_dir
-    )
-    gff3_postprocess(genome_assembly, output_dir)
+def get_gff3_files(D_result):
+    augustus_gff3 = D_result['augustus'][0]
+    maker_gff3s = D_result['maker'][0]
+    braker1_gff3s = D_result['braker1'][0]
+    return [augustus_gff3] + maker_gff3s + braker1_gff3s
 
-    # Copy output files
-    copy_output(output_dir)
 
-    # Create markdown
-    create_markdown(genome_assembly, output_dir, trans_bams, trinity_asms)
+def get_faa_files(D_result):
+    augustus_faa = D_result['augustus'][1]
+    maker_faas = D_result['maker'][1]
+    braker1_faas = D_result['braker1'][1]
+    return [augustus_faa] + maker_faas + braker1_faas
 
 
 def create_dir(output_dir):
@@ -404,16 +615,16 @@ def run_maker(
     return maker_gff3s, maker_faas
 
 
-def run_augustus(masked_assembly, output_dir, augustus_species):
+def run_augustus(masked_assembly, output_dir, augustus_species, num_cores):
     # run_augustus.py -m <masked_assembly> -s <species> -o <output_dir>
-    # -l <log_dir>
+    # -l <log_dir> -c <num_cores>
     output_dir = os.path.join(output_dir, 'augustus_out')
     log_dir = os.path.join(output_dir, 'logs')
     command = (
         'python {} --masked_assembly {} --species {} --output_dir {} '
-        '--log_dir {}'.format(
+        '--log_dir {} --num_cores {}'.format(
             run_augustus_path, masked_assembly, augustus_species, output_dir,
-            log_dir
+            log_dir, num_cores
         )
     )
     logger_time.debug('START: wrapper_run_augustus')
@@ -465,6 +676,8 @@ def run_braker1(
 
 
 def run_busco(input_faa, output_dir, num_cores):
+    # BUSCO is run once on nr_prot.faa; scores are mapped back to the genes
+    # of each predictor by import_busco
     busco_output_dir = os.path.join(output_dir, 'busco_out')
     log_dir = os.path.join(output_dir, 'logs')
     # run_busco.py -i <input_fasta> -o <output_dir> -l <log_dir> -c <num_cores>
@@ -480,28 +693,34 @@ def run_busco(input_faa, output_dir, num_cores):
     check_call(command_args)
     logger_time.debug('DONE : wrapper_run_busco\n')
 
+    input_base = os.path.splitext(os.path.basename(input_faa))[0]
+    busco_run_dir = os.path.join(busco_output_dir, 'run_{}'.format(input_base))
+    return busco_run_dir
+
 
 def make_nr_prot(faa_files, output_dir):
     gene_filtering_dir = os.path.join(output_dir, 'gene_filtering')
-    # make_nr_prot.py -i <faa_files> -o <output_dir>
-    command = 'python {} --faa_files {} --output_dir {}'.format(
-        make_nr_prot_path, ' '.join(faa_files), gene_filtering_dir
+    logger_time.debug('START: make_nr_prot')
+    logger_txt.debug('[In-process] make_nr_prot.py {}'.format(
+        ' '.join(faa_files)
+    ))
+    make_nr_prot_py.create_dir(gene_filtering_dir)
+    D_mapping, D_mapping_rev = make_nr_prot_py.make_nr_prot(
+        faa_files, gene_filtering_dir
     )
-    logger_time.debug('START: wrapper_make_nr_prot')
-    logger_txt.debug('[Wrapper] {}'.format(command))
-    command_args = shlex.split(command)
-    check_call(command_args)
-    logger_time.debug('DONE : wrapper_make_nr_prot\n')
+    logger_time.debug('DONE : make_nr_prot\n')
 
     nr_prot_file = os.path.join(gene_filtering_dir, 'nr_prot.faa')
     nr_prot_mapping_file = os.path.join(
         gene_filtering_dir, 'nr_prot_mapping.txt'
     )
 
-    return nr_prot_file, nr_prot_mapping_file
+    return nr_prot_file, nr_prot_mapping_file, D_mapping, D_mapping_rev
 
 
-def run_blastp(nr_prot_file, output_dir, sister_proteome, num_cores):
+def run_blastp(
+    nr_prot_file, output_dir, sister_proteome, num_cores, cache_db=None
+):
     # run_blastp.py -q <query_fasta> -d <db_fasta> -l <log_dir> -c <num_cores>
     log_dir = os.path.join(output_dir, 'logs')
     command = (
@@ -511,6 +730,8 @@ def run_blastp(nr_prot_file, output_dir, sister_proteome, num_cores):
             num_cores
         )
     )
+    if cache_db:
+        command += ' --cache_db {}'.format(cache_db)
     logger_time.debug('START: wrapper_run_blastp')
     logger_txt.debug('[Wrapper] {}'.format(command))
     command_args = shlex.split(command)
@@ -522,12 +743,14 @@ def run_blastp(nr_prot_file, output_dir, sister_proteome, num_cores):
     return blastp_output
 
 
-def run_pfam_scan(nr_prot_file, output_dir, num_cores):
+def run_pfam_scan(nr_prot_file, output_dir, num_cores, cache_db=None):
     # run_pfam_scan.py -i <input_fasta> -l <log_dir> -c <num_cores>
     log_dir = os.path.join(output_dir, 'logs')
     command = 'python {} --input_fasta {} --log_dir {} --num_cores {}'.format(
         run_pfam_scan_path, nr_prot_file, log_dir, num_cores
     )
+    if cache_db:
+        command += ' --cache_db {}'.format(cache_db)
     logger_time.debug('START: wrapper_run_pfam_scan')
     logger_txt.debug('[Wapper] {}'.format(command))
     command_args = shlex.split(command)
@@ -540,26 +763,63 @@ def run_pfam_scan(nr_prot_file, output_dir, num_cores):
     return pfam_scan_out
 
 
-def make_transcripts(genome_assembly, gff3_file):
-    # make_transcripts.py -f <input_fasta> -g <input_gff3>
-    command = 'python {} --input_fasta {} --input_gff3 {}'.format(
-        make_transcripts_path, genome_assembly, gff3_file
+def concat_trinity_asms(trinity_asms, output_dir):
+    # Concatenate all transcripts files
+    gene_filtering_dir = os.path.join(output_dir, 'gene_filtering')
+    if not os.path.exists(gene_filtering_dir):
+        os.mkdir(gene_filtering_dir)
+
+    trinity_asm = os.path.join(gene_filtering_dir, 'trinity_transcripts.fna')
+    command = 'cat {} > {}'.format(' '.join(trinity_asms), trinity_asm)
+    logger_time.debug('Create transcript')
+    logger_txt.debug('[Run] {}'.format(command))
+    os.system(command)
+
+    # BLASTn database shared by the BLASTn runs of all predictors
+    log_file = os.path.join(output_dir, 'logs', 'makeblastdb_trinity.log')
+    command = '{} -in {} -dbtype nucl > {} 2>&1'.format(
+        D_conf['MAKEBLASTDB_PATH'], trinity_asm, log_file
     )
-    logger_time.debug('START: wrapper_make_transcripts')
-    logger_txt.debug('[Wapper] {}'.format(command))
-    command_args = shlex.split(command)
-    check_call(command_args)
-    logger_time.debug('DONE : wrapper_make_transcripts\n')
+    logger_txt.debug('[Run] {}'.format(command))
+    os.system(command)
+    return trinity_asm
+
+
+def make_transcripts(genome_assembly, gff3_file):
+    logger_time.debug('START: make_transcripts')
+    logger_txt.debug('[In-process] make_transcripts.py {}'.format(gff3_file))
+    transcript_file = make_transcripts_py.parse_gff3(genome_assembly, gff3_file)
+    logger_time.debug('DONE : make_transcripts\n')
 
-    gff3_base = os.path.splitext(gff3_file)[0]
-    transcript_file = '{}_transcript.fna'.format(gff3_base)
     return transcript_file
 
 
-def run_blastn(predicted_transcript, assembled_transcript, output_dir):
+def make_nr_transcript(transcript_files, output_dir):
+    gene_filtering_dir = os.path.join(output_dir, 'gene_filtering')
+    logger_time.debug('START: make_nr_transcript')
+    logger_txt.debug('[In-process] make_nr_transcript.py {}'.format(
+        ' '.join(transcript_files)
+    ))
+    make_nr_transcript_py.create_dir(gene_filtering_dir)
+    make_nr_transcript_py.make_nr_transcript(
+        transcript_files, gene_filtering_dir
+    )
+    logger_time.debug('DONE : make_nr_transcript\n')
+
+    nr_transcript_file = os.path.join(gene_filtering_dir, 'nr_transcript.fna')
+    nr_transcript_mapping_file = os.path.join(
+        gene_filtering_dir, 'nr_transcript_mapping.txt'
+    )
+
+    return nr_transcript_file, nr_transcript_mapping_file
+
+
+def run_blastn(
+    predicted_transcript, assembled_transcript, output_dir, num_cores=1
+):
     gene_filtering_dir = os.path.join(output_dir, 'gene_filtering')
     prefix = re.sub(
-        r'_transcript\.fna', '', os.path.basename(predicted_transcript)
+        r'(_transcript)?\.fna$', '', os.path.basename(predicted_transcript)
     )
     out_prefix = os.path.join(gene_filtering_dir, prefix)
     log_dir = os.path.join(output_dir, 'logs')
@@ -567,9 +827,9 @@ def run_blastn(predicted_transcript, assembled_transcript, output_dir):
     # -l <log_dir> -c <num_cores>
     command = (
         'python {} --query_fasta {} --db_fasta {} --output_prefix {} '
-        '--log_dir {}'.format(
+        '--log_dir {} --num_cores {}'.format(
             run_blastn_path, predicted_transcript, assembled_transcript,
-            out_prefix, log_dir
+            out_prefix, log_dir, num_cores
         )
     )
     logger_time.debug('START: wrapper_run_blastn')
@@ -582,165 +842,184 @@ def run_blastn(predicted_transcript, assembled_transcript, output_dir):
     return blastn_out
 
 
-def import_blastp(blastp_output, nr_prot_mapping_file):
-    # import_blastp.py -b <blastp_out_file> -n <nr_prot_mapping>
-    blastp_out_dir = os.path.dirname(blastp_output)
-    command = 'python {} --blastp_out_file {} --nr_prot_mapping {}'.format(
-        import_blast_path, blastp_output, nr_prot_mapping_file
+def run_blastns(
+    gff3_files, genome_assembly, trinity_asm, output_dir, num_cores=1
+):
+    # Predictors often share transcripts, so the transcripts of all of them
+    # are made nonredundant and searched by a single BLASTn with all cores.
+    # Returns (blastn output, nr_transcript_mapping.txt); only paths, so the
+    # mapping is not stored in the checkpoint manifest
+    transcript_files = [
+        make_transcripts(genome_assembly, x) for x in gff3_files
+    ]
+    nr_transcript_file, nr_transcript_mapping_file = make_nr_transcript(
+        transcript_files, output_dir
     )
-    logger_time.debug('START: wrapper_import_blastp')
-    logger_txt.debug('[Wrapper] {}'.format(command))
-    os.system(command)
-    logger_time.debug('DONE : wrapper_import_blastp\n')
+    blastn_out = run_blastn(
+        nr_transcript_file, trinity_asm, output_dir, num_cores
+    )
+    return blastn_out, nr_transcript_mapping_file
 
-    # Return files
-    blastp_dict= os.path.join(blastp_out_dir, 'blastp_score.p')
 
-    return blastp_dict
+def get_pickle(output_dir, file_name, write_pickles):
+    # The bad gene dictionary is only written to disk on request
+    if not write_pickles:
+        return None
+    return os.path.join(output_dir, 'gene_filtering', file_name)
 
 
-def import_busco(busco_out_dir, output_dir):
-    # import_busco.py -b <busco_dir> -o <output_dir>
+def import_blastp(blastp_output, nr_prot_mapping_file, output_dir):
     gene_filtering_dir = os.path.join(output_dir, 'gene_filtering')
-    command = 'python {} --busco_dir {} --output_dir {}'.format(
-        import_busco_path, busco_out_dir, gene_filtering_dir
+    logger_time.debug('START: import_blastp')
+    logger_txt.debug('[In-process] import_blastp.py {}'.format(blastp_output))
+    keys, D_rows = evidence_table_py.import_rows(nr_prot_mapping_file)
+    blastp_column = evidence_table_py.get_column_file(
+        gene_filtering_dir, 'blastp'
     )
-    logger_time.debug('START: wrapper_import_busco')
-    logger_txt.debug('[Wrapper] {}'.format(command))
-    os.system(command)
-    logger_time.debug('DONE : wrapper_import_busco\n')
-
-    # Return files
-    busco_dict = os.path.join(gene_filtering_dir, 'busco_score.p')
+    import_blastp_py.import_blastp(
+        blastp_output, D_rows, len(keys), blastp_column
+    )
+    logger_time.debug('DONE : import_blastp\n')
 
-    return busco_dict
+    return blastp_column
 
 
-def import_pfam(pfam_scan_out, nr_prot_mapping_file):
-    # import_pfam.py -p <pfam_scan_out_file> -n <nr_prot_mapping>
-    command = 'python {} --pfam_scan_out_file {} --nr_prot_mapping {}'.format(
-        import_pfam_path, pfam_scan_out, nr_prot_mapping_file
+def import_busco(busco_out_dir, nr_prot_mapping_file, output_dir):
+    gene_filtering_dir = os.path.join(output_dir, 'gene_filtering')
+    logger_time.debug('START: import_busco')
+    logger_txt.debug('[In-process] import_busco.py {}'.format(busco_out_dir))
+    keys, D_rows = evidence_table_py.import_rows(nr_prot_mapping_file)
+    busco_column = evidence_table_py.get_column_file(
+        gene_filtering_dir, 'busco'
     )
-    logger_time.debug('START: wrapper_import_pfam')
-    logger_txt.debug('[Wrapper] {}'.format(command))
-    os.system(command)
-    logger_time.debug('DONE : wrapper_import_pfam\n')
+    import_busco_py.import_busco(
+        busco_out_dir, gene_filtering_dir, keys, D_rows, busco_column
+    )
+    logger_time.debug('DONE : import_busco\n')
+
+    return busco_column
+
 
-    # Return files
-    pfam_scan_out_dir = os.path.dirname(pfam_scan_out)
-    pfam_dict = os.path.join(pfam_scan_out_dir, 'pfam_score.p')
+def import_pfam(pfam_scan_out, nr_prot_mapping_file, output_dir):
+    gene_filtering_dir = os.path.join(output_dir, 'gene_filtering')
+    logger_time.debug('START: import_pfam')
+    logger_txt.debug('[In-process] import_pfam.py {}'.format(pfam_scan_out))
+    keys, D_rows = evidence_table_py.import_rows(nr_prot_mapping_file)
+    pfam_column = evidence_table_py.get_column_file(gene_filtering_dir, 'pfam')
+    import_pfam_py.import_pfam(pfam_scan_out, D_rows, len(keys), pfam_column)
+    logger_time.debug('DONE : import_pfam\n')
 
-    return pfam_dict
+    return pfam_column
 
 
-def import_blastn(blastn_out_files, output_dir):
+def import_blastn(
+    blastn_output, nr_transcript_mapping_file, nr_prot_mapping_file,
+    output_dir
+):
     gene_filtering_dir = os.path.join(output_dir, 'gene_filtering')
-    # import_blastn.py -b <blastn_out_files> -o <output_dir>
-    command = 'python {} --blastn_out_files {} --output_dir {}'.format(
-        import_blastn_path, ' '.join(blastn_out_files), gene_filtering_dir
+    logger_time.debug('START: import_blastn')
+    logger_txt.debug('[In-process] import_blastn.py {} {}'.format(
+        blastn_output, nr_transcript_mapping_file
+    ))
+    D_mapping_rev = import_blastn_py.import_mapping(nr_transcript_mapping_file)
+    keys, _ = evidence_table_py.import_rows(nr_prot_mapping_file)
+    blastn_column = evidence_table_py.get_column_file(
+        gene_filtering_dir, 'blastn'
     )
-    logger_time.debug('START: wrapper_import_blastn')
-    logger_txt.debug('[Wrapper] {}'.format(command))
-    os.system(command)
-    logger_time.debug('DONE : wrapper_import_blastn\n')
-    blastn_dict = os.path.join(gene_filtering_dir, 'blastn_score.p')
+    import_blastn_py.import_blastn(
+        [blastn_output], keys, blastn_column, D_mapping_rev
+    )
+    logger_time.debug('DONE : import_blastn\n')
 
-    return blastn_dict
+    return blastn_column
 
 
-def catch_bad_genes(gff3_files, genome_assembly, output_dir):
-    # catch_bad_genes.py -g <gff3_files> -a <genome_assembly> -o <output_dir>
+def evidence_table(column_files, output_dir):
     gene_filtering_dir = os.path.join(output_dir, 'gene_filtering')
-    command = (
-        'python {} --gff3_files {} --genome_assembly {} --output_dir {}'.format(
-            catch_bad_genes_path, ' '.join(gff3_files), genome_assembly,
-            gene_filtering_dir
-        )
+    logger_time.debug('START: evidence_table')
+    logger_txt.debug('[In-process] evidence_table.py {}'.format(
+        ' '.join(column_files)
+    ))
+    table_file = evidence_table_py.write_table(
+        column_files, evidence_table_py.get_table_file(gene_filtering_dir)
     )
-    logger_time.debug('START: wrapper_catch_bad_genes')
-    logger_txt.debug('[Wrapper] {}'.format(command))
-    command_args = shlex.split(command)
-    check_call(command_args)
-    logger_time.debug('DONE : wrapper_catch_bad_genes\n')
+    logger_time.debug('DONE : evidence_table\n')
+
+    return table_file
+
+
+def catch_bad_genes(
+    gff3_files, genome_assembly, output_dir, num_cores, write_pickles
+):
+    gene_filtering_dir = os.path.join(output_dir, 'gene_filtering')
+    logger_time.debug('START: catch_bad_genes')
+    logger_txt.debug('[In-process] catch_bad_genes.py {}'.format(
+        ' '.join(gff3_files)
+    ))
+    D_bad = catch_bad_genes_py.catch_middle_stop(
+        gff3_files, genome_assembly, gene_filtering_dir,
+        get_pickle(output_dir, 'D_bad.p', write_pickles), num_cores
+    )
+    logger_time.debug('DONE : catch_bad_genes\n')
 
-    bad_dict = os.path.join(gene_filtering_dir, 'D_bad.p')
-    return bad_dict
+    return D_bad
 
 
 def filter_gff3s(
-    gff3_files, blastp_dict, busco_dict, pfam_dict, blastn_dict, bad_dict,
-    nr_prot_file, nr_prot_mapping_file, output_dir
+    genome_assembly, gff3_files, nr_prot, evidence_table_file, D_bad,
+    output_dir
 ):
-    # filter_gff3s.py -i <input_gff3s> -m <mapping_file> -b <blastp_dict>
-    # -B <busco_dict> -p <pfam_dict> -N <blastn_dict> -g <bad_dict>
-    # -n <nr_prot_file> -o <output_dir> -l <log_dir>
+    nr_prot_file, nr_prot_mapping_file, D_mapping, D_mapping_rev = nr_prot
     gene_filtering_dir = os.path.join(output_dir, 'gene_filtering')
-    log_dir = os.path.join(output_dir, 'logs')
-    command = (
-        'python {} --input_gff3s {} --mapping_file {} --blastp_dict {} '
-        '--busco_dict {} --pfam_dict {} --blastn_dict {} --bad_dict {} '
-        '--nr_prot_file {} --output_dir {} --log_dir {}'
-    ).format(
-        filter_gff3s_path, ' '.join(gff3_files), nr_prot_mapping_file,
-        blastp_dict, busco_dict, pfam_dict, blastn_dict, bad_dict, nr_prot_file,
-        gene_filtering_dir, log_dir
-    )
-    logger_time.debug('START: wrapper_filter_gff3s')
-    logger_txt.debug('[Wrapper] {}'.format(command))
-    command_args = shlex.split(command)
-    check_call(command_args)
-    logger_time.debug('DONE : wrapper_filter_gff3s\n')
+    logger_time.debug('START: filter_gff3s')
+    logger_txt.debug('[In-process] filter_gff3s.py {}'.format(
+        ' '.join(gff3_files)
+    ))
+    filtered_gff3, filtered_prot = filter_gff3s_py.filter_gff3s(
+        genome_assembly, gff3_files, nr_prot_mapping_file, D_mapping,
+        D_mapping_rev, evidence_table_file, D_bad, nr_prot_file,
+        gene_filtering_dir
+    )
+    logger_time.debug('DONE : filter_gff3s\n')
+
+    return filtered_gff3, filtered_prot
 
 
 def gff3_postprocess(genome_assembly, output_dir):
-    # gff3_postprocess.py -g <genome_assembly> -i <input_gff3> -o <output_gff3>
     input_gff3 = os.path.join(output_dir, 'gene_filtering', 'filtered_1.gff3')
     output_gff3 = os.path.join(output_dir, 'gene_filtering', 'filtered_2.gff3')
-    command = (
-        'python {} --genome_assembly {} --input_gff3 {} --output_gff3 {}'
-    ).format(
-        gff3_postprocess_path, genome_assembly, input_gff3, output_gff3
+    logger_time.debug('START: gff3_postprocess')
+    logger_txt.debug('[In-process] gff3_postprocess.py {}'.format(input_gff3))
+    gff3_postprocess_py.gff3_postprocess(
+        genome_assembly, input_gff3, output_gff3
     )
-    logger_time.debug('START: wrapper_gff3_postprocess')
-    logger_txt.debug('[Wrapper] {}'.format(command))
-    command_args = shlex.split(command)
-    check_call(command_args)
-    logger_time.debug('DONE : wrapper_gff3_postprocess\n')
+    logger_time.debug('DONE : gff3_postprocess\n')
+    return output_gff3
 
 
 def copy_output(output_dir):
-    # copy_output.py -o <output_dir>
-    command = 'python {} --output_dir {}'.format(copy_output_path, output_dir)
-    logger_time.debug('START: wrapper_copy_output')
-    logger_txt.debug('[Wrapper] {}'.format(command))
-    command_args = shlex.split(command)
-    check_call(command_args)
-    logger_time.debug('DONE: wrapper_copy_output\n')
+    logger_time.debug('START: copy_output')
+    copy_output_py.create_dir(output_dir)
+    fungap_out_gff3, fungap_out_prot = copy_output_py.copy_output(output_dir)
+    logger_time.debug('DONE: copy_output\n')
+
+    return fungap_out_gff3, fungap_out_prot
 
 
 def create_markdown(genome_assembly, output_dir, trans_bams, trinity_asms):
-    # python create_markdown.py -f <input_fasta> -g <input_gff3>
-    # -t <trinity_assembly> -b <bam_file> -o <output_dir>
     fungap_gff3 = os.path.join(output_dir, 'gene_filtering/filtered_2.gff3')
     trans_bam = trans_bams[0]
     trinity_asm = trinity_asms[0]
     markdown_out_dir = os.path.join(output_dir, 'fungap_out')
 
-    command = (
-        'python {} --input_fasta {} --input_gff3 {} --trinity_assembly {} '
-        '--bam_file {} --output_dir {}'
-    ).format(
-        create_markdown_path, genome_assembly, fungap_gff3, trinity_asm,
-        trans_bam, markdown_out_dir
+    logger_time.debug('START: create_markdown')
+    logger_txt.debug('[In-process] create_markdown.py {}'.format(fungap_gff3))
+    markdown_html = create_markdown_py.make_report(
+        genome_assembly, fungap_gff3, trinity_asm, trans_bam,
+        markdown_out_dir
     )
-    logger_time.debug('START: wrapper_create_markdown')
-    logger_txt.debug('[Wrapper] {}'.format(command))
-    command_args = shlex.split(command)
-    check_call(command_args)
-    logger_time.debug('DONE: wrapper_create_markdown\n')
-
-    logger_time.debug('## DONE: FunGAP ##')
-
+    logger_time.debug('DONE: create_markdown\n')
+    return markdown_html
 
 if __name__ == '__main__':
     main(sys.argv[1:])
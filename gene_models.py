@@ -0,0 +1,276 @@
+#!/usr/bin/env python2
+
+'''
+Columnar store of gene models parsed from GFF3 files
+
+Each transcript (mRNA or transcript feature, or the Parent of a CDS/exon
+when the transcript line is missing) gets an integer model ID; its key is
+(prefix, transcript ID), where prefix is the GFF3 file name up to the first
+dot (e.g. augustus_out). Coordinates, strands and phases are kept in
+array columns and scaffold, source and score strings are interned, so a
+model costs a few machine words instead of tuples of Python objects.
+
+Features (CDS and exon) are grouped by model when loading is finished;
+feature_offsets[model_id]:feature_offsets[model_id + 1] is the range of a
+model's features in file order. Row tuples in the layout the callers used
+before, (scaffold, source, type, start, end, score, strand, phase), are
+made only on request.
+'''
+
+# Import modules
+import os
+import re
+from array import array
+from collections import defaultdict
+
+# Parameters
+D_feat_code = {'CDS': 'C', 'exon': 'E'}
+D_feat_type = {'C': 'CDS', 'E': 'exon'}
+
+
+def get_prefix(gff3_file):
+    # Software name of a predictor GFF3 (e.g. augustus_out.gff3: augustus_out)
+    return os.path.basename(gff3_file).split('.')[0]
+
+
+def load_models(gff3_files):
+    D_models = {
+        'strings': [],
+        'D_string': {},
+        'keys': [],
+        'D_key': {},
+        # Transcript columns; scaffold is -1 without a transcript line
+        'scaffold': array('i'),
+        'source': array('i'),
+        'type': array('i'),
+        'start': array('l'),
+        'end': array('l'),
+        'score': array('i'),
+        'strand': array('c'),
+        'phase': array('c'),
+        # Feature columns
+        'feat_model': array('i'),
+        'feat_type': array('c'),
+        'feat_scaffold': array('i'),
+        'feat_source': array('i'),
+        'feat_start': array('l'),
+        'feat_end': array('l'),
+        'feat_score': array('i'),
+        'feat_strand': array('c'),
+        'feat_phase': array('c'),
+    }
+
+    reg_id = re.compile(r'ID=([^;]+)')
+    reg_parent = re.compile(r'Parent=([^;]+)')
+    for gff3_file in gff3_files:
+        prefix = get_prefix(gff3_file)
+        mrna_id = None
+        with open(gff3_file) as f_in:
+            for line in f_in:
+                line = line.rstrip()
+                if line.startswith('#') or '\t' not in line:
+                    continue
+
+                (
+                    scaffold, source, feat_type, start, end, score,
+                    strand, phase, attr
+                ) = line.split('\t')
+
+                if feat_type in ('mRNA', 'transcript'):
+                    m_id = reg_id.search(attr)
+                    entry_id = m_id.group(1) if m_id else attr
+                    if entry_id != '':
+                        mrna_id = entry_id
+                    model_id = get_model_id(D_models, (prefix, mrna_id))
+                    D_models['scaffold'][model_id] = intern_string(
+                        D_models, scaffold
+                    )
+                    D_models['source'][model_id] = intern_string(
+                        D_models, source
+                    )
+                    D_models['type'][model_id] = intern_string(
+                        D_models, feat_type
+                    )
+                    D_models['start'][model_id] = int(start)
+                    D_models['end'][model_id] = int(end)
+                    D_models['score'][model_id] = intern_string(
+                        D_models, score
+                    )
+                    D_models['strand'][model_id] = strand[:1] or '.'
+                    D_models['phase'][model_id] = phase[:1] or '.'
+
+                elif feat_type in D_feat_code:
+                    m_parent = reg_parent.search(attr)
+                    parent_id = m_parent.group(1) if m_parent else ''
+                    model_id = get_model_id(D_models, (prefix, parent_id))
+                    D_models['feat_model'].append(model_id)
+                    D_models['feat_type'].append(D_feat_code[feat_type])
+                    D_models['feat_scaffold'].append(
+                        intern_string(D_models, scaffold)
+                    )
+                    D_models['feat_source'].append(
+                        intern_string(D_models, source)
+                    )
+                    D_models['feat_start'].append(int(start))
+                    D_models['feat_end'].append(int(end))
+                    D_models['feat_score'].append(
+                        intern_string(D_models, score)
+                    )
+                    D_models['feat_strand'].append(strand[:1] or '.')
+                    D_models['feat_phase'].append(phase[:1] or '.')
+
+    group_features(D_models)
+    return D_models
+
+
+def intern_string(D_models, string):
+    string_id = D_models['D_string'].get(string)
+    if string_id is None:
+        string_id = len(D_models['strings'])
+        D_models['strings'].append(string)
+        D_models['D_string'][string] = string_id
+    return string_id
+
+
+def get_model_id(D_models, key):
+    model_id = D_models['D_key'].get(key)
+    if model_id is None:
+        model_id = len(D_models['keys'])
+        D_models['keys'].append(key)
+        D_models['D_key'][key] = model_id
+        for column, value in (
+            ('scaffold', -1), ('source', -1), ('type', -1), ('start', 0),
+            ('end', 0), ('score', -1), ('strand', '.'), ('phase', '.')
+        ):
+            D_models[column].append(value)
+    return model_id
+
+
+def group_features(D_models):
+    # Sort feature columns by model (stable, so file order is kept within
+    # a model) and summarize CDSs of each model
+    feat_model = D_models['feat_model']
+    order = sorted(xrange(len(feat_model)), key=feat_model.__getitem__)
+    for column in (
+        'feat_model', 'feat_type', 'feat_scaffold', 'feat_source',
+        'feat_start', 'feat_end', 'feat_score', 'feat_strand', 'feat_phase'
+    ):
+        values = D_models[column]
+        D_models[column] = array(values.typecode, (values[x] for x in order))
+
+    num_models = len(D_models['keys'])
+    feature_offsets = array('l', [0] * (num_models + 1))
+    for model_id in D_models['feat_model']:
+        feature_offsets[model_id + 1] += 1
+    for model_id in xrange(num_models):
+        feature_offsets[model_id + 1] += feature_offsets[model_id]
+    D_models['feature_offsets'] = feature_offsets
+
+    # CDS span (scaffold of the first CDS, min start, max end) and length;
+    # cds_scaffold is -1 for models without CDS
+    cds_scaffold = array('i', [-1] * num_models)
+    cds_start = array('l', [0] * num_models)
+    cds_end = array('l', [0] * num_models)
+    cds_len = array('l', [0] * num_models)
+    for model_id in xrange(num_models):
+        for feat_i in xrange(
+            feature_offsets[model_id], feature_offsets[model_id + 1]
+        ):
+            if D_models['feat_type'][feat_i] != 'C':
+                continue
+            start = D_models['feat_start'][feat_i]
+            end = D_models['feat_end'][feat_i]
+            low, high = min(start, end), max(start, end)
+            if cds_scaffold[model_id] == -1:
+                cds_scaffold[model_id] = D_models['feat_scaffold'][feat_i]
+                cds_start[model_id] = low
+                cds_end[model_id] = high
+            else:
+                cds_start[model_id] = min(cds_start[model_id], low)
+                cds_end[model_id] = max(cds_end[model_id], high)
+            cds_len[model_id] += high - low + 1
+    D_models['cds_scaffold'] = cds_scaffold
+    D_models['cds_start'] = cds_start
+    D_models['cds_end'] = cds_end
+    D_models['cds_len'] = cds_len
+
+
+def num_models(D_models):
+    return len(D_models['keys'])
+
+
+def model_key(D_models, model_id):
+    return D_models['keys'][model_id]
+
+
+def prefix_models(D_models):
+    # Model IDs of each predictor
+    D_prefix = defaultdict(list)
+    for model_id, key in enumerate(D_models['keys']):
+        D_prefix[key[0]].append(model_id)
+    return D_prefix
+
+
+def get_string(D_models, string_id):
+    if string_id == -1:
+        return None
+    return D_models['strings'][string_id]
+
+
+def has_transcript(D_models, model_id):
+    return D_models['scaffold'][model_id] != -1
+
+
+def get_transcript(D_models, model_id):
+    # (scaffold, source, type, start, end, score, strand, phase)
+    return (
+        get_string(D_models, D_models['scaffold'][model_id]),
+        get_string(D_models, D_models['source'][model_id]),
+        get_string(D_models, D_models['type'][model_id]),
+        D_models['start'][model_id],
+        D_models['end'][model_id],
+        get_string(D_models, D_models['score'][model_id]),
+        D_models['strand'][model_id],
+        D_models['phase'][model_id],
+    )
+
+
+def get_features(D_models, model_id, feat_type):
+    # Features of a type ('CDS' or 'exon') in file order, as
+    # (scaffold, source, type, start, end, score, strand, phase)
+    feat_code = D_feat_code[feat_type]
+    features = []
+    for feat_i in xrange(
+        D_models['feature_offsets'][model_id],
+        D_models['feature_offsets'][model_id + 1]
+    ):
+        if D_models['feat_type'][feat_i] != feat_code:
+            continue
+        features.append((
+            get_string(D_models, D_models['feat_scaffold'][feat_i]),
+            get_string(D_models, D_models['feat_source'][feat_i]),
+            feat_type,
+            D_models['feat_start'][feat_i],
+            D_models['feat_end'][feat_i],
+            get_string(D_models, D_models['feat_score'][feat_i]),
+            D_models['feat_strand'][feat_i],
+            D_models['feat_phase'][feat_i],
+        ))
+    return features
+
+
+def has_cds(D_models, model_id):
+    return D_models['cds_scaffold'][model_id] != -1
+
+
+def get_cds_span(D_models, model_id):
+    # (scaffold, start, end) of the CDSs of a model
+    return (
+        get_string(D_models, D_models['cds_scaffold'][model_id]),
+        D_models['cds_start'][model_id],
+        D_models['cds_end'][model_id],
+    )
+
+
+def get_cds_len(D_models, model_id):
+    return D_models['cds_len'][model_id]
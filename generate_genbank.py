@@ -23,6 +23,11 @@ from Bio.SeqRecord import SeqRecord
 from Bio.SeqFeature import SeqFeature
 from Bio.SeqFeature import FeatureLocation, CompoundLocation
 
+this_path = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_path)
+sys.path.append(this_dir)
+from genome_index import open_genome, seq_names, fetch_seq
+
 # Initialized values
 gffInfoFields = [
     'seqid', 'source', 'type', 'start', 'end', 'score', 'strand',
@@ -146,18 +151,20 @@ def generate_genbank(
     # Output file name
     outfile = '%s.gb' % (output_prefix)
 
-    # First, import input_fna in dictionary
-    D_fna = SeqIO.to_dict(SeqIO.parse(input_fna, 'fasta', generic_dna))
-    D_faa = SeqIO.to_dict(SeqIO.parse(input_faa, 'fasta', generic_protein))
+    # First, index input_fna and input_faa
+    D_genome = open_genome(input_fna)
+    D_faa = SeqIO.index(input_faa, 'fasta', generic_protein)
 
-    D_fna_sorted = sorted(
-        D_fna.items(),
-        key=lambda x: int(re.findall(r'\d+', x[0])[0])
+    scaffolds_sorted = sorted(
+        seq_names(D_genome),
+        key=lambda x: int(re.findall(r'\d+', x)[0])
     )
 
-    # Make dictionary for CDS
+    # Parse the GFF3 once: exons and CDSs by parent, other features by
+    # scaffold in file order
     D_cds = defaultdict(list)
     D_exon = defaultdict(list)
+    D_records = defaultdict(list)
     for record in parseGFF3(input_gff3):
         if record.type == 'exon':
             exon_parent = record.attributes['Parent']
@@ -167,9 +174,13 @@ def generate_genbank(
             cds_parent = record.attributes['Parent']
             D_cds[cds_parent].append(record)
 
-    my_seq_records = []
-    for scaffold, seq in D_fna_sorted:
-        my_seq = Seq(str(seq.seq))
+        else:
+            D_records[record.seqid].append(record)
+
+    # Records are written scaffold by scaffold
+    outhandle = open(outfile, 'w')
+    for scaffold in scaffolds_sorted:
+        my_seq = Seq(fetch_seq(D_genome, scaffold))
         my_seq_record = SeqRecord(my_seq)
         my_seq_record.seq.alphabet = generic_dna
 
@@ -184,13 +195,8 @@ def generate_genbank(
         my_seq_record.annotations['taxonomy'] = taxonomy.split('; ')
         my_seq_record.annotations['source'] = organism_name
 
-        for record in parseGFF3(input_gff3):
-            if scaffold != record.seqid:
-                continue
-
+        for record in D_records.pop(scaffold, []):
             my_feature_type = record.type
-            if my_feature_type == ('exon', 'CDS'):
-                continue
 
             # GFFRecord(seqid='contig1', source='AUGUSTUS', type='gene',
             # start=16942, end=19008, score=0.22, strand='+', phase=None,
@@ -291,9 +297,8 @@ def generate_genbank(
                 # Append my feature to seq_record
                 my_seq_record.features.append(mrna_feature)
                 my_seq_record.features.append(cds_feature)
-        my_seq_records.append(my_seq_record)
-
-    SeqIO.write(my_seq_records, outfile, 'genbank')
+        SeqIO.write(my_seq_record, outhandle, 'genbank')
+    outhandle.close()
 
 
 if __name__ == '__main__':
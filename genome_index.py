@@ -0,0 +1,205 @@
+#!/usr/bin/env python2
+
+'''
+Indexed access to a genome assembly (samtools faidx-style)
+
+The assembly is scanned once to build an index of each sequence (name,
+length, byte offset, bases per line and bytes per line), which is saved as
+<assembly>.fai next to the assembly when possible and reused as long as it is
+newer than the assembly. Subsequences are then read from a read-only mmap of
+the file by offset arithmetic, so the genome is never loaded into Python
+strings as a whole.
+
+Sequences whose lines are not wrapped evenly cannot be addressed this way;
+they are kept in memory instead (and no .fai is written for that assembly).
+
+Opened genomes are cached per process, so every module asking for the same
+assembly shares one index and one mmap.
+'''
+
+# Import modules
+import os
+import sys
+import mmap
+import threading
+
+# Parameters
+D_genome_cache = {}
+cache_lock = threading.Lock()
+
+
+def open_genome(fasta_file):
+    fasta_file = os.path.abspath(fasta_file)
+    stat = os.stat(fasta_file)
+    with cache_lock:
+        D_genome = D_genome_cache.get(fasta_file)
+        if D_genome and D_genome['stat'] == (stat.st_size, stat.st_mtime):
+            return D_genome
+
+        D_genome = load_genome(fasta_file)
+        D_genome['stat'] = (stat.st_size, stat.st_mtime)
+        D_genome_cache[fasta_file] = D_genome
+    return D_genome
+
+
+def load_genome(fasta_file):
+    fai_file = '{}.fai'.format(fasta_file)
+    entries = None
+    if (
+        os.path.exists(fai_file) and
+        os.path.getmtime(fai_file) >= os.path.getmtime(fasta_file)
+    ):
+        entries = read_fai(fai_file)
+
+    D_irregular = {}
+    if entries is None:
+        entries, D_irregular = build_index(fasta_file)
+        if not D_irregular:
+            write_fai(entries, fai_file)
+
+    names = []
+    D_index = {}
+    for name, length, offset, line_bases, line_width in entries:
+        if name in D_index:
+            sys.exit('[ERROR] Duplicated sequence name {} in {}'.format(
+                name, fasta_file
+            ))
+        names.append(name)
+        D_index[name] = (length, offset, line_bases, line_width)
+
+    seq_map = None
+    if os.path.getsize(fasta_file) > 0:
+        with open(fasta_file, 'rb') as f_in:
+            seq_map = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+
+    D_genome = {
+        'fasta_file': fasta_file,
+        'names': names,
+        'index': D_index,
+        'irregular': D_irregular,
+        'mmap': seq_map,
+    }
+    return D_genome
+
+
+def read_fai(fai_file):
+    # Returns None if the index cannot be read, so that it is rebuilt
+    entries = []
+    with open(fai_file) as f_in:
+        for line in f_in:
+            line_split = line.rstrip('\n').split('\t')
+            if len(line_split) < 5:
+                return None
+            try:
+                entries.append(
+                    [line_split[0]] + [int(x) for x in line_split[1:5]]
+                )
+            except ValueError:
+                return None
+    return entries
+
+
+def write_fai(entries, fai_file):
+    # The index is a cache; a read-only directory only costs a rebuild
+    tmp_file = '{}.tmp.{}'.format(fai_file, os.getpid())
+    try:
+        with open(tmp_file, 'w') as outhandle:
+            for entry in entries:
+                outhandle.write('{}\n'.format('\t'.join(str(x) for x in entry)))
+        os.rename(tmp_file, fai_file)
+    except (IOError, OSError):
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def build_index(fasta_file):
+    # entries: [name, length, offset, line_bases, line_width]
+    entries = []
+    D_irregular = {}
+    D_span = {}  # Byte span of irregular sequences
+    entry = None
+    short_line = False  # A line shorter than line_bases was seen
+    offset = 0
+    with open(fasta_file, 'rb') as f_in:
+        for line in f_in:
+            line_len = len(line)
+            if line.startswith('>'):
+                if entry is not None and entry[0] in D_span:
+                    D_span[entry[0]][1] = offset
+                name_split = line[1:].split()
+                name = name_split[0] if name_split else ''
+                entry = [name, 0, offset + line_len, 0, 0]
+                entries.append(entry)
+                short_line = False
+
+            elif entry is not None:
+                num_bases = len(line.rstrip('\r\n'))
+                entry[1] += num_bases
+                if entry[0] in D_span:
+                    pass
+                elif not num_bases:
+                    short_line = True
+                elif short_line or num_bases > entry[3] > 0 or (
+                    num_bases == entry[3] and line_len != entry[4]
+                ):
+                    D_span[entry[0]] = [entry[2], None]
+                elif entry[3] == 0:
+                    entry[3] = num_bases
+                    entry[4] = line_len
+                elif num_bases < entry[3]:
+                    short_line = True
+
+            offset += line_len
+
+    if entry is not None and entry[0] in D_span:
+        D_span[entry[0]][1] = offset
+
+    # Unevenly wrapped sequences are kept in memory
+    if D_span:
+        with open(fasta_file, 'rb') as f_in:
+            for name, (start, end) in D_span.items():
+                f_in.seek(start)
+                D_irregular[name] = ''.join(f_in.read(end - start).split())
+
+    return entries, D_irregular
+
+
+def seq_names(D_genome):
+    # Sequence names in the order of the assembly
+    return D_genome['names']
+
+
+def seq_length(D_genome, name):
+    return get_entry(D_genome, name)[0]
+
+
+def get_entry(D_genome, name):
+    try:
+        return D_genome['index'][name]
+    except KeyError:
+        sys.exit('[ERROR] Sequence {} is not in {}'.format(
+            name, D_genome['fasta_file']
+        ))
+
+
+def fetch_seq(D_genome, name, start=1, end=None):
+    # Subsequence in 1-based, inclusive coordinates (like GFF3)
+    length, offset, line_bases, line_width = get_entry(D_genome, name)
+    start = max(start, 1)
+    if end is None or end > length:
+        end = length
+    if end < start:
+        return ''
+
+    if name in D_genome['irregular']:
+        return D_genome['irregular'][name][start - 1:end]
+
+    start_byte = (
+        offset + (start - 1) // line_bases * line_width +
+        (start - 1) % line_bases
+    )
+    end_byte = (
+        offset + (end - 1) // line_bases * line_width +
+        (end - 1) % line_bases + 1
+    )
+    return D_genome['mmap'][start_byte:end_byte].translate(None, '\r\n')
@@ -2,7 +2,13 @@
 
 '''
 GFF3 postprocessing
-    - Remove UTRs when two near genes are overlapped
+    - Remove UTRs when two genes are overlapped
+
+The GFF3 (filtered_1.gff3, sorted by scaffold) is streamed: genes of one
+scaffold are read as plain line records, trimmed where they overlap and
+written before the next scaffold is read, so memory is bounded by the
+annotation of one scaffold. Only scaffold names and lengths are taken from
+the genome index (##sequence-region lines); no sequence is loaded.
 
 Input: GFF3 file
 Output: Postprocessed GFF3 file
@@ -10,13 +16,19 @@ Output: Postprocessed GFF3 file
 
 # Import modules
 import os
+import re
 import sys
 from argparse import ArgumentParser
 
-from BCBio import GFF
-from Bio import SeqIO
-from Bio.Alphabet import generic_dna
-from Bio.SeqFeature import FeatureLocation
+this_path = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_path)
+sys.path.append(this_dir)
+from genome_index import open_genome, seq_names, seq_length
+from interval_index import build_index, find_overlaps
+
+# Parameters
+reg_id = re.compile(r'ID=([^;]+)')
+reg_parent = re.compile(r'Parent=([^;]+)')
 
 
 # Main function
@@ -49,75 +61,131 @@ def main(argv):
     gff3_postprocess(genome_assembly, input_gff3, output_gff3)
 
 
-def import_file(input_file):
-    with open(input_file) as f_in:
-        txt = list(line.rstrip() for line in f_in)
-    return txt
-
-
 def gff3_postprocess(genome_assembly, input_gff3, output_gff3):
-    def update_g_features(gene_i):
-        g_feature = g_features[gene_i]
-        m_feature = g_feature.sub_features[0]
-        c_features = [
-            x for x in m_feature.sub_features if x.type == 'CDS'
-        ]
-        c_features_s = sorted(
-            c_features, key=lambda x: x.location.start
-        )
-
-        e_features = [
-            x for x in m_feature.sub_features if x.type == 'exon'
-        ]
-        e_features_s = sorted(
-            e_features, key=lambda x: x.location.start
-        )
-        cds_start = c_features_s[0].location.start
-        cds_end = c_features_s[-1].location.end
-
-        e_features_s[0].location = FeatureLocation(
-            cds_start, e_features_s[0].location.end,
-            strand=e_features_s[0].location.strand
-        )
-        e_features_s[-1].location = FeatureLocation(
-            e_features_s[-1].location.start, cds_end,
-            strand=e_features_s[-1].location.strand
-        )
-        m_feature.location = FeatureLocation(
-            cds_start, cds_end, m_feature.location.strand
-        )
-        m_feature.sub_features = e_features_s + c_features_s
-
-        g_features[gene_i].location = FeatureLocation(
-            cds_start, cds_end,
-            strand=g_features[gene_i].location.strand
+    D_genome = open_genome(genome_assembly)
+    outhandle = open(output_gff3, 'w')
+    outhandle.write('##gff-version 3\n')
+    for scaffold in seq_names(D_genome):
+        outhandle.write('##sequence-region {} 1 {}\n'.format(
+            scaffold, seq_length(D_genome, scaffold)
+        ))
+
+    for scaffold, genes in iter_genes(input_gff3):
+        trim_overlaps(scaffold, genes)
+        for gene in genes:
+            write_gene(gene, outhandle)
+    outhandle.close()
+
+
+def iter_genes(input_gff3):
+    # Yield (scaffold, genes) for each run of a scaffold. A gene is a dict of
+    # its gene line, mRNA line and the mRNA's children (exon and CDS lines);
+    # lines are lists of the nine columns, with start and end as int
+    scaffold = None
+    genes = []
+    D_gene = {}  # key: gene or mRNA ID, value: gene
+    with open(input_gff3) as f_in:
+        for line in f_in:
+            if line.startswith('#') or '\t' not in line:
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 9:
+                continue
+            fields[3] = int(fields[3])
+            fields[4] = int(fields[4])
+
+            if fields[0] != scaffold:
+                if genes:
+                    yield scaffold, genes
+                scaffold = fields[0]
+                genes = []
+                D_gene = {}
+
+            m_id = reg_id.search(fields[8])
+            m_parent = reg_parent.search(fields[8])
+            if fields[2] == 'gene':
+                gene = {'gene': fields, 'mRNA': None, 'children': []}
+                genes.append(gene)
+                if m_id:
+                    D_gene[m_id.group(1)] = gene
+            elif fields[2] == 'mRNA':
+                gene = D_gene.get(m_parent.group(1)) if m_parent else None
+                if gene is None:
+                    sys.exit('[ERROR] mRNA without gene in {}: {}'.format(
+                        input_gff3, line.rstrip()
+                    ))
+                # Other isoforms are dropped, as only the first is kept
+                if gene['mRNA'] is None:
+                    gene['mRNA'] = fields
+                    if m_id:
+                        D_gene[m_id.group(1)] = gene
+            else:
+                gene = D_gene.get(m_parent.group(1)) if m_parent else None
+                if gene is None:
+                    sys.exit('[ERROR] Feature without mRNA in {}: {}'.format(
+                        input_gff3, line.rstrip()
+                    ))
+                if gene['mRNA'] is not None and (
+                    m_parent.group(1) == reg_id.search(
+                        gene['mRNA'][8]
+                    ).group(1)
+                ):
+                    gene['children'].append(fields)
+
+    if genes:
+        yield scaffold, genes
+
+
+def trim_overlaps(scaffold, genes):
+    # Every pair of overlapping genes is checked, not only adjacent ones.
+    # Trimming only shrinks genes, so the index built from the original
+    # spans returns all candidates, which are checked with their current
+    # spans
+    D_index = build_index(
+        (scaffold, x['gene'][3], x['gene'][4], gene_i)
+        for gene_i, x in enumerate(genes)
+    )
+    for gene_i, gene in enumerate(genes):
+        overlaps = find_overlaps(
+            D_index, scaffold, gene['gene'][3], gene['gene'][4]
         )
-        g_features[gene_i].sub_features = [m_feature]
-
-    D_fna = SeqIO.to_dict(SeqIO.parse(genome_assembly, "fasta", generic_dna))
-    gff_iter = GFF.parse(input_gff3, D_fna)
-    my_records = []
-    for gff_element in gff_iter:
-        g_features = gff_element.features  # Genes in a scaffold
-        gene_i = 0
-        while gene_i < len(g_features) - 1:
-            g_feature = g_features[gene_i]
-            g_feature_next = g_features[gene_i + 1]
-            end = g_feature.location.end
-            start_next = g_feature_next.location.start + 1
-            if end >= start_next:
-                update_g_features(gene_i)
-                update_g_features(gene_i + 1)
-            gene_i += 1
-
-        gff_element.features = g_features
-        my_records.append(gff_element)
-
-    GFF.write(my_records, open(output_gff3, 'w'))
-
-
-
-
+        for gene_j in overlaps:
+            if gene_j <= gene_i:
+                continue
+            fields = genes[gene_i]['gene']
+            fields_next = genes[gene_j]['gene']
+            if fields[4] >= fields_next[3] and fields_next[4] >= fields[3]:
+                update_gene(genes[gene_i])
+                update_gene(genes[gene_j])
+
+
+def update_gene(gene):
+    # Trim the gene, its mRNA and its terminal exons to the CDS span
+    cds_list = sorted(
+        [x for x in gene['children'] if x[2] == 'CDS'], key=lambda x: x[3]
+    )
+    exons = sorted(
+        [x for x in gene['children'] if x[2] == 'exon'], key=lambda x: x[3]
+    )
+    cds_start = cds_list[0][3]
+    cds_end = cds_list[-1][4]
+
+    exons[0][3] = cds_start
+    exons[-1][4] = cds_end
+    gene['mRNA'][3] = cds_start
+    gene['mRNA'][4] = cds_end
+    gene['gene'][3] = cds_start
+    gene['gene'][4] = cds_end
+    gene['children'] = exons + cds_list
+
+
+def write_gene(gene, outhandle):
+    lines = [gene['gene']]
+    if gene['mRNA'] is not None:
+        lines.append(gene['mRNA'])
+    lines.extend(gene['children'])
+    for fields in lines:
+        outhandle.write('{}\n'.format('\t'.join(str(x) for x in fields)))
 
 
 if __name__ == '__main__':
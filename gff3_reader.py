@@ -0,0 +1,110 @@
+#!/usr/bin/env python2
+
+'''
+Streaming GFF3 reader of mRNA CDS coordinates
+
+Lines are read one at a time and grouped by runs of consecutive lines of the
+same scaffold. When a run ends, its mRNAs (mRNA or transcript features) are
+given with their CDSs: no sequence is attached and no feature tree is built,
+so memory is bounded by the annotation of one scaffold plus the IDs of the
+mRNAs already given, which are kept to catch an mRNA whose lines are split
+across two runs (an error). Genes of different scaffolds may be interleaved
+as long as the lines of each mRNA are together.
+
+Each mRNA is (scaffold, mrna_id, strand, cds_list), where cds_list holds
+(start, end, phase) of its CDSs sorted by start; coordinates are 1-based and
+inclusive as in the file. CDSs without a Parent or an mRNA line are ignored.
+
+keep_scaffold, if given, is called with each scaffold name and lines of the
+scaffolds it rejects are skipped (e.g. to split a file among workers).
+'''
+
+# Import modules
+import re
+import sys
+
+# Parameters
+reg_id = re.compile(r'ID=([^;]+)')
+reg_parent = re.compile(r'Parent=([^;]+)')
+
+
+def iter_scaffolds(gff3_file, keep_scaffold=None):
+    # Yield (scaffold, list of mRNAs) for each run of the scaffold
+    done = set()  # mRNA IDs of finished runs
+    scaffold = None
+    D_mrna = {}  # key: mRNA ID, value: [strand, cds_list]
+    mrna_order = []
+    D_orphan = {}  # CDSs listed before their mRNA line
+    with open(gff3_file) as f_in:
+        for line in f_in:
+            if line.startswith('#') or '\t' not in line:
+                continue
+            line_split = line.rstrip('\n').split('\t')
+            if len(line_split) < 9:
+                continue
+            feat_type = line_split[2]
+            if feat_type not in ('mRNA', 'transcript', 'CDS'):
+                continue
+            if keep_scaffold and not keep_scaffold(line_split[0]):
+                continue
+
+            if line_split[0] != scaffold:
+                if scaffold is not None:
+                    yield scaffold, get_mrnas(
+                        scaffold, D_mrna, mrna_order, D_orphan
+                    )
+                    done.update(D_mrna)
+                    done.update(D_orphan)
+                scaffold = line_split[0]
+                D_mrna = {}
+                mrna_order = []
+                D_orphan = {}
+
+            attr = line_split[8]
+            if feat_type == 'CDS':
+                m_parent = reg_parent.search(attr)
+                if not m_parent:
+                    continue
+                mrna_id = m_parent.group(1)
+                cds = (
+                    int(line_split[3]), int(line_split[4]), line_split[7]
+                )
+                if mrna_id in D_mrna:
+                    D_mrna[mrna_id][1].append(cds)
+                else:
+                    D_orphan.setdefault(mrna_id, []).append(cds)
+            else:
+                m_id = reg_id.search(attr)
+                mrna_id = m_id.group(1) if m_id else attr
+                if mrna_id in D_mrna:
+                    continue
+                D_mrna[mrna_id] = [
+                    line_split[6], D_orphan.pop(mrna_id, [])
+                ]
+                mrna_order.append(mrna_id)
+
+            if mrna_id in done:
+                sys.exit(
+                    '[ERROR] Lines of {} are not together by scaffold in '
+                    '{}'.format(mrna_id, gff3_file)
+                )
+
+    if scaffold is not None:
+        yield scaffold, get_mrnas(scaffold, D_mrna, mrna_order, D_orphan)
+
+
+def get_mrnas(scaffold, D_mrna, mrna_order, D_orphan):
+    mrnas = []
+    for mrna_id in mrna_order:
+        strand, cds_list = D_mrna[mrna_id]
+        mrnas.append((
+            scaffold, mrna_id, strand, sorted(cds_list, key=lambda x: x[0])
+        ))
+    return mrnas
+
+
+def iter_mrnas(gff3_file, keep_scaffold=None):
+    # Yield (scaffold, mrna_id, strand, cds_list) of each mRNA
+    for scaffold, mrnas in iter_scaffolds(gff3_file, keep_scaffold):
+        for mrna in mrnas:
+            yield mrna
@@ -2,28 +2,47 @@
 
 '''
 Import BLASTn result
- - Input: blastn output directory
- - Output: dictionary
+ - Input: blastn output files (may be gzipped), or the blastn output of
+   nr_transcript.fna with nr_transcript_mapping.txt (make_nr_transcript.py),
+   and nr_prot_mapping.txt (make_nr_prot.py) giving the model IDs
+ - Output: blastn column of the evidence table (evidence_table.py)
 '''
 
 # Import modules
-from __future__ import division
 import re
 import os
 import sys
-import cPickle
 from argparse import ArgumentParser
 from collections import defaultdict
 
+this_path = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_path)
+sys.path.append(this_dir)
+from blast_tabular import sum_hits
+from evidence_table import (
+    import_rows, get_column_file, key_column, write_column
+)
+
 
 # Define main function
 def main(argv):
-    argparse_usage = 'import_blastn.py -b <blastn_out_files> -o <output_dir>'
+    argparse_usage = (
+        'import_blastn.py -b <blastn_out_files> -m <nr_prot_mapping> '
+        '-n <nr_transcript_mapping> -o <output_dir>'
+    )
     parser = ArgumentParser(usage=argparse_usage)
     parser.add_argument(
         '-b', '--blastn_out_files', nargs='+', required=True,
         help='BLASTn output files'
     )
+    parser.add_argument(
+        '-m', '--nr_prot_mapping', nargs=1, required=True,
+        help='nr_prot_mapping.txt generated by make_nr_prot.py'
+    )
+    parser.add_argument(
+        '-n', '--nr_transcript_mapping', nargs='?', default=None,
+        help='nr_transcript_mapping.txt generated by make_nr_transcript.py'
+    )
     parser.add_argument(
         '-o', '--output_dir', nargs='?', default='gene_filtering',
         help='BLASTn output files'
@@ -31,18 +50,18 @@ def main(argv):
 
     args = parser.parse_args()
     blastn_out_files = [os.path.abspath(x) for x in args.blastn_out_files]
+    nr_prot_mapping = os.path.abspath(args.nr_prot_mapping[0])
+    nr_transcript_mapping = args.nr_transcript_mapping
     output_dir = os.path.abspath(args.output_dir)
 
     # Run fuctions :) Slow is as good as Fast
     create_dir(output_dir)
-    import_blastn(blastn_out_files, output_dir)
-
-
-def import_file(input_file):
-    with open(input_file) as f_in:
-        txt = (line.rstrip() for line in f_in)
-        txt = list(line for line in txt if line)
-    return txt
+    D_mapping = None
+    if nr_transcript_mapping:
+        D_mapping = import_mapping(os.path.abspath(nr_transcript_mapping))
+    keys, _ = import_rows(nr_prot_mapping)
+    output_column = get_column_file(output_dir, 'blastn')
+    import_blastn(blastn_out_files, keys, output_column, D_mapping)
 
 
 def create_dir(output_dir):
@@ -50,27 +69,44 @@ def create_dir(output_dir):
         os.mkdir(output_dir)
 
 
-def import_blastn(blastn_out_files, output_dir):
+def import_mapping(nr_transcript_mapping):
+    # key: nr transcript name, value: list of (prefix, transcript ID)
+    D_mapping = defaultdict(list)
+    with open(nr_transcript_mapping) as f_in:
+        next(f_in)  # Header
+        for line in f_in:
+            line_split = line.rstrip('\n').split('\t')
+            transcript_name, prefix, prefix_id = line_split
+            D_mapping[transcript_name].append((prefix, prefix_id))
+    return D_mapping
+
+
+def import_blastn(blastn_out_files, keys, output_column=None, D_mapping=None):
+    # Sum of scores of all hits of each gene, streamed (blast_tabular.py).
+    # With D_mapping (D_mapping_rev of make_nr_transcript.py), the queries
+    # are nr transcripts and each score is given to all genes sharing the
+    # sequence; otherwise the prefix is taken from the file name. keys:
+    # model IDs of evidence_table.import_rows
     D_blastn = defaultdict(float)
-    for blast_file in blastn_out_files:
-        prefix = re.sub('\.blastn$', '', os.path.basename(blast_file))
-        blast_txt = import_file(blast_file)
-        for line in blast_txt:
-            line_split = line.split('\t')
-            gene_id = line_split[0]
-            alignment_length = int(line_split[2])
-            qlen = int(line_split[3])
-            slen = int(line_split[4])
-            bit_score = float(line_split[5])
-
-            q_cov = min(1, alignment_length / qlen)
-            s_cov = min(1, alignment_length / slen)
-            score = bit_score * q_cov * s_cov
-            D_blastn[(prefix, gene_id)] += round(score, 1)
-
-     # Write cPickle
-    output_pickle = os.path.join(output_dir, 'blastn_score.p')
-    cPickle.dump(D_blastn, open(output_pickle, 'wb'))
+    if D_mapping is not None:
+        D_nr = defaultdict(float)
+        for blast_file in blastn_out_files:
+            sum_hits(blast_file, D_nr)
+        for transcript_name, score in D_nr.iteritems():
+            for tup in D_mapping[transcript_name]:
+                D_blastn[tup] = score
+    else:
+        for blast_file in blastn_out_files:
+            prefix = re.sub(
+                r'\.blastn(\.gz)?$', '', os.path.basename(blast_file)
+            )
+            sum_hits(blast_file, D_blastn, lambda x: (prefix, x))
+
+    values = key_column(D_blastn, keys)
+    if output_column:
+        write_column(values, output_column)
+
+    return values
 
 
 if __name__ == '__main__':
@@ -3,18 +3,22 @@
 '''
 Import BLASTp result
  - Input: Blastp output file
-   (outfmt "6 qseqid sseqid length qlen slen bitscore")
- - Output: dictionary
+   (outfmt "6 qseqid sseqid length qlen slen bitscore"), may be gzipped
+ - Output: blastp column of the evidence table (evidence_table.py)
 '''
 
 # Import modules
-from __future__ import division
 import os
 import sys
-import cPickle
-from glob import glob
 from argparse import ArgumentParser
-from collections import defaultdict
+
+this_path = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_path)
+sys.path.append(this_dir)
+from blast_tabular import top_hits
+from evidence_table import (
+    import_rows, get_column_file, nr_column, write_column
+)
 
 
 # Define main function
@@ -40,56 +44,25 @@ def main(argv):
     nr_prot_mapping = os.path.abspath(args.nr_prot_mapping[0])
 
     # Run fuctions :) Slow is as good as Fast
-    D_mapping = import_mapping(nr_prot_mapping)
-    import_blastp(blastp_out_file, D_mapping)
-
-
-def import_file(input_file):
-    with open(input_file) as f_in:
-        txt = (line.rstrip() for line in f_in)
-        txt = list(line for line in txt if line)
-    return txt
-
-
-def import_mapping(nr_prot_mapping):
-    mapping_txt = import_file(nr_prot_mapping)
-    # Key: nr id, value: tuple of software and id
-    D_mapping = defaultdict(list)
-    for line in mapping_txt[1:]:
-        line_split = line.split('\t')
-        prot_name, prefix, prefix_id = line_split
-        D_mapping[prot_name].append((prefix, prefix_id))
-
-    return D_mapping
-
+    keys, D_rows = import_rows(nr_prot_mapping)
+    output_column = get_column_file(
+        os.path.dirname(blastp_out_file), 'blastp'
+    )
+    import_blastp(blastp_out_file, D_rows, len(keys), output_column)
 
-def import_blastp(blastp_out_file, D_mapping):
-    blast_txt = import_file(blastp_out_file)
-    done = set()
-    D_blastp = defaultdict(float)
-    for line in blast_txt:
-        line_split = line.split('\t')
-        prot_name = line_split[0]
-        if prot_name in done:
-            continue
-        done.add(prot_name)
-        alignment_length = int(line_split[2])
-        qlen = int(line_split[3])
-        slen = int(line_split[4])
-        bit_score = float(line_split[5])
 
-        q_cov = min(1.0, alignment_length / qlen)
-        s_cov = min(1.0, alignment_length / slen)
-        score = bit_score * q_cov * s_cov
+def import_blastp(blastp_out_file, D_rows, num_rows, output_column=None):
+    # Best hit of each nr protein, streamed (blast_tabular.py). D_rows: model
+    # IDs of each nr protein (evidence_table.import_rows)
+    D_nr_blastp = {}
+    for prot_name, score in top_hits(blastp_out_file):
+        D_nr_blastp[prot_name] = round(score, 1)
+    values = nr_column(D_nr_blastp, D_rows, num_rows)
 
-        for tup in D_mapping[prot_name]:
-            D_blastp[(tup[0], tup[1])] = round(score, 1)
+    if output_column:
+        write_column(values, output_column)
 
-    # Write cPickle
-    output_pickle = os.path.join(
-        os.path.dirname(blastp_out_file), 'blastp_score.p'
-    )
-    cPickle.dump(D_blastp, open(output_pickle, 'wb'))
+    return values
 
 
 if __name__ == '__main__':
@@ -4,26 +4,42 @@
 Import BUSCO output and store in a dictionary
 BUSCO evidence score is HMM alignment bit score
 
-Input: BUSCO output
-Output: cPickle file containing dict object
+Input: BUSCO output of nr_prot.faa (run_nr_prot), or of each predictor
+       (run_<prefix>), and nr_prot_mapping.txt (make_nr_prot.py)
+Output: busco column of the evidence table (evidence_table.py)
 '''
 
 # Import modules
 import os
 import sys
-import cPickle
 from glob import glob
 from argparse import ArgumentParser
 from collections import defaultdict
 
+this_path = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_path)
+sys.path.append(this_dir)
+from evidence_table import (
+    import_rows, get_column_file, nr_column, key_column, write_column
+)
+
+# Parameters
+nr_run_dir = 'run_nr_prot'  # BUSCO run on nr_prot.faa
+
 
 def main(argv):
-    argparse_usage = 'import_busco.py -b <busco_dir> -o <output_dir>'
+    argparse_usage = (
+        'import_busco.py -b <busco_dir> -n <nr_prot_mapping> -o <output_dir>'
+    )
     parser = ArgumentParser(usage=argparse_usage)
     parser.add_argument(
         '-b', '--busco_dir', nargs=1, required=True,
         help='BUSCO output directory (busco_out)'
     )
+    parser.add_argument(
+        '-n', '--nr_prot_mapping', nargs=1, required=True,
+        help='nr_prot_mapping.txt generated by make_nr_prot.py'
+    )
     parser.add_argument(
         '-o', '--output_dir', nargs='?', default='gene_filtering',
         help='Output directory (default: current working directory)'
@@ -31,11 +47,14 @@ def main(argv):
 
     args = parser.parse_args()
     busco_dir = os.path.abspath(args.busco_dir[0])
+    nr_prot_mapping = os.path.abspath(args.nr_prot_mapping[0])
     output_dir = os.path.abspath(args.output_dir)
 
     # Run fuctions :) Slow is as good as Fast
     create_dir(output_dir)
-    import_busco(busco_dir, output_dir)
+    keys, D_rows = import_rows(nr_prot_mapping)
+    output_column = get_column_file(output_dir, 'busco')
+    import_busco(busco_dir, output_dir, keys, D_rows, output_column)
 
 
 def import_file(input_file):
@@ -50,10 +69,17 @@ def create_dir(output_dir):
         os.mkdir(output_dir)
 
 
-def import_busco(busco_dir, output_dir):
+def import_busco(busco_dir, output_dir, keys, D_rows, output_column=None):
     # Because BUSCO output (full_table) doesn't have E-value
-    # And raw HMM output has this, this script directly parse them
-    busco_outdirs = glob(os.path.join(busco_dir, 'run_*'))
+    # And raw HMM output has this, this script directly parse them.
+    # keys and D_rows: model IDs of evidence_table.import_rows. If BUSCO was
+    # run on nr_prot.faa, only that run is read and its scores are given to
+    # all genes sharing the protein
+    nr_outdir = os.path.join(busco_dir, nr_run_dir)
+    if os.path.isdir(nr_outdir):
+        busco_outdirs = [nr_outdir]
+    else:
+        busco_outdirs = glob(os.path.join(busco_dir, 'run_*'))
 
     D_busco = defaultdict(float)
     D_score_element = {}
@@ -87,6 +113,17 @@ def import_busco(busco_dir, output_dir):
                         full_seq_score, round(len_ratio, 3), round(score, 1)
                     )
 
+    if busco_outdirs == [nr_outdir]:
+        D_nr_busco = dict((x[1], y) for x, y in D_busco.items())
+        values = nr_column(D_nr_busco, D_rows, len(keys))
+        D_nr_score_element = D_score_element
+        D_score_element = {}
+        for nr_tup, score_element in D_nr_score_element.items():
+            for row in D_rows.get(nr_tup[1], []):
+                D_score_element[keys[row]] = score_element
+    else:
+        values = key_column(D_busco, keys)
+
     # Write to file
     outfile = os.path.join(output_dir, 'busco_score.txt')
     outhandle = open(outfile, 'w')
@@ -103,9 +140,10 @@ def import_busco(busco_dir, output_dir):
         outhandle.write(row_txt)
     outhandle.close()
 
-    # Write cPickle
-    output_pickle1 = os.path.join(output_dir, 'busco_score.p')
-    cPickle.dump(D_busco, open(output_pickle1, 'wb'))
+    if output_column:
+        write_column(values, output_column)
+
+    return values
 
 
 if __name__ == '__main__':
@@ -1,22 +1,28 @@
 #!/usr/bin/env python2
 
 '''
-Import pfam_scan output and store in dictionary
+Import pfam_scan output and store in the evidence table
 Pfam evidence score is HMM alignment bit score. If there are multiple Pfam
     domains, sum of scores is used
 
 Input: Pfam_scan output in .tsv
-Output: cPickle file containing dict object
+Output: pfam column of the evidence table (evidence_table.py)
 '''
 
 # Import module
 import re
 import os
 import sys
-import cPickle
 from collections import defaultdict
 from argparse import ArgumentParser
 
+this_path = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_path)
+sys.path.append(this_dir)
+from evidence_table import (
+    import_rows, get_column_file, nr_column, write_column
+)
+
 
 # Define main function
 def main(argv):
@@ -38,8 +44,11 @@ def main(argv):
     nr_prot_mapping = os.path.abspath(args.nr_prot_mapping[0])
 
     # Run fuctions :) Slow is as good as Fast
-    D_mapping = import_mapping(nr_prot_mapping)
-    import_pfam(pfam_scan_out_file, D_mapping)
+    keys, D_rows = import_rows(nr_prot_mapping)
+    output_column = get_column_file(
+        os.path.dirname(pfam_scan_out_file), 'pfam'
+    )
+    import_pfam(pfam_scan_out_file, D_rows, len(keys), output_column)
 
 
 def import_file(input_file):
@@ -49,35 +58,23 @@ def import_file(input_file):
     return txt
 
 
-def import_mapping(nr_prot_mapping):
-    mapping_txt = import_file(nr_prot_mapping)
-    # Key: nr id, value: tuple of software and id
-    D_mapping = defaultdict(list)
-    for line in mapping_txt[1:]:
-        line_split = line.split('\t')
-        prot_name, prefix, prefix_id = line_split
-        D_mapping[prot_name].append((prefix, prefix_id))
-
-    return D_mapping
-
-
-def import_pfam(pfam_scan_out_file, D_mapping):
+def import_pfam(pfam_scan_out_file, D_rows, num_rows, output_column=None):
+    # D_rows: model IDs of each nr protein (evidence_table.import_rows)
     pfam_txt = import_file(pfam_scan_out_file)
-    D_pfam = defaultdict(float)
+    D_nr_pfam = defaultdict(float)
     for line in pfam_txt:
         if line.startswith('#'):
             continue
         line_split = re.split(' +', line)
         prot_name = line_split[0]
         bit_score = float(line_split[11])
-        for tup in D_mapping[prot_name]:
-            D_pfam[(tup[0], tup[1])] += round(bit_score, 1)
+        D_nr_pfam[prot_name] += round(bit_score, 1)
+    values = nr_column(D_nr_pfam, D_rows, num_rows)
 
-    # Write cPickle
-    output_pickle = os.path.join(
-        os.path.dirname(pfam_scan_out_file), 'pfam_score.p'
-    )
-    cPickle.dump(D_pfam, open(output_pickle, 'wb'))
+    if output_column:
+        write_column(values, output_column)
+
+    return values
 
 
 if __name__ == '__main__':
@@ -0,0 +1,160 @@
+#!/usr/bin/env python2
+
+'''
+Per-scaffold interval index for gene model coordinates
+
+Intervals of each scaffold are kept in arrays sorted by (start, end), laid
+out as an implicit augmented binary search tree (as in cgranges): the
+element at index i is a node at level k, where k is the number of trailing
+1 bits of i, and max_ends[i] holds the largest end in its subtree. Overlap
+and containment queries walk down from the root and skip subtrees ending
+before the query, in O(log n + number of hits).
+
+Coordinates are 1-based and inclusive, like GFF3. Gene blocks (sets of
+overlapping intervals) and merged spans are read off the sorted arrays.
+'''
+
+# Import modules
+from collections import defaultdict
+
+
+def build_index(intervals):
+    # intervals: iterable of (scaffold, start, end, label). Returns D_index
+    # keyed by scaffold
+    D_intervals = defaultdict(list)
+    for scaffold, start, end, label in intervals:
+        D_intervals[scaffold].append((start, end, label))
+
+    D_index = {}
+    for scaffold, scaffold_intervals in D_intervals.items():
+        scaffold_intervals.sort(key=lambda x: (x[0], x[1]))
+        starts = [x[0] for x in scaffold_intervals]
+        ends = [x[1] for x in scaffold_intervals]
+        labels = [x[2] for x in scaffold_intervals]
+        max_ends, root_level = index_core(ends)
+        D_index[scaffold] = {
+            'starts': starts,
+            'ends': ends,
+            'labels': labels,
+            'max_ends': max_ends,
+            'root_level': root_level,
+        }
+    return D_index
+
+
+def index_core(ends):
+    # Largest end of each subtree of the implicit tree
+    num_intervals = len(ends)
+    max_ends = list(ends)
+    if not num_intervals:
+        return max_ends, -1
+
+    last_i = (num_intervals - 1) & ~1
+    last = max_ends[last_i]
+    k = 1
+    while 1 << k <= num_intervals:
+        x = 1 << (k - 1)
+        i0 = (x << 1) - 1
+        step = x << 2
+        for i in xrange(i0, num_intervals, step):
+            end_left = max_ends[i - x]
+            end_right = max_ends[i + x] if i + x < num_intervals else last
+            max_ends[i] = max(ends[i], end_left, end_right)
+        last_i = last_i - x if last_i >> k & 1 else last_i + x
+        if last_i < num_intervals and max_ends[last_i] > last:
+            last = max_ends[last_i]
+        k += 1
+    return max_ends, k - 1
+
+
+def query_index(D_scaffold, start, end):
+    # Indices of intervals overlapping [start, end], in sorted order
+    starts = D_scaffold['starts']
+    ends = D_scaffold['ends']
+    max_ends = D_scaffold['max_ends']
+    num_intervals = len(starts)
+    hits = []
+    if not num_intervals:
+        return hits
+
+    root_level = D_scaffold['root_level']
+    stack = [(root_level, (1 << root_level) - 1, 0)]
+    while stack:
+        k, x, left_done = stack.pop()
+        if k <= 3:
+            # Small subtree: scan it
+            i0 = x >> k << k
+            i1 = min(i0 + (1 << (k + 1)) - 1, num_intervals)
+            i = i0
+            while i < i1 and starts[i] <= end:
+                if start <= ends[i]:
+                    hits.append(i)
+                i += 1
+        elif not left_done:
+            y = x - (1 << (k - 1))  # Left child, may be out of range
+            stack.append((k, x, 1))
+            if y >= num_intervals or max_ends[y] >= start:
+                stack.append((k - 1, y, 0))
+        elif x < num_intervals and starts[x] <= end:
+            if start <= ends[x]:
+                hits.append(x)
+            stack.append((k - 1, x + (1 << (k - 1)), 0))
+    return hits
+
+
+def find_overlaps(D_index, scaffold, start, end):
+    D_scaffold = D_index.get(scaffold)
+    if not D_scaffold:
+        return []
+    labels = D_scaffold['labels']
+    return [labels[x] for x in query_index(D_scaffold, start, end)]
+
+
+def find_contained(D_index, scaffold, start, end):
+    # Intervals lying within [start, end]
+    D_scaffold = D_index.get(scaffold)
+    if not D_scaffold:
+        return []
+    starts = D_scaffold['starts']
+    ends = D_scaffold['ends']
+    labels = D_scaffold['labels']
+    return [
+        labels[x] for x in query_index(D_scaffold, start, end)
+        if starts[x] >= start and ends[x] <= end
+    ]
+
+
+def iter_blocks(D_index, scaffold):
+    # Yield lists of labels of overlapping intervals (gene blocks)
+    D_scaffold = D_index.get(scaffold)
+    if not D_scaffold:
+        return
+    block = []
+    block_end = None
+    for start, end, label in zip(
+        D_scaffold['starts'], D_scaffold['ends'], D_scaffold['labels']
+    ):
+        if block and start > block_end:
+            yield block
+            block = []
+        if not block:
+            block_end = end
+        block.append(label)
+        block_end = max(block_end, end)
+    if block:
+        yield block
+
+
+def merge_intervals(D_index, scaffold):
+    # Union of the intervals as sorted, disjoint (start, end)
+    D_scaffold = D_index.get(scaffold)
+    if not D_scaffold:
+        return []
+    merged = []
+    for start, end in zip(D_scaffold['starts'], D_scaffold['ends']):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [tuple(x) for x in merged]
@@ -0,0 +1,126 @@
+#!/usr/bin/env python2
+
+'''
+Select the best set of compatible gene models in a gene block
+
+Two gene models are compatible when their CDS spans are not identical and
+overlap by less than 10% of the length of each (filter_gff3s.py). The best
+set is the set of pairwise compatible models with the highest weight.
+
+Sorted by (start, end), a model can only be compatible with an earlier one
+that also ends earlier (a model nested in another overlaps by its whole
+length), and then the overlap with any later model is even smaller, so
+compatibility is transitive along this order. Sets of pairwise compatible
+models are therefore chains, and the best one is found by a sweep in start
+order: predecessors ending before the start are read from a prefix-maximum
+(Fenwick) tree over end positions, and the few overlapping ones ending
+within 10% of the model length after its start are checked one by one.
+This takes O(n log n) per block instead of enumerating all maximal cliques.
+
+The argument does not hold for single-base models (start == end), which
+are compatible with models enclosing them; blocks having such a model fall
+back to clique enumeration.
+'''
+
+# Import modules
+from bisect import bisect_left, bisect_right
+import networkx as nx
+
+
+def is_compatible(start1, end1, start2, end2):
+    if start1 == start2 and end1 == end2:
+        return False
+    overlap = min(end1, end2) - max(start1, start2)
+    condition1 = overlap < (end1 - start1 + 1) * 0.1
+    condition2 = overlap < (end2 - start2 + 1) * 0.1
+    return overlap == 0 or condition1 and condition2
+
+
+def add_weights(weight1, weight2):
+    return tuple(x + y for x, y in zip(weight1, weight2))
+
+
+def select_intervals(intervals, weights):
+    # intervals: list of (start, end); weights: list of tuples compared
+    # lexicographically (e.g. (score, cds_len)). Returns indices of the
+    # selected intervals in start order
+    if any(start == end for start, end in intervals):
+        return select_cliques(intervals, weights)
+
+    num_intervals = len(intervals)
+    order = sorted(range(num_intervals), key=lambda x: intervals[x])
+    D_pos = dict((x, pos) for pos, x in enumerate(order))
+    by_end = sorted(range(num_intervals), key=lambda x: intervals[x][1])
+    ends = [intervals[x][1] for x in by_end]
+    D_end_pos = dict((x, pos) for pos, x in enumerate(by_end))
+
+    # Fenwick tree of (best chain weight, index) over end positions
+    tree = [None] * (num_intervals + 1)
+    best = [None] * num_intervals
+    prev = [None] * num_intervals
+    for pos, i in enumerate(order):
+        start, end = intervals[i]
+
+        # Best chain ending before start
+        cand = None
+        k = bisect_left(ends, start)
+        while k > 0:
+            if tree[k] and (cand is None or tree[k][0] > cand[0]):
+                cand = tree[k]
+            k -= k & -k
+
+        # Overlapping models ending within 10% of the length after start
+        hi = bisect_right(ends, start + (end - start + 1) * 0.1)
+        for k in xrange(bisect_left(ends, start), hi):
+            j = by_end[k]
+            if D_pos[j] >= pos:
+                continue
+            if not is_compatible(intervals[j][0], intervals[j][1], start, end):
+                continue
+            if cand is None or best[j] > cand[0]:
+                cand = (best[j], j)
+
+        if cand is None:
+            best[i] = weights[i]
+        else:
+            best[i] = add_weights(cand[0], weights[i])
+            prev[i] = cand[1]
+
+        k = D_end_pos[i] + 1
+        while k <= num_intervals:
+            if tree[k] is None or best[i] > tree[k][0]:
+                tree[k] = (best[i], i)
+            k += k & -k
+
+    # Trace back the best chain
+    last = None
+    for i in order:
+        if last is None or best[i] > best[last]:
+            last = i
+    selected = []
+    while last is not None:
+        selected.append(last)
+        last = prev[last]
+    return selected[::-1]
+
+
+def select_cliques(intervals, weights):
+    # Maximal cliques of the compatibility graph
+    G = nx.Graph()
+    for i in range(len(intervals)):
+        G.add_node(i)
+        for j in range(i):
+            if is_compatible(
+                intervals[i][0], intervals[i][1],
+                intervals[j][0], intervals[j][1]
+            ):
+                G.add_edge(i, j)
+
+    best_weight = None
+    selected = []
+    for clique in nx.find_cliques(G):
+        weight = reduce(add_weights, [weights[x] for x in clique])
+        if best_weight is None or weight > best_weight:
+            best_weight = weight
+            selected = clique
+    return sorted(selected, key=lambda x: intervals[x])
@@ -2,15 +2,19 @@
 
 '''
 Make nonredundant protein FASTA file.
+
+Input FASTA files are streamed record by record. Sequences are keyed by
+their SHA-1 and MD5 digests and length; a sequence is appended to the output
+when it is first seen and numbered in that order (prot_1, prot_2, ...). Two
+sequences are taken as identical when all three match, so only the keys of
+unique sequences are kept in memory.
 '''
 
 # Import modules
 import os
-import re
 import sys
-import mmap
+import hashlib
 from argparse import ArgumentParser
-from collections import defaultdict
 
 
 # Main function
@@ -41,55 +45,90 @@ def create_dir(output_dir):
 
 
 def make_nr_prot(faa_files, output_dir):
-    # Import FASTA & store in dictionary
-    # (key: prot_seq, value: (prefix, name))
-    D_nr_prot = defaultdict(list)
-    for faa_file in faa_files:
-        prefix = os.path.basename(faa_file).split('.')[0]
-        D_faa = defaultdict(str)
-        with open(faa_file, 'r+b') as f:
-            map = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
-            for line in iter(map.readline, ''):
-                line = line.rstrip()
-                if re.search('^>', line):
-                    prot_name = line.split(' ')[0].replace('>', '')
-                    continue
-
-                D_faa[prot_name] += line.strip()
-
-            for prot_name, seq in D_faa.items():
-                D_nr_prot[seq].append((prefix, prot_name))
-
-    # Write to FASTA & mapping file
+    # Returns D_mapping (key: (software, software_id), value: nr ID) and
+    # D_mapping_rev (key: nr ID, value: list of (software, software_id))
     outfile1 = os.path.join(output_dir, 'nr_prot.faa')
     outfile2 = os.path.join(output_dir, 'nr_prot_mapping.txt')
-
-    outhandle1 = open(outfile1, 'w')
-    outhandle2 = open(outfile2, 'w')
-    header_txt = '{}\t{}\t{}\n'.format('prot_name', 'software', 'software_id')
-    outhandle2.write(header_txt)
-
-    prot_num = 1
-    for seq, lst in D_nr_prot.items():
-        new_prot_name = 'prot_{}'.format(prot_num)
-        prot_num += 1
-
-        # Write FASTA
-        outhandle1.write('>{}\n'.format(new_prot_name))
-        i = 0
-        while i < len(seq):
-            outhandle1.write('{}\n'.format(seq[i:i + 60]))
-            i += 60
-
-        # Write mapping file
-        for element in lst:
-            software, software_id = element
-            row_txt = '{}\t{}\t{}\n'.format(new_prot_name, software, software_id)
-            outhandle2.write(row_txt)
-
-    # Close handle
-    outhandle1.close()
-    outhandle2.close()
+    D_mapping, D_mapping_rev = make_nr_fasta(
+        faa_files, get_prefix, outfile1, outfile2, 'prot_{}', 'prot_name'
+    )
+    return D_mapping, D_mapping_rev
+
+
+def get_prefix(faa_file):
+    return os.path.basename(faa_file).split('.')[0]
+
+
+def iter_fasta(fasta_file):
+    # Yield (seq_name, seq) of each record
+    seq_name = None
+    seq_lines = []
+    with open(fasta_file) as f_in:
+        for line in f_in:
+            line = line.strip()
+            if line.startswith('>'):
+                if seq_name is not None:
+                    yield seq_name, ''.join(seq_lines)
+                seq_name = line[1:].split(' ')[0]
+                seq_lines = []
+            elif line:
+                seq_lines.append(line)
+    if seq_name is not None:
+        yield seq_name, ''.join(seq_lines)
+
+
+def make_nr_fasta(
+    fasta_files, prefix_func, output_fasta, output_mapping, name_format,
+    name_column
+):
+    # Also used by make_nr_transcript.py. prefix_func gives the software
+    # name of an input file, name_format the nr IDs from their number
+    # (e.g. prot_{}) and name_column the mapping file header
+    D_nr = {}  # key: (SHA-1 digest, MD5 digest, length), value: nr ID
+    nr_names = []
+    D_mapping = {}
+    D_mapping_rev = {}
+
+    outhandle = open(output_fasta, 'w')
+    for fasta_file in fasta_files:
+        prefix = prefix_func(fasta_file)
+        for seq_name, seq in iter_fasta(fasta_file):
+            seq_key = (
+                hashlib.sha1(seq).digest(), hashlib.md5(seq).digest(),
+                len(seq)
+            )
+            nr_name = D_nr.get(seq_key)
+            if nr_name is None:
+                nr_name = name_format.format(len(nr_names) + 1)
+                nr_names.append(nr_name)
+                D_nr[seq_key] = nr_name
+                D_mapping_rev[nr_name] = []
+
+                # Write FASTA
+                outhandle.write('>{}\n'.format(nr_name))
+                i = 0
+                while i < len(seq):
+                    outhandle.write('{}\n'.format(seq[i:i + 60]))
+                    i += 60
+
+            element = (prefix, seq_name)
+            D_mapping[element] = nr_name
+            D_mapping_rev[nr_name].append(element)
+    outhandle.close()
+
+    # Write mapping file
+    outhandle = open(output_mapping, 'w')
+    header_txt = '{}\t{}\t{}\n'.format(
+        name_column, 'software', 'software_id'
+    )
+    outhandle.write(header_txt)
+    for nr_name in nr_names:
+        for software, software_id in D_mapping_rev[nr_name]:
+            row_txt = '{}\t{}\t{}\n'.format(nr_name, software, software_id)
+            outhandle.write(row_txt)
+    outhandle.close()
+
+    return D_mapping, D_mapping_rev
 
 
 if __name__ == '__main__':
@@ -0,0 +1,71 @@
+#!/usr/bin/env python2
+
+'''
+Make nonredundant transcript FASTA file (as make_nr_prot.py for proteins;
+transcripts are numbered in order of first appearance).
+
+Input: transcript FASTA files of each predictor (make_transcripts.py,
+       <prefix>_transcript.fna)
+Output: nr_transcript.fna and nr_transcript_mapping.txt
+'''
+
+# Import modules
+import os
+import re
+import sys
+from argparse import ArgumentParser
+
+this_path = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_path)
+sys.path.append(this_dir)
+from make_nr_prot import make_nr_fasta
+
+
+# Main function
+def main(argv):
+    optparse_usage = (
+        'make_nr_transcript.py -i <transcript_files> -o <output_dir>'
+    )
+    parser = ArgumentParser(usage=optparse_usage)
+    parser.add_argument(
+        '-i', '--transcript_files', nargs='+', required=True,
+        help='Input transcript FASTA files'
+    )
+    parser.add_argument(
+        '-o', '--output_dir', nargs='?', default='gene_filtering',
+        help='Output directory'
+    )
+
+    args = parser.parse_args()
+    transcript_files = [os.path.abspath(x) for x in args.transcript_files]
+    output_dir = os.path.abspath(args.output_dir)
+
+    # Run functions :)
+    create_dir(output_dir)
+    make_nr_transcript(transcript_files, output_dir)
+
+
+def create_dir(output_dir):
+    if not os.path.exists(output_dir):
+        os.mkdir(output_dir)
+
+
+def get_prefix(transcript_file):
+    # augustus_transcript.fna: augustus
+    return re.sub(r'_transcript\.fna$', '', os.path.basename(transcript_file))
+
+
+def make_nr_transcript(transcript_files, output_dir):
+    # Returns D_mapping (key: (software, software_id), value: nr ID) and
+    # D_mapping_rev (key: nr ID, value: list of (software, software_id))
+    outfile1 = os.path.join(output_dir, 'nr_transcript.fna')
+    outfile2 = os.path.join(output_dir, 'nr_transcript_mapping.txt')
+    D_mapping, D_mapping_rev = make_nr_fasta(
+        transcript_files, get_prefix, outfile1, outfile2, 'transcript_{}',
+        'transcript_name'
+    )
+    return D_mapping, D_mapping_rev
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -7,13 +7,19 @@ Author Byoungnam Min Aug 1, 2017
 
 # Import modules
 import sys
-import re
 import os
 from Bio.Seq import Seq
 from argparse import ArgumentParser
-from collections import defaultdict
 from Bio.Alphabet import generic_dna
 
+this_path = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_path)
+sys.path.append(this_dir)
+from genome_index import open_genome, fetch_seq
+from gene_models import (
+    load_models, num_models, model_key, get_features, has_cds
+)
+
 
 # Main function
 def main(argv):
@@ -39,13 +45,6 @@ def main(argv):
     parse_gff3(input_fasta, input_gff3)
 
 
-def import_file(input_file):
-    with open(input_file) as f_in:
-        txt = (line.rstrip() for line in f_in)
-        txt = list(line for line in txt if line)
-    return txt
-
-
 def get_reverse_complement(nuc_seq):
     my_dna = Seq(nuc_seq, generic_dna)
     rev_comp_dna = str(my_dna.reverse_complement())
@@ -53,62 +52,30 @@ def get_reverse_complement(nuc_seq):
 
 
 def parse_gff3(input_fasta, input_gff3):
-    # Read gff3
-    gff3 = import_file(input_gff3)
-
-    # Parse gff3 and store in dictionary
-    D_gff3 = defaultdict(list)
-    reg_parent = re.compile('Parent=([^;]+)')
-    for line in gff3:
-        if re.search('^#', line):  # Ignore comment
-            continue
-        line_split = line.split('\t')
-        entry_type = line_split[2]
-        if entry_type != 'CDS':  # Only consider 'CDS'
-            continue
-        scaffold = line_split[0]
-        start = int(line_split[3])
-        end = int(line_split[4])
-        strand = line_split[6]
-        phase = int(line_split[7])
-        gene_id = line_split[8]
-        gene_id = reg_parent.search(gene_id).group(1)
-        D_gff3[gene_id].append((scaffold, start, end, strand, phase))
-
-    # Read fasta
-    fasta = import_file(input_fasta)
-
-    # Parse fasta and store in dictionary
-    D_fasta = defaultdict(str)
-    for line in fasta:
-        if re.search(r'^>', line):
-            scaffold_id = line.split(' ')[0].replace('>', '')
-            continue
-        D_fasta[scaffold_id] += line
+    # Gene models (gene_models.py); only models with CDS are written
+    D_models = load_models([input_gff3])
+
+    # Indexed genome
+    D_genome = open_genome(input_fasta)
 
     # Extract sequence
     gff3_base = os.path.splitext(input_gff3)[0]
     output_transcript = '{}_transcript.fna'.format(gff3_base)
     output2 = open(output_transcript, 'w')
 
-    gene_ids = sorted(
-        D_gff3.keys(),
-        key=lambda x: x.replace('.t1', '')
+    model_ids = sorted(
+        [x for x in range(num_models(D_models)) if has_cds(D_models, x)],
+        key=lambda x: model_key(D_models, x)[1].replace('.t1', '')
     )
 
-    for gene_id in gene_ids:
-        feature = D_gff3[gene_id]
+    for model_id in model_ids:
+        gene_id = model_key(D_models, model_id)[1]
+        feature = [
+            (x[0], x[3], x[4], x[6], int(x[7]))
+            for x in get_features(D_models, model_id, 'CDS')
+        ]
         sorted_by_start = sorted(feature, key=lambda tup: tup[1])
 
-        # Gene sequcne
-        gene_scaffold = sorted_by_start[0][0]
-        gene_start = sorted_by_start[0][1]
-        gene_end = sorted_by_start[-1][2]
-
-        gene_seq = D_fasta[gene_scaffold][gene_start - 1:gene_end]
-        if strand == '-':
-            gene_seq = gene_seq[::-1]
-
         nuc_seq = ''
         for element in sorted_by_start:  # Feature is a list of tuple
             scaffold = element[0]
@@ -117,7 +84,7 @@ def parse_gff3(input_fasta, input_gff3):
             strand = element[3]
             phase = element[4]
 
-            nuc_seq += D_fasta[scaffold][start - 1:end]
+            nuc_seq += fetch_seq(D_genome, scaffold, start, end)
 
         # If it is '-' strand, reverse the transcript
         if strand == '-':
@@ -141,6 +108,8 @@ def parse_gff3(input_fasta, input_gff3):
 
     output2.close()
 
+    return output_transcript
+
 
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -0,0 +1,76 @@
+#!/usr/bin/env python2
+
+'''
+Hand out core and memory leases to concurrently running stages
+
+The broker splits the global --num_cores (and optionally --max_memory) budget
+between the stages that are ready to run. A stage asks for between
+min_cores and max_cores cores; it gets its fair share of the free cores,
+so a stage running alone uses the whole node and stages running side by side
+do not oversubscribe it. If even min_cores (or its memory) does not fit, the
+stage waits until a running stage returns its lease.
+'''
+
+# Import modules
+from collections import namedtuple
+
+Lease = namedtuple('Lease', ['cores', 'memory'])
+
+
+def init_broker(num_cores, max_memory=None):
+    # max_memory in GB; None means memory is not limited
+    D_broker = {
+        'cores': num_cores,
+        'memory': max_memory,
+        'total_cores': num_cores,
+        'total_memory': max_memory,
+    }
+    return D_broker
+
+
+def fit_memory(D_broker, memory):
+    if D_broker['memory'] is None or not memory:
+        return True
+    return memory <= D_broker['memory']
+
+
+def share_cores(D_broker, requests):
+    # requests: list of (min_cores, max_cores) of the ready stages.
+    # Free cores are split evenly; cores a small stage cannot use go to the
+    # bigger ones
+    total_cores = D_broker['total_cores']
+    requests = [
+        (min(x, total_cores), min(max(x, y), total_cores))
+        for x, y in requests
+    ]
+    shares = [0] * len(requests)
+    free_cores = D_broker['cores']
+    order = sorted(range(len(requests)), key=lambda x: requests[x][1])
+    for num_left, request_i in zip(range(len(order), 0, -1), order):
+        min_cores, max_cores = requests[request_i]
+        share = min(max(free_cores // num_left, min_cores), max_cores)
+        shares[request_i] = share
+        free_cores -= min(share, free_cores)
+
+    return shares
+
+
+def grant_lease(D_broker, cores, memory, idle):
+    # idle: nothing is running, so the lease must be granted
+    cores = min(cores, D_broker['total_cores'])
+    if not idle:
+        if cores > D_broker['cores'] or not fit_memory(D_broker, memory):
+            return None
+
+    if D_broker['memory'] is not None:
+        memory = min(memory, D_broker['total_memory'])
+        D_broker['memory'] -= memory
+    D_broker['cores'] -= cores
+
+    return Lease(cores, memory)
+
+
+def release_lease(D_broker, lease):
+    D_broker['cores'] += lease.cores
+    if D_broker['memory'] is not None:
+        D_broker['memory'] += lease.memory
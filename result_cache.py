@@ -0,0 +1,209 @@
+#!/usr/bin/env python2
+
+'''
+Cross-run cache of per-protein search results (BLASTp, Pfam_scan)
+
+Results are stored in an SQLite database, keyed by the tool, a fingerprint
+of the database searched (and of the tool and its options), and the SHA-1
+of the protein sequence. Only proteins missing from the cache are searched;
+the output file is then assembled in query order from cached and new
+results, so downstream parsers see the same file as from a full run.
+
+A result is the set of output lines of one query with the query ID
+stripped (the first whitespace-separated field), so it can be given back
+under another name. Queries without hits are cached as empty results. The
+comment header of the output (e.g. of pfam_scan.pl) is cached per tool and
+database, so a run whose proteins are all cached writes it too.
+
+Database fingerprint: files are hashed by content; directories (e.g. the
+Pfam database) by the names, sizes and modification times of their files.
+'''
+
+# Import modules
+import os
+import hashlib
+import sqlite3
+
+# Parameters
+batch_size = 500  # Digests per SELECT
+
+
+def open_cache(cache_db, tool, db_paths, params):
+    # Returns D_cache used by the functions below
+    conn = sqlite3.connect(cache_db, timeout=600)
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS results ('
+        'tool TEXT, db_key TEXT, seq_digest TEXT, result TEXT, '
+        'PRIMARY KEY (tool, db_key, seq_digest))'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS headers ('
+        'tool TEXT, db_key TEXT, header TEXT, PRIMARY KEY (tool, db_key))'
+    )
+    conn.commit()
+
+    sha1 = hashlib.sha1()
+    sha1.update(params)
+    for db_path in db_paths:
+        sha1.update(fingerprint_path(db_path))
+    D_cache = {
+        'conn': conn,
+        'tool': tool,
+        'db_key': sha1.hexdigest(),
+    }
+    return D_cache
+
+
+def close_cache(D_cache):
+    D_cache['conn'].close()
+
+
+def fingerprint_path(path):
+    sha1 = hashlib.sha1()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file_name in sorted(files):
+                file_path = os.path.join(root, file_name)
+                stat = os.stat(file_path)
+                sha1.update('{}\t{}\t{}\n'.format(
+                    os.path.relpath(file_path, path), stat.st_size,
+                    int(stat.st_mtime)
+                ))
+    elif os.path.isfile(path):
+        with open(path, 'rb') as f_in:
+            for chunk in iter(lambda: f_in.read(1 << 20), ''):
+                sha1.update(chunk)
+    else:
+        sha1.update(path)  # e.g. a program name found in PATH
+    return sha1.hexdigest()
+
+
+def read_fasta(input_fasta):
+    # Returns list of (seq_name, seq) in input order
+    records = []
+    with open(input_fasta) as f_in:
+        for line in f_in:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('>'):
+                records.append([line[1:].split()[0], []])
+            elif records:
+                records[-1][1].append(line)
+    return [(x[0], ''.join(x[1])) for x in records]
+
+
+def get_seq_digest(seq):
+    return hashlib.sha1(seq.upper()).hexdigest()
+
+
+def split_cached(D_cache, input_fasta, miss_fasta):
+    # Write proteins missing from the cache (once per sequence) to
+    # miss_fasta. Returns (records, D_result, num_misses); records is a list
+    # of (seq_name, digest), D_result maps digests to cached results
+    records = []
+    D_seq = {}
+    for seq_name, seq in read_fasta(input_fasta):
+        digest = get_seq_digest(seq)
+        records.append((seq_name, digest))
+        D_seq.setdefault(digest, (seq_name, seq))
+
+    D_result = fetch_results(D_cache, D_seq.keys())
+    num_misses = 0
+    outhandle = open(miss_fasta, 'w')
+    for seq_name, digest in records:
+        if digest in D_result or D_seq[digest][0] != seq_name:
+            continue
+        outhandle.write('>{}\n'.format(seq_name))
+        seq = D_seq[digest][1]
+        for i in xrange(0, len(seq), 60):
+            outhandle.write('{}\n'.format(seq[i:i + 60]))
+        num_misses += 1
+    outhandle.close()
+    return records, D_result, num_misses
+
+
+def fetch_results(D_cache, digests):
+    D_result = {}
+    digests = list(digests)
+    for i in xrange(0, len(digests), batch_size):
+        batch = digests[i:i + batch_size]
+        rows = D_cache['conn'].execute(
+            'SELECT seq_digest, result FROM results WHERE tool = ? AND '
+            'db_key = ? AND seq_digest IN ({})'.format(
+                ','.join('?' * len(batch))
+            ),
+            [D_cache['tool'], D_cache['db_key']] + batch
+        )
+        for digest, result in rows:
+            D_result[digest] = result
+    return D_result
+
+
+def fetch_header(D_cache):
+    # Returns the cached comment lines (output header)
+    row = D_cache['conn'].execute(
+        'SELECT header FROM headers WHERE tool = ? AND db_key = ?',
+        (D_cache['tool'], D_cache['db_key'])
+    ).fetchone()
+    if row is None or not row[0]:
+        return []
+    return row[0].split('\n')
+
+
+def add_results(D_cache, records, miss_fasta, miss_output, D_result):
+    # Store results of the searched proteins (miss_output) in the cache and
+    # in D_result. Returns comment lines of miss_output (output header),
+    # which are cached too
+    D_digest = dict(records)
+    D_lines = dict(
+        (seq_name, []) for seq_name, seq in read_fasta(miss_fasta)
+    )
+    header = []
+    with open(miss_output) as f_in:
+        for line in f_in:
+            line = line.rstrip('\n')
+            if line.startswith('#'):
+                header.append(line)
+                continue
+            if not line.strip():
+                continue
+            seq_name = line.split(None, 1)[0]
+            D_lines[seq_name].append(line[len(seq_name):])
+
+    rows = []
+    for seq_name, lines in D_lines.items():
+        result = '\n'.join(lines)
+        D_result[D_digest[seq_name]] = result
+        rows.append(
+            (D_cache['tool'], D_cache['db_key'], D_digest[seq_name], result)
+        )
+    D_cache['conn'].executemany(
+        'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', rows
+    )
+    if header:
+        D_cache['conn'].execute(
+            'INSERT OR REPLACE INTO headers VALUES (?, ?, ?)',
+            (D_cache['tool'], D_cache['db_key'], '\n'.join(header))
+        )
+    D_cache['conn'].commit()
+    return header
+
+
+def write_results(records, D_result, output_file, header=()):
+    tmp_file = '{}.tmp'.format(output_file)
+    outhandle = open(tmp_file, 'w')
+    # Header followed by a blank line, as in pfam_scan.pl output
+    for line in header:
+        outhandle.write('{}\n'.format(line))
+    if header:
+        outhandle.write('\n')
+    for seq_name, digest in records:
+        result = D_result[digest]
+        if not result:
+            continue
+        for line in result.split('\n'):
+            outhandle.write('{}{}\n'.format(seq_name, line))
+    outhandle.close()
+    os.rename(tmp_file, output_file)
@@ -18,6 +18,12 @@ augustus\
     prediction including slight overlap between two neighboring genes on
     opposite strand.
 
+With --num_cores > 1, the assembly is split into scaffold batches of similar
+total length (fasta_shards.py) that are run in a process pool. Batch outputs
+are merged in the original scaffold order, renumbering sequence numbers and
+gene IDs (g1, g2, ...) as a single AUGUSTUS run would have. Batches are
+reused only by a run with the same species and AUGUSTUS.
+
 Input: masked assembly and species parameter for Augustus
 Output: gene features in GFF3
 '''
@@ -26,7 +32,9 @@ Output: gene features in GFF3
 import sys
 import re
 import os
+import subprocess
 from glob import glob
+from multiprocessing import Pool
 from argparse import ArgumentParser
 from collections import defaultdict
 
@@ -36,10 +44,25 @@ this_dir = os.path.dirname(this_path)
 sys.path.append(this_dir)
 from set_logging import set_logging
 from import_config import import_config
+from fasta_shards import (
+    check_stamp, get_seq_lengths, balance_shards, write_shards
+)
+from result_cache import fingerprint_path
+from augustus_gff3 import write_proteins
 
 # Parameters
 D_conf = import_config(this_dir)
 augustus_bin = D_conf['AUGUSTUS_PATH']
+batches_per_core = 2  # More batches than cores evens out the run times
+
+# Regular expressions for merging batch outputs
+reg_seq_header = re.compile(
+    r'^# ----- prediction on sequence number \d+ '
+    r'\(length = (\d+), name = (\S+)\) -----$'
+)
+reg_gene_comment = re.compile(r'^# (start|end) gene (\S+)$')
+reg_gene_num = re.compile(r'(^|\.)g(\d+)(?=\.t\d+|$)')
+reg_attr_id = re.compile(r'(ID|Parent)=([^;]+)')
 
 
 def main(argv):
@@ -61,12 +84,17 @@ def main(argv):
         '-l', '--log_dir', nargs='?', default='logs',
         help='Log directory'
     )
+    parser.add_argument(
+        '-c', '--num_cores', nargs='?', default=1, type=int,
+        help='Number of cores (default: 1)'
+    )
 
     args = parser.parse_args()
     masked_assembly = os.path.abspath(args.masked_assembly[0])
     species = args.species[0]
     output_dir = os.path.abspath(args.output_dir)
     log_dir = os.path.abspath(args.log_dir)
+    num_cores = args.num_cores
 
     # Create necessary dirs
     create_dir(output_dir, log_dir)
@@ -77,18 +105,11 @@ def main(argv):
     logger_time, logger_txt = set_logging(log_file)
 
     # Run functions :) Slow is as good as Fast
-    run_augustus(masked_assembly, output_dir, species)
+    run_augustus(masked_assembly, output_dir, species, num_cores)
     parse_augustus(output_dir)
 
 
 # Define functions
-def import_file(input_file):
-    with open(input_file) as f_in:
-        txt = (line.rstrip() for line in f_in)
-        txt = list(line for line in txt if line)
-    return txt
-
-
 def create_dir(output_dir, log_dir):
     if not glob(output_dir):
         os.mkdir(output_dir)
@@ -97,7 +118,16 @@ def create_dir(output_dir, log_dir):
         os.mkdir(log_dir)
 
 
-def run_augustus(masked_assembly, output_dir, species):
+def augustus_command(input_fasta, species, output_gff3):
+    command = (
+        '{} --uniqueGeneId=true --singlestrand=true --gff3=on {} '
+        '--species={} --stopCodonExcludedFromCDS=false --softmasking=1 '
+        '> {}'.format(augustus_bin, input_fasta, species, output_gff3)
+    )
+    return command
+
+
+def run_augustus(masked_assembly, output_dir, species, num_cores=1):
     # augustus --uniqueGeneId=true --gff3=on Neucr2_AssemblyScaffolds.fasta
     # --species=fusarium_graminearum --stopCodonExcludedFromCDS=false
     # > Neucr2.gff3
@@ -106,91 +136,185 @@ def run_augustus(masked_assembly, output_dir, species):
 
     # Run AUGUSTUS
     logger_time.debug('START: Augustus')
-    if not glob(augustus_output):
-        command = (
-            '{} --uniqueGeneId=true --singlestrand=true --gff3=on {} '
-            '--species={} --stopCodonExcludedFromCDS=false --softmasking=1 '
-            '> {}'.format(
-            augustus_bin, masked_assembly, species, augustus_output
-        ))
+    if glob(augustus_output):
+        logger_txt.debug('Running Augustus has already been finished')
+    elif num_cores <= 1:
+        command = augustus_command(masked_assembly, species, augustus_output)
         logger_txt.debug('[Run] {}'.format(command))
         os.system(command)
     else:
-        logger_txt.debug('Running Augustus has already been finished')
+        run_augustus_batches(masked_assembly, output_dir, species, num_cores)
     logger_time.debug('DONE : Augustus')
 
 
+def run_augustus_batch(args):
+    # Run in a worker process. Output is renamed from .tmp when finished, so
+    # an interrupted run resumes with the unfinished batches
+    batch_fasta, species, batch_gff3 = args
+    tmp_gff3 = '{}.tmp'.format(batch_gff3)
+    command = augustus_command(batch_fasta, species, tmp_gff3)
+    return_code = subprocess.call(command, shell=True)
+    if return_code == 0:
+        os.rename(tmp_gff3, batch_gff3)
+    return batch_gff3, command, return_code
+
+
+def run_augustus_batches(masked_assembly, output_dir, species, num_cores):
+    # Batch outputs of another species or AUGUSTUS are not reused
+    batch_dir = os.path.join(output_dir, 'augustus_batches')
+    stamp = '{}\n{}\n'.format(
+        augustus_command('<input_fasta>', species, '<output_gff3>'),
+        fingerprint_path(augustus_bin)
+    )
+    check_stamp(batch_dir, stamp)
+
+    # Split assembly into batches of similar total length
+    seq_lengths = get_seq_lengths(masked_assembly)
+    assignment = balance_shards(seq_lengths, num_cores * batches_per_core)
+    num_batches = max(assignment) + 1 if assignment else 0
+    batch_fastas = [
+        os.path.join(batch_dir, 'batch_{}.fasta'.format(x))
+        for x in range(num_batches)
+    ]
+    batch_gff3s = [
+        os.path.join(batch_dir, 'batch_{}.gff3'.format(x))
+        for x in range(num_batches)
+    ]
+    changed = write_shards(masked_assembly, assignment, batch_fastas)
+    for batch_fasta, batch_gff3 in zip(batch_fastas, batch_gff3s):
+        if batch_fasta in changed and glob(batch_gff3):
+            os.remove(batch_gff3)
+
+    # Run AUGUSTUS on unfinished batches, longest first
+    D_batch_len = defaultdict(int)
+    for (seq_name, seq_len), batch_i in zip(seq_lengths, assignment):
+        D_batch_len[batch_i] += seq_len
+    jobs = [
+        (batch_fastas[x], species, batch_gff3s[x])
+        for x in sorted(D_batch_len, key=lambda x: -D_batch_len[x])
+        if not glob(batch_gff3s[x])
+    ]
+    logger_txt.debug('[Run] Augustus on {} of {} batches with {} cores'.format(
+        len(jobs), num_batches, num_cores
+    ))
+    if jobs:
+        pool = Pool(min(num_cores, len(jobs)))
+        try:
+            results = pool.map(run_augustus_batch, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        for batch_gff3, command, return_code in results:
+            logger_txt.debug('[Run] {}'.format(command))
+            if return_code != 0:
+                sys.exit('[ERROR] Augustus failed on {}'.format(
+                    os.path.basename(batch_gff3)
+                ))
+
+    # Merge batch outputs in the original scaffold order
+    augustus_output = os.path.join(output_dir, 'augustus.gff3')
+    tmp_output = '{}.tmp'.format(augustus_output)
+    command = augustus_command(masked_assembly, species, augustus_output)
+    merge_augustus(
+        seq_lengths, assignment, batch_fastas, batch_gff3s, masked_assembly,
+        tmp_output, command.split(' > ')[0]
+    )
+    os.rename(tmp_output, augustus_output)
+
+
+def iter_sections(batch_gff3):
+    # Yield (seq_name, lines) per "prediction on sequence" section. Lines
+    # before the first section are yielded with seq_name None, and the
+    # "# command line:" footer is dropped
+    seq_name = None
+    lines = []
+    with open(batch_gff3) as f_in:
+        for line in f_in:
+            if line.startswith('# command line:'):
+                break
+            m_seq_header = reg_seq_header.search(line.rstrip('\n'))
+            if m_seq_header:
+                yield seq_name, lines
+                seq_name = m_seq_header.group(2)
+                lines = []
+            lines.append(line)
+    yield seq_name, lines
+
+
+def renumber_gene(value, batch_i, D_gene_num):
+    # g<N> in gene, transcript and feature IDs; numbers are assigned in
+    # order of appearance in the merged output
+    def replace(m_gene_num):
+        key = (batch_i, m_gene_num.group(2))
+        if key not in D_gene_num:
+            D_gene_num[key] = len(D_gene_num) + 1
+        return '{}g{}'.format(m_gene_num.group(1), D_gene_num[key])
+
+    return reg_gene_num.sub(replace, value, count=1)
+
+
+def renumber_line(line, batch_i, seq_num, D_gene_num):
+    if line.startswith('#') and 'sequence number' in line:
+        return re.sub(
+            r'sequence number \d+', 'sequence number {}'.format(seq_num),
+            line, count=1
+        )
+
+    m_gene_comment = reg_gene_comment.search(line.rstrip('\n'))
+    if m_gene_comment:
+        return '# {} gene {}\n'.format(
+            m_gene_comment.group(1),
+            renumber_gene(m_gene_comment.group(2), batch_i, D_gene_num)
+        )
+
+    if line.startswith('#') or '\t' not in line:
+        return line
+
+    line_split = line.rstrip('\n').split('\t')
+    line_split[-1] = reg_attr_id.sub(
+        lambda x: '{}={}'.format(
+            x.group(1), renumber_gene(x.group(2), batch_i, D_gene_num)
+        ), line_split[-1]
+    )
+    return '{}\n'.format('\t'.join(line_split))
+
+
+def merge_augustus(
+    seq_lengths, assignment, batch_fastas, batch_gff3s, input_fasta,
+    output_gff3, command
+):
+    # Each batch output has its scaffolds in input order, so sections are
+    # merged by reading the batch of each scaffold in turn
+    batch_iters = [iter_sections(x) for x in batch_gff3s]
+    D_gene_num = {}
+    outhandle = open(output_gff3, 'w')
+    for batch_i, batch_iter in enumerate(batch_iters):
+        seq_name, lines = next(batch_iter)  # Header
+        if batch_i == 0:
+            for line in lines:
+                outhandle.write(line.replace(batch_fastas[0], input_fasta))
+
+    D_pending = {}
+    for seq_num, ((seq_name, seq_len), batch_i) in enumerate(
+        zip(seq_lengths, assignment), start=1
+    ):
+        if batch_i not in D_pending:
+            D_pending[batch_i] = next(batch_iters[batch_i], (None, []))
+        section_name, lines = D_pending[batch_i]
+        if section_name != seq_name:
+            continue  # No section for this scaffold
+        del D_pending[batch_i]
+        for line in lines:
+            outhandle.write(renumber_line(line, batch_i, seq_num, D_gene_num))
+
+    outhandle.write('# command line:\n# {}\n'.format(command))
+    outhandle.close()
+
+
 def parse_augustus(output_dir):
     augustus_gff3_file = os.path.join(output_dir, 'augustus.gff3')
-    augustus_gff3 = import_file(augustus_gff3_file)
-
-    # Define regular expression
-    reg_transcript = re.compile(r'\ttranscript\t.+ID=([^;]+)')
-    reg_proSeq_start = re.compile(r'^# protein sequence = \[(\S+)\]*')
-    reg_proSeq_end = re.compile(r'\]$')
-
-    prot_tag = 0
-    D_seq = defaultdict(str)
-    for line in augustus_gff3:
-        # Exclude comment lines of BRAKER1 output
-        if re.search('# Evidence for and against this transcript:', line):
-            continue
-        elif re.search('# % of transcript supported by hints', line):
-            continue
-        elif re.search('# CDS exons', line):
-            continue
-        elif re.search('# CDS introns', line):
-            continue
-        elif re.search("# 5'UTR exons and introns:", line):
-            continue
-        elif re.search("# 3'UTR exons and introns:", line):
-            continue
-        elif re.search("# hint groups fully obeyed:", line):
-            continue
-        elif re.search("# incompatible hint groups:", line):
-            continue
-        elif re.search("#      E:", line):
-            continue
-        elif re.search("#     RM:", line):
-            continue
-
-        m_transcript = reg_transcript.search(line)
-        m_proSeq_start = reg_proSeq_start.search(line)
-        m_proSeq_end = reg_proSeq_end.search(line)
-
-        if m_transcript:
-            transcript_id = m_transcript.group(1)
-        elif m_proSeq_start:
-            prot_tag = 1
-
-        if m_proSeq_end:
-            prot_seq = line.replace('# protein sequence = [', '')
-            prot_seq = prot_seq.replace('# ', '').replace(']', '')
-            D_seq[transcript_id] += prot_seq
-            prot_tag = 0
-
-        if prot_tag == 1:
-            prot_seq = (
-                line.replace('# protein sequence = [', '')
-                    .replace('# ', '')
-            )
-            D_seq[transcript_id] += prot_seq
-
-    # Write to file
     outfile = os.path.join(output_dir, 'augustus.faa')
-    outhandle = open(outfile, "w")
-    D_seq_sorted = sorted(
-        D_seq.items(),
-        key=lambda x: int(re.search(r'g(\d+)\.t\d+$', x[0]).group(1))
-    )
-    for transcript_id, prot_seq in D_seq_sorted:
-        header_txt = '>{}\n'.format(transcript_id)
-        outhandle.write(header_txt)
-        i = 0
-        while i < len(prot_seq):
-            row_txt = '{}\n'.format(prot_seq[i:i + 60])
-            outhandle.write(row_txt)
-            i += 60
+    write_proteins(augustus_gff3_file, outfile, by_gene_number=True)
 
 
 if __name__ == "__main__":
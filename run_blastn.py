@@ -2,11 +2,16 @@
 
 '''
 Run BLASTn for given two FASTA files
+
+The nucleotide database is built only when its index is missing or older
+than the database FASTA, so several queries (e.g. transcripts of each
+predictor) can share one build.
 '''
 
 # Import modules
 import os
 import sys
+from glob import glob
 from argparse import ArgumentParser
 
 # Get Logging
@@ -82,28 +87,48 @@ def create_dir(log_dir):
         os.mkdir(log_program_dir)
 
 
+def make_blastdb(db_fasta, log_dir):
+    # makeblastdb -in <db_fasta> -dbtype nucl; skipped if the index is
+    # up to date (single or multi-volume)
+    index_files = glob('{}.*nhr'.format(db_fasta))
+    if index_files and min(
+        os.path.getmtime(x) for x in index_files
+    ) >= os.path.getmtime(db_fasta):
+        logger_txt.debug('Running makeblastdb has already been finished')
+        return
+
+    makeblastdb_bin = D_conf['MAKEBLASTDB_PATH']
+    log_file1 = os.path.join(log_dir, program_name, 'makeblastdb.log')
+    command1 = '{} -in {} -dbtype nucl > {} 2>&1'.format(
+        makeblastdb_bin, db_fasta, log_file1
+    )
+    logger_txt.debug('[Run] {}'.format(command1))
+    os.system(command1)
+
+
 def run_blastn(query_fasta, db_fasta, output_prefix, log_dir, num_cores):
+    # Output is renamed from .tmp when BLASTn finishes, so concurrent runs
+    # for other queries or an interrupted run never leave a partial output
     blastn_out = '{}.blastn'.format(output_prefix)
     if not os.path.exists(blastn_out):
-        makeblastdb_bin = D_conf['MAKEBLASTDB_PATH']
-        log_file1 = os.path.join(log_dir, program_name, 'makeblastdb.log')
-        command1 = '{} -in {} -dbtype nucl > {} 2>&1'.format(
-            makeblastdb_bin, db_fasta, log_file1
-        )
-        logger_txt.debug('[Run] {}'.format(command1))
-        os.system(command1)
+        make_blastdb(db_fasta, log_dir)
 
         blastn_bin = D_conf['BLASTN_PATH']
-        log_file2 = os.path.join(log_dir, program_name, 'blastn.log')
+        tmp_out = '{}.tmp'.format(blastn_out)
+        log_file2 = os.path.join(log_dir, program_name, '{}.log'.format(
+            os.path.basename(output_prefix)
+        ))
         command2 = (
             '{} -query {} -db {} -out {} -outfmt "6 qseqid sseqid length '
             'qlen slen bitscore" -num_threads {} -evalue 1e-5 > {} 2>&1'.format(
-                blastn_bin, query_fasta, db_fasta, blastn_out, num_cores,
+                blastn_bin, query_fasta, db_fasta, tmp_out, num_cores,
                 log_file2
             )
         )
         logger_txt.debug('[Run] {}'.format(command2))
-        os.system(command2)
+        if os.system(command2) != 0:
+            sys.exit('[ERROR] BLASTn failed on {}'.format(query_fasta))
+        os.rename(tmp_out, blastn_out)
     else:
         logger_txt.debug('Running BLASTn has already been finished')
 
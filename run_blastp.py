@@ -2,15 +2,26 @@
 
 '''
 Run Blastp to databases
+
+With --num_cores > 1, the query FASTA is split into shards of similar total
+length (fasta_shards.py), each searched by a single-threaded blastp in a
+process pool, and the shard outputs are merged back in query order. A shard output is renamed from .tmp only when its blastp finishes, so
+an interrupted run resumes with the unfinished shards. Shards are reused only
+by a run with the same database, blastp and options.
+
+With --cache_db, results are looked up in a cross-run cache keyed by
+protein sequence and database (result_cache.py); only the missing proteins
+are searched.
 '''
 
 # Import modules
 import sys
 import re
 import os
+import subprocess
 from glob import glob
+from multiprocessing import Pool
 from argparse import ArgumentParser
-from collections import defaultdict
 
 # Get Logging
 this_path = os.path.realpath(__file__)
@@ -18,18 +29,28 @@ this_dir = os.path.dirname(this_path)
 sys.path.append(this_dir)
 from set_logging import set_logging
 from import_config import import_config
+from fasta_shards import (
+    check_stamp, get_seq_lengths, balance_shards, write_shards,
+    merge_outputs
+)
+from result_cache import (
+    open_cache, close_cache, split_cached, add_results, write_results,
+    fingerprint_path
+)
 
 # Parameters
 D_conf = import_config(this_dir)
 evalue_cut = 0.00001
 program_name = 'blastp'
+outfmt = '6 qseqid sseqid length qlen slen bitscore'
+shards_per_core = 2
 
 
 # Main function
 def main(argv):
     argparse_usage = (
         'run_blast_reduce.py -q <query_fasta> -d <db_fasta> '
-        '-l <log_dir> -c <num_cores>'
+        '-l <log_dir> -c <num_cores> [--cache_db <cache_db>]'
     )
     parser = ArgumentParser(usage=argparse_usage)
     parser.add_argument(
@@ -48,12 +69,20 @@ def main(argv):
         '-c', '--num_cores', nargs='?', default=1, type=int,
         help='Number of cores to be used'
     )
+    parser.add_argument(
+        '--cache_db', nargs='?', default=None,
+        help='SQLite cache of results shared across runs'
+    )
 
     args = parser.parse_args()
     query_fasta = os.path.abspath(args.query_fasta[0])
     db_fasta = os.path.abspath(args.db_fasta[0])
     log_dir = args.log_dir
     num_cores = args.num_cores
+    if args.cache_db:
+        cache_db = os.path.abspath(args.cache_db)
+    else:
+        cache_db = None
 
     # Check input FASTA is valid
     if not glob(query_fasta):
@@ -70,7 +99,7 @@ def main(argv):
 
     # Run functions :) Slow is as good as Fast
     logger_time.debug('START: BLASTp')
-    run_blastp(query_fasta, db_fasta, log_dir, num_cores)
+    run_blastp(query_fasta, db_fasta, log_dir, num_cores, cache_db)
     logger_time.debug('DONE : BLASTp')
 
 
@@ -83,7 +112,7 @@ def create_dir(log_dir):
         os.mkdir(log_program_dir)
 
 
-def run_blastp(query_fasta, db_fasta, log_dir, num_cores):
+def run_blastp(query_fasta, db_fasta, log_dir, num_cores, cache_db=None):
     # Run makeblastdb. Usage: makeblastdb -in <db_fasta> -dbtype prot
     makeblastdb_bin = D_conf['MAKEBLASTDB_PATH']
     blast_index_file = '{}.*phr'.format(db_fasta)
@@ -100,23 +129,139 @@ def run_blastp(query_fasta, db_fasta, log_dir, num_cores):
         logger_txt.debug('Running makeblastdb has been already finished')
 
     # Run BLASTp
-    # blastp -outfmt "7 qseqid sseqid length qlen slen bitscore"
-    # -query <query_fasta> -db <db_prefix> -out <out_file>
-    # -num_threads <num_cores>
-    blastp_bin = D_conf['BLASTP_PATH']
     input_base = os.path.splitext(query_fasta)[0]
     blastp_output = '{}.blastp'.format(input_base)
-    log_file2 = os.path.join(log_dir, program_name, 'blastp.log')
-    if not glob(blastp_output) or os.stat(blastp_output)[6] == 0:
-        command = (
-            '{} -outfmt "6 qseqid sseqid length qlen slen bitscore" -query '
-            '{} -db {} -out {} -num_threads {} > {} 2>&1'.format(
-                blastp_bin, query_fasta, db_fasta, blastp_output, num_cores,
-                log_file2
-            )
+    if glob(blastp_output) and os.stat(blastp_output)[6] != 0:
+        logger_txt.debug('Running BLASTp has been already finished')
+    elif cache_db:
+        run_blastp_cached(query_fasta, db_fasta, log_dir, num_cores, cache_db)
+    else:
+        search_blastp(query_fasta, db_fasta, log_dir, num_cores)
+
+
+def search_blastp(query_fasta, db_fasta, log_dir, num_cores):
+    # Output: <query base>.blastp
+    if num_cores <= 1:
+        blastp_output = '{}.blastp'.format(os.path.splitext(query_fasta)[0])
+        log_file2 = os.path.join(log_dir, program_name, 'blastp.log')
+        command = blastp_command(
+            query_fasta, db_fasta, blastp_output, num_cores, log_file2
         )
         logger_txt.debug('[Run] {}'.format(command))
         os.system(command)
+    else:
+        run_blastp_shards(query_fasta, db_fasta, log_dir, num_cores)
+
+
+def run_blastp_cached(query_fasta, db_fasta, log_dir, num_cores, cache_db):
+    # Search only the proteins missing from the cache
+    input_base = os.path.splitext(query_fasta)[0]
+    blastp_output = '{}.blastp'.format(input_base)
+    miss_fasta = '{}.blastp_miss.faa'.format(input_base)
+    miss_output = '{}.blastp_miss.blastp'.format(input_base)
+    D_cache = open_cache(
+        cache_db, program_name, [db_fasta, D_conf['BLASTP_PATH']], outfmt
+    )
+    records, D_result, num_misses = split_cached(
+        D_cache, query_fasta, miss_fasta
+    )
+    logger_txt.debug('[Cache] {} of {} proteins found in {}'.format(
+        len(records) - num_misses, len(records), cache_db
+    ))
+    if num_misses:
+        if glob(miss_output):
+            os.remove(miss_output)
+        search_blastp(miss_fasta, db_fasta, log_dir, num_cores)
+        if not glob(miss_output):
+            sys.exit('[ERROR] BLASTp failed on {}'.format(miss_fasta))
+        add_results(D_cache, records, miss_fasta, miss_output, D_result)
+    close_cache(D_cache)
+    write_results(records, D_result, blastp_output)
+
+
+def blastp_command(query_fasta, db_fasta, output, num_threads, log_file):
+    # blastp -outfmt "6 qseqid sseqid length qlen slen bitscore"
+    # -query <query_fasta> -db <db_prefix> -out <out_file>
+    # -num_threads <num_cores>
+    blastp_bin = D_conf['BLASTP_PATH']
+    command = (
+        '{} -outfmt "{}" -query {} -db {} -out {} -num_threads {} > {} '
+        '2>&1'.format(
+            blastp_bin, outfmt, query_fasta, db_fasta, output, num_threads,
+            log_file
+        )
+    )
+    return command
+
+
+def run_blastp_shard(args):
+    # Run in a worker process. Output is renamed from .tmp when finished
+    shard_fasta, db_fasta, shard_output, log_file = args
+    tmp_output = '{}.tmp'.format(shard_output)
+    command = blastp_command(shard_fasta, db_fasta, tmp_output, 1, log_file)
+    return_code = subprocess.call(command, shell=True)
+    if return_code == 0:
+        os.rename(tmp_output, shard_output)
+    return shard_output, command, return_code
+
+
+def run_blastp_shards(query_fasta, db_fasta, log_dir, num_cores):
+    input_base = os.path.splitext(query_fasta)[0]
+    shard_dir = '{}_blastp_shards'.format(input_base)
+    stamp = '{}\n{}\n{}\n'.format(
+        blastp_command('<query_fasta>', db_fasta, '<output>', 1, '<log_file>'),
+        fingerprint_path(db_fasta), fingerprint_path(D_conf['BLASTP_PATH'])
+    )
+    check_stamp(shard_dir, stamp)
+
+    # Split queries into shards of similar total length
+    seq_lengths = get_seq_lengths(query_fasta)
+    assignment = balance_shards(seq_lengths, num_cores * shards_per_core)
+    num_shards = max(assignment) + 1 if assignment else 0
+    shard_fastas = [
+        os.path.join(shard_dir, 'shard_{}.faa'.format(x))
+        for x in range(num_shards)
+    ]
+    shard_outputs = [
+        os.path.join(shard_dir, 'shard_{}.blastp'.format(x))
+        for x in range(num_shards)
+    ]
+    changed = write_shards(query_fasta, assignment, shard_fastas)
+    for shard_fasta, shard_output in zip(shard_fastas, shard_outputs):
+        if shard_fasta in changed and glob(shard_output):
+            os.remove(shard_output)
+
+    # Run BLASTp on unfinished shards
+    jobs = [
+        (
+            shard_fastas[x], db_fasta, shard_outputs[x],
+            os.path.join(log_dir, program_name, 'blastp_{}.log'.format(x))
+        )
+        for x in range(num_shards) if not glob(shard_outputs[x])
+    ]
+    logger_txt.debug('[Run] BLASTp on {} of {} shards with {} cores'.format(
+        len(jobs), num_shards, num_cores
+    ))
+    if jobs:
+        pool = Pool(min(num_cores, len(jobs)))
+        try:
+            results = pool.map(run_blastp_shard, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        for shard_output, command, return_code in results:
+            logger_txt.debug('[Run] {}'.format(command))
+            if return_code != 0:
+                sys.exit('[ERROR] BLASTp failed on {}'.format(
+                    os.path.basename(shard_output)
+                ))
+
+    # Merge shard outputs in query order
+    blastp_output = '{}.blastp'.format(input_base)
+    tmp_output = '{}.tmp'.format(blastp_output)
+    with open(tmp_output, 'w') as outhandle:
+        merge_outputs(seq_lengths, assignment, shard_outputs, outhandle)
+    os.rename(tmp_output, blastp_output)
 
 
 if __name__ == '__main__':
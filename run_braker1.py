@@ -17,7 +17,7 @@ braker.pl\
     useful for fungal genomes)
 
 Input: BAM file (Hisat-generated), masked assembly
-Output: gene features in GFF3
+Output: gene features in GFF3 and proteins in FASTA (augustus_gff3.py)
 '''
 
 # Import modules
@@ -32,6 +32,7 @@ this_dir = os.path.dirname(this_path)
 sys.path.append(this_dir)
 from set_logging import set_logging
 from import_config import import_config
+from augustus_gff3 import write_proteins
 
 # Parameters
 D_conf = import_config(this_dir)
@@ -164,30 +165,23 @@ def run_braker1(
             logger_txt.debug('[Run] {}'.format(command1))
             os.system(command1)
 
-            # Change file name
-            command2 = 'mv {} {}'.format(
-                glob(os.path.join(
-                    output_dir, prefix, 'braker/*', 'augustus.gff3')
-                )[0],
-                os.path.join(
-                    output_dir, prefix,
-                    'braker1_{}.gff3'.format(prefix)
-                )
+            # Proteins from the comment blocks of the GFF3. Written before
+            # the GFF3 is renamed, which marks BRAKER1 as finished
+            augustus_gff3 = glob(os.path.join(
+                output_dir, prefix, 'braker/*', 'augustus.gff3')
+            )[0]
+            faa_braker1 = os.path.join(
+                output_dir, prefix, 'braker1_{}.faa'.format(prefix)
             )
+            logger_txt.debug('[Run] Extract proteins to {}'.format(
+                faa_braker1
+            ))
+            write_proteins(augustus_gff3, faa_braker1)
+
+            # Change file name
+            command2 = 'mv {} {}'.format(augustus_gff3, gff3_braker1)
             logger_txt.debug('[Run] {}'.format(command2))
             os.system(command2)
-
-            command3 = 'mv {} {}'.format(
-                glob(os.path.join(
-                    output_dir, prefix, 'braker/*', 'augustus.aa')
-                )[0],
-                os.path.join(
-                    output_dir, prefix,
-                    'braker1_{}.faa'.format(prefix)
-                )
-            )
-            logger_txt.debug('[Run] {}'.format(command3))
-            os.system(command3)
         else:
             logger_txt.debug('Braker1 has already been finished')
     logger_time.debug('DONE : Braker1')
@@ -74,6 +74,7 @@ this_dir = os.path.dirname(this_path)
 sys.path.append(this_dir)
 from set_logging import set_logging
 from import_config import import_config
+from genome_index import open_genome, seq_names
 
 # Parameters
 D_conf = import_config(this_dir)
@@ -299,13 +300,7 @@ def check_maker_finished(output_dir, input_fasta, version, prefix):
         finished_scaffold = line_split[0]
         finished_scaffolds.append(finished_scaffold)
 
-    fasta = import_file(input_fasta)
-    fasta_scaffolds = []
-    for line in fasta:
-        if not re.search('^>', line):
-            continue
-        fasta_scaffold = line.split(' ')[0].replace('>', '')
-        fasta_scaffolds.append(fasta_scaffold)
+    fasta_scaffolds = seq_names(open_genome(input_fasta))
 
     if finished_scaffolds == fasta_scaffolds:
         return False
@@ -3,6 +3,18 @@
 '''
 Run Pfam_scan for Pfam domain identification on predicted genes
 
+With --num_cores > 1, the proteins are split into shards of similar total
+length (fasta_shards.py), each searched by a single-CPU pfam_scan.pl in a
+process pool, and the shard outputs are merged in shard order with the
+comment header kept once. A shard output is renamed from .tmp only when its
+pfam_scan.pl finishes, so an interrupted run resumes with the unfinished
+shards. Shards are reused only by a run with the same Pfam database,
+pfam_scan.pl and options.
+
+With --cache_db, results are looked up in a cross-run cache keyed by
+protein sequence and Pfam database (result_cache.py); only the missing
+proteins are searched.
+
 Input: protein FASTA file
 Output: Identified Pfam domains .tsv format
 '''
@@ -11,6 +23,9 @@ Output: Identified Pfam domains .tsv format
 import sys
 import os
 import re
+import subprocess
+from glob import glob
+from multiprocessing import Pool
 from argparse import ArgumentParser
 from collections import defaultdict
 
@@ -20,15 +35,26 @@ this_dir = os.path.dirname(this_path)
 sys.path.append(this_dir)
 from set_logging import set_logging
 from import_config import import_config
+from fasta_shards import (
+    check_stamp, get_seq_lengths, balance_shards, write_shards
+)
+from result_cache import (
+    open_cache, close_cache, split_cached, fetch_header, add_results,
+    write_results, fingerprint_path
+)
 
 # Parameters
 D_conf = import_config(this_dir)
 program_name = 'pfam_scan'
+shards_per_core = 2
 
 
 # Main function
 def main(argv):
-    argparse_usage = 'run_pfam_scan.py -i <input_fasta> -l <log_dir>'
+    argparse_usage = (
+        'run_pfam_scan.py -i <input_fasta> -l <log_dir> '
+        '[--cache_db <cache_db>]'
+    )
     parser = ArgumentParser(usage=argparse_usage)
     parser.add_argument(
         '-i', '--input_fasta', nargs=1, required=True,
@@ -42,11 +68,19 @@ def main(argv):
         '-c', '--num_cores', nargs='?', default=1, type=int,
         help='Number of cores to be used'
     )
+    parser.add_argument(
+        '--cache_db', nargs='?', default=None,
+        help='SQLite cache of results shared across runs'
+    )
 
     args = parser.parse_args()
     input_fasta = os.path.abspath(args.input_fasta[0])
     log_dir = os.path.abspath(args.log_dir)
     num_cores = args.num_cores
+    if args.cache_db:
+        cache_db = os.path.abspath(args.cache_db)
+    else:
+        cache_db = None
 
     # Create necessary dirs
     create_dir(log_dir)
@@ -58,7 +92,7 @@ def main(argv):
 
     # Run functions :) Slow is as good as fast
     new_input_fasta = check_sequence(input_fasta)
-    run_pfam_scan(new_input_fasta, log_dir, num_cores)
+    run_pfam_scan(new_input_fasta, log_dir, num_cores, cache_db)
 
 
 # Define functions
@@ -81,20 +115,27 @@ def create_dir(log_dir):
 
 
 def check_sequence(input_fasta):
+    # Proteins are written in input order, so shards are the same across
+    # runs
     with open(input_fasta) as f_in:
         fasta = (line.rstrip() for line in f_in)
         fasta = list(line for line in fasta if line)
 
-    D = defaultdict(str)
+    D = defaultdict(list)
+    gene_names = []
     for line in fasta:
         if re.search('^>', line):
             gene_name = line.split('\t')[0].replace('>', '')
+            if gene_name not in D:
+                gene_names.append(gene_name)
+            D[gene_name]
             continue
-        D[gene_name] += line
+        D[gene_name].append(line)
 
     new_input_fasta = '{}_nonX'.format(input_fasta)
     outhandle = open(new_input_fasta, 'w')
-    for gene_name, seq in D.items():
+    for gene_name in gene_names:
+        seq = ''.join(D[gene_name])
         if 'X' in seq or '*' in seq:
             continue
         i = 0
@@ -107,27 +148,16 @@ def check_sequence(input_fasta):
     return new_input_fasta
 
 
-def run_pfam_scan(new_input_fasta, log_dir, num_cores):
-    # pfam_scan.pl -fasta Lenafn_TMI1502_1.faa -dir <pfam_db_dir> -cpu 10
-    # -outfile pfam_scan.out
-    pfam_scan_bin = D_conf['PFAM_SCAN_PATH']
-    pfam_db_dir = D_conf['PFAM_DB_PATH']
-
+def run_pfam_scan(new_input_fasta, log_dir, num_cores, cache_db=None):
     pfam_scan_out = '{}.pfam_scan'.format(os.path.splitext(new_input_fasta)[0])
 
-    log_file = os.path.join(log_dir, program_name, 'pfam_scan.log')
     logger_time.debug('START: Pfam Scan')
-    if not os.path.exists(pfam_scan_out):
-        command = (
-            '{} -fasta {} -dir {} -cpu {} -outfile {} > {} 2>&1'.format(
-                pfam_scan_bin, new_input_fasta, pfam_db_dir, num_cores,
-                pfam_scan_out, log_file
-            )
-        )
-        logger_txt.debug('[Run] {}'.format(command))
-        os.system(command)
-    else:
+    if os.path.exists(pfam_scan_out):
         logger_txt.debug('Running Pfam Scan has already been finished')
+    elif cache_db:
+        run_pfam_scan_cached(new_input_fasta, log_dir, num_cores, cache_db)
+    else:
+        search_pfam(new_input_fasta, pfam_scan_out, log_dir, num_cores)
     logger_time.debug('DONE : Pfam Scan')
 
     if not os.path.exists(pfam_scan_out):
@@ -137,5 +167,148 @@ def run_pfam_scan(new_input_fasta, log_dir, num_cores):
         sys.exit(2)
 
 
+def search_pfam(input_fasta, pfam_scan_out, log_dir, num_cores):
+    if num_cores <= 1:
+        log_file = os.path.join(log_dir, program_name, 'pfam_scan.log')
+        command = pfam_scan_command(
+            input_fasta, pfam_scan_out, num_cores, log_file
+        )
+        logger_txt.debug('[Run] {}'.format(command))
+        os.system(command)
+    else:
+        run_pfam_scan_shards(input_fasta, pfam_scan_out, log_dir, num_cores)
+
+
+def pfam_scan_command(input_fasta, pfam_scan_out, num_cpus, log_file):
+    # pfam_scan.pl -fasta Lenafn_TMI1502_1.faa -dir <pfam_db_dir> -cpu 10
+    # -outfile pfam_scan.out
+    pfam_scan_bin = D_conf['PFAM_SCAN_PATH']
+    pfam_db_dir = D_conf['PFAM_DB_PATH']
+    command = (
+        '{} -fasta {} -dir {} -cpu {} -outfile {} > {} 2>&1'.format(
+            pfam_scan_bin, input_fasta, pfam_db_dir, num_cpus,
+            pfam_scan_out, log_file
+        )
+    )
+    return command
+
+
+def run_pfam_scan_shard(args):
+    # Run in a worker process. Output is renamed from .tmp when finished
+    shard_fasta, shard_output, log_file = args
+    tmp_output = '{}.tmp'.format(shard_output)
+    if os.path.exists(tmp_output):
+        os.remove(tmp_output)  # pfam_scan.pl does not overwrite
+    command = pfam_scan_command(shard_fasta, tmp_output, 1, log_file)
+    return_code = subprocess.call(command, shell=True)
+    if return_code == 0 and os.path.exists(tmp_output):
+        os.rename(tmp_output, shard_output)
+    return shard_output, command, return_code
+
+
+def run_pfam_scan_shards(input_fasta, pfam_scan_out, log_dir, num_cores):
+    shard_dir = '{}_shards'.format(os.path.splitext(pfam_scan_out)[0])
+    stamp = '{}\n{}\n{}\n'.format(
+        pfam_scan_command('<input_fasta>', '<output>', 1, '<log_file>'),
+        fingerprint_path(D_conf['PFAM_DB_PATH']),
+        fingerprint_path(D_conf['PFAM_SCAN_PATH'])
+    )
+    check_stamp(shard_dir, stamp)
+
+    # Split proteins into shards of similar total length
+    seq_lengths = get_seq_lengths(input_fasta)
+    assignment = balance_shards(seq_lengths, num_cores * shards_per_core)
+    num_shards = max(assignment) + 1 if assignment else 0
+    shard_fastas = [
+        os.path.join(shard_dir, 'shard_{}.faa'.format(x))
+        for x in range(num_shards)
+    ]
+    shard_outputs = [
+        os.path.join(shard_dir, 'shard_{}.pfam_scan'.format(x))
+        for x in range(num_shards)
+    ]
+    changed = write_shards(input_fasta, assignment, shard_fastas)
+    for shard_fasta, shard_output in zip(shard_fastas, shard_outputs):
+        if shard_fasta in changed and glob(shard_output):
+            os.remove(shard_output)
+
+    # Run Pfam_scan on unfinished shards
+    jobs = [
+        (
+            shard_fastas[x], shard_outputs[x],
+            os.path.join(log_dir, program_name, 'pfam_scan_{}.log'.format(x))
+        )
+        for x in range(num_shards) if not glob(shard_outputs[x])
+    ]
+    logger_txt.debug(
+        '[Run] Pfam_scan on {} of {} shards with {} cores'.format(
+            len(jobs), num_shards, num_cores
+        )
+    )
+    if jobs:
+        pool = Pool(min(num_cores, len(jobs)))
+        try:
+            results = pool.map(run_pfam_scan_shard, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        for shard_output, command, return_code in results:
+            logger_txt.debug('[Run] {}'.format(command))
+            if return_code != 0 or not glob(shard_output):
+                logger_txt.debug('[ERROR] Pfam_scan failed on {}'.format(
+                    os.path.basename(shard_output)
+                ))
+                return
+
+    # Merge shard outputs in shard order, with the comment header of the
+    # first shard
+    tmp_output = '{}.tmp'.format(pfam_scan_out)
+    outhandle = open(tmp_output, 'w')
+    with open(shard_outputs[0]) as f_in:
+        for line in f_in:
+            if line.startswith('#'):
+                outhandle.write(line)
+    outhandle.write('\n')
+    for shard_output in shard_outputs:
+        with open(shard_output) as f_in:
+            for line in f_in:
+                if line.startswith('#') or not line.strip():
+                    continue
+                outhandle.write(line)
+    outhandle.close()
+    os.rename(tmp_output, pfam_scan_out)
+
+
+def run_pfam_scan_cached(new_input_fasta, log_dir, num_cores, cache_db):
+    # Search only the proteins missing from the cache
+    input_base = os.path.splitext(new_input_fasta)[0]
+    pfam_scan_out = '{}.pfam_scan'.format(input_base)
+    miss_fasta = '{}.pfam_miss.faa'.format(input_base)
+    miss_output = '{}.pfam_miss.pfam_scan'.format(input_base)
+    D_cache = open_cache(
+        cache_db, program_name,
+        [D_conf['PFAM_DB_PATH'], D_conf['PFAM_SCAN_PATH']], ''
+    )
+    records, D_result, num_misses = split_cached(
+        D_cache, new_input_fasta, miss_fasta
+    )
+    logger_txt.debug('[Cache] {} of {} proteins found in {}'.format(
+        len(records) - num_misses, len(records), cache_db
+    ))
+    header = fetch_header(D_cache)
+    if num_misses:
+        if os.path.exists(miss_output):
+            os.remove(miss_output)
+        search_pfam(miss_fasta, miss_output, log_dir, num_cores)
+        if not os.path.exists(miss_output):
+            close_cache(D_cache)
+            return
+        header = add_results(
+            D_cache, records, miss_fasta, miss_output, D_result
+        )
+    close_cache(D_cache)
+    write_results(records, D_result, pfam_scan_out, header)
+
+
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -0,0 +1,200 @@
+#!/usr/bin/env python2
+
+'''
+Run FunGAP stages as a dependency graph
+
+Each stage declares the stages it depends on and how many cores (and how
+much memory) it can use. A stage is started as soon as all of its
+dependencies are finished and resource_broker.py grants it a lease, so
+independent tools (e.g. RepeatModeler and Trinity, or BUSCO, BLASTp and
+Pfam_scan) run side by side within the --num_cores budget.
+
+Stage function is called as func(D_result, num_cores) where D_result holds
+the return values of finished stages keyed by stage name and num_cores is
+the number of cores leased to the stage.
+
+With a checkpoint (checkpoint.py), a stage whose input files (its
+dependencies' outputs plus its own declared inputs), parameters and tools
+did not change since the last run is skipped and returns its recorded result.
+'''
+
+# Import modules
+import os
+import sys
+import time
+import threading
+from collections import namedtuple
+
+this_path = os.path.realpath(__file__)
+this_dir = os.path.dirname(this_path)
+sys.path.append(this_dir)
+from resource_broker import (
+    init_broker, share_cores, grant_lease, release_lease
+)
+from checkpoint import (
+    stage_key, find_checkpoint, clear_outputs, record_checkpoint
+)
+
+Stage = namedtuple(
+    'Stage', [
+        'name', 'func', 'deps', 'min_cores', 'max_cores', 'memory',
+        'inputs', 'params', 'tools', 'work_dirs'
+    ]
+)
+
+
+def make_stage(
+    name, func, deps=(), min_cores=1, max_cores=1, memory=0, inputs=(),
+    params=None, tools=(), work_dirs=()
+):
+    # memory: GB the stage needs while running (0: not accounted)
+    # inputs: input files not produced by other stages
+    # params: parameters changing the output; tools: program files used
+    # work_dirs: intermediate directories (shards, batches) removed with the
+    # outputs when the stage is stale
+    return Stage(
+        name, func, tuple(deps), max(1, min_cores), max(1, max_cores), memory,
+        tuple(inputs), params or {}, tuple(tools), tuple(work_dirs)
+    )
+
+
+def check_stages(stages):
+    D_stage = {}
+    for stage in stages:
+        if stage.name in D_stage:
+            sys.exit('[ERROR] Duplicated stage name: {}'.format(stage.name))
+        D_stage[stage.name] = stage
+
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in D_stage:
+                sys.exit('[ERROR] Stage {} depends on unknown stage {}'.format(
+                    stage.name, dep
+                ))
+
+
+def run_checkpointed(stage, D_result, num_cores, D_checkpoint, logger_txt):
+    inputs = [D_result[x] for x in stage.deps] + list(stage.inputs)
+    key = stage_key(
+        D_checkpoint, stage.name, inputs, stage.params, stage.tools,
+        stage.deps
+    )
+    done, result = find_checkpoint(D_checkpoint, stage.name, key)
+    if done:
+        logger_txt.debug(
+            '[Checkpoint] {} is up to date, skipped'.format(stage.name)
+        )
+        return result
+
+    for path in clear_outputs(
+        D_checkpoint, stage.name, inputs, stage.work_dirs
+    ):
+        logger_txt.debug('[Checkpoint] Removed stale {}'.format(path))
+    result = stage.func(D_result, num_cores)
+    record_checkpoint(D_checkpoint, stage.name, key, result)
+    return result
+
+
+def run_stages(
+    stages, num_cores, logger_time, logger_txt, max_memory=None,
+    D_checkpoint=None
+):
+    check_stages(stages)
+
+    D_broker = init_broker(num_cores, max_memory)
+    D_result = {}
+    D_ready_time = {}
+    finished = set()
+    running = {}
+    errors = []
+    pending = list(stages)  # Declaration order is the launch priority
+    cond = threading.Condition()
+
+    def run_stage(stage, lease):
+        try:
+            if D_checkpoint is None:
+                result = stage.func(D_result, lease.cores)
+            else:
+                result = run_checkpointed(
+                    stage, D_result, lease.cores, D_checkpoint, logger_txt
+                )
+        except (Exception, SystemExit):
+            with cond:
+                errors.append((stage.name, sys.exc_info()))
+        else:
+            with cond:
+                D_result[stage.name] = result
+                finished.add(stage.name)
+        finally:
+            with cond:
+                release_lease(D_broker, lease)
+                del running[stage.name]
+                logger_txt.debug('[Scheduler] Finished {}'.format(stage.name))
+                cond.notify_all()
+
+    with cond:
+        while pending or running:
+            if errors:
+                # Let running stages finish, but do not start new ones
+                if not running:
+                    break
+                cond.wait()
+                continue
+
+            ready = [
+                x for x in pending if all(y in finished for y in x.deps)
+            ]
+            now = time.time()
+            for stage in ready:
+                D_ready_time.setdefault(stage.name, now)
+
+            shares = share_cores(
+                D_broker, [(x.min_cores, x.max_cores) for x in ready]
+            )
+            launched = False
+            for stage, cores in zip(ready, shares):
+                lease = grant_lease(
+                    D_broker, cores, stage.memory, not running
+                )
+                if lease is None:
+                    continue
+
+                pending.remove(stage)
+                running[stage.name] = lease
+                waited = now - D_ready_time[stage.name]
+                if waited >= 1:
+                    logger_txt.debug(
+                        '[Scheduler] {} waited {}s for its lease'.format(
+                            stage.name, int(waited)
+                        )
+                    )
+                logger_txt.debug(
+                    '[Scheduler] Start {} with {} cores{} ({} cores free)'
+                    .format(
+                        stage.name, lease.cores,
+                        ' and {}G memory'.format(lease.memory)
+                        if lease.memory else '',
+                        D_broker['cores']
+                    )
+                )
+                thread = threading.Thread(
+                    target=run_stage, args=(stage, lease), name=stage.name
+                )
+                thread.start()
+                launched = True
+
+            if launched:
+                continue
+            if not running:
+                sys.exit(
+                    '[ERROR] Cannot schedule stages (circular dependency?): '
+                    '{}'.format(', '.join(x.name for x in pending))
+                )
+            cond.wait()
+
+    if errors:
+        stage_name, exc_info = errors[0]
+        logger_time.debug('[ERROR] Stage {} failed'.format(stage_name))
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+    return D_result